@@ -1,17 +1,96 @@
 # coding: utf-8
 
+import json
 from typing import Literal
+
+import cachetools
 from aiocouch import CouchDB, Database, Document
-from aiocouch.exception import NotFoundError
+from aiocouch.exception import ConflictError, NotFoundError
+from aiocouch.view import View
 from aiogram.types import Chat, Message, User
 from loguru import logger
 
 import utils
 from config import config
+from consts import DOCUMENT_CACHE_MAX_SIZE, DOCUMENT_CACHE_TTL
 
 
 couchdb: CouchDB | None = None
 DB: Database | None = None
+_document_cache: cachetools.TTLCache[str, "CachedDocument"] = cachetools.TTLCache(DOCUMENT_CACHE_MAX_SIZE, DOCUMENT_CACHE_TTL)
+
+class CachedDocument(Document):
+	"""
+	Документ из БД, который хранится в кэше документов (см. `get_document`). При сохранении документ обновляется в кэше, а при удалении или конфликте — удаляется из него.
+	"""
+
+	async def save(self):
+		try:
+			response = await super().save()
+		except ConflictError:
+			# Документ в кэше устарел, поэтому при следующем запросе он будет загружен заново.
+			_document_cache.pop(self.id, None)
+
+			raise
+
+		_document_cache[self.id] = self
+
+		return response
+
+	async def delete(self, discard_changes: bool = False):
+		_document_cache.pop(self.id, None)
+
+		return await super().delete(discard_changes=discard_changes)
+
+def invalidate_document(id: str) -> None:
+	"""
+	Удаляет документ из кэша документов. Необходимо вызывать, если документ был изменён в обход кэша (например, через `db.docs()`), что бы при следующем запросе он был загружен из БД заново.
+
+	:param id: ID документа.
+	"""
+
+	_document_cache.pop(id, None)
+
+def cache_document(doc: Document) -> CachedDocument:
+	"""
+	Возвращает документ из кэша документов. Если документа в кэше нет, то в кэш добавляется переданный документ, загруженный в обход кэша (например, через `db.docs()`), без повторного запроса к БД.
+
+	:param doc: Документ, загруженный из БД.
+	"""
+
+	cached = _document_cache.get(doc.id)
+	if cached is not None:
+		return cached
+
+	cached = CachedDocument(doc._database, doc.id)
+	cached._update_cache(doc._data)
+	_document_cache[doc.id] = cached
+
+	return cached
+
+async def get_document(id: str) -> CachedDocument | None:
+	"""
+	Возвращает документ из БД по его ID, используя кэш документов. Возвращает None, если документ не был найден.
+
+	Поскольку кэш возвращает один и тот же объект документа, изменения в документе видны всем его пользователям, а сохранение через `save()` обновляет и БД, и кэш.
+
+	:param id: ID документа.
+	"""
+
+	doc = _document_cache.get(id)
+	if doc is not None:
+		return doc
+
+	doc = CachedDocument(await get_db(), id)
+
+	try:
+		await doc.fetch(discard_changes=True)
+	except NotFoundError:
+		return None
+
+	_document_cache[id] = doc
+
+	return doc
 
 async def get_db(db_name: str | None = None, check_auth: bool = False, force_new: bool = False) -> Database:
 	"""
@@ -54,12 +133,13 @@ async def get_db(db_name: str | None = None, check_auth: bool = False, force_new
 
 	return DB
 
-async def get_user(user: User, create_by_default: bool = True) -> Document:
+async def get_user(user: User, create_by_default: bool = True, document: Document | None = None) -> Document:
 	"""
 	Возвращает данные пользователя из базы данных.
 
 	:param user: Пользователь, информацию о котором нужно получить.
 	:param create_by_default: Создавать ли пользователя, если он не был найден в базе данных?
+	:param document: Документ пользователя, уже загруженный из БД. Если передан, то повторный запрос к БД не делается.
 	"""
 
 	assert not user.is_bot, "Попытка получить информацию из БД (метод get_user()) о боте"
@@ -69,22 +149,19 @@ async def get_user(user: User, create_by_default: bool = True) -> Document:
 	id = str(user.id)
 
 	async def _get():
-		try:
-			return await db["user_" + id]
-		except NotFoundError:
-			if not create_by_default:
-				raise NotFoundError(f"Пользователь с ID {id} не был найден в базе данных")
-
-			# Пользователь не был найден, поэтому мы создаем его.
-			user_db = await db.create(
-				"user_" + id,
-				exists_ok=False,
-				data=get_default_user(user)
-			)
-			await user_db.save()
-
+		user_db = cache_document(document) if document is not None else await get_document("user_" + id)
+		if user_db is not None:
 			return user_db
 
+		if not create_by_default:
+			raise NotFoundError(f"Пользователь с ID {id} не был найден в базе данных")
+
+		# Пользователь не был найден, поэтому мы создаем его.
+		user_db = CachedDocument(db, "user_" + id, data=get_default_user(user))
+		await user_db.save()
+
+		return user_db
+
 	user_db = await _get()
 	if user_db["DocVer"] == utils.get_bot_version():
 		return user_db
@@ -105,32 +182,6 @@ async def get_user(user: User, create_by_default: bool = True) -> Document:
 	await user_db.save()
 	return user_db
 
-async def get_attachment_cache(service: str, create_by_default: bool = True) -> Document:
-	"""
-	Возвращает запись из БД, хранимую в себе кэш вложений определённого сервиса.
-
-	:param service: Сервис, кэш вложений которого должен быть возвращён.
-	:param create_by_default: Если равен `True`, то будет произведена запись если она не была найдена, в противном случае будет вызвана ошибка.
-	"""
-
-	db = await get_db()
-
-	try:
-		return await db[f"global_attchcache_{service}"]
-	except NotFoundError:
-		if not create_by_default:
-			raise NotFoundError(f"Запись кэша вложений для сервиса {service} не была найдена в БД")
-
-		# Запись кэша вложений не была найдена, поэтому создаём её.
-		cache_db = await db.create(
-			f"global_attchcache_{service}",
-			exists_ok=False,
-			data=get_default_attachment_cache(service)
-		)
-		await cache_db.save()
-
-		return cache_db
-
 def get_default_user(user: User, version: int = utils.get_bot_version()) -> dict:
 	"""
 	Возвращает шаблон пользователя для сохранения в базу данных.
@@ -153,33 +204,132 @@ def get_default_user(user: User, version: int = utils.get_bot_version()) -> dict
 		}
 	}
 
-def get_default_attachment_cache(service: str, version: int = utils.get_bot_version()) -> dict:
+def get_attachment_id(service: str, key: str) -> str:
+	"""
+	Возвращает ID документа в БД, в котором хранится кэшированное вложение.
+
+	:param service: Сервис, с которым ассоциировано вложение.
+	:param key: Захешированный ключ вложения.
+	"""
+
+	return f"attch_{service}_{key}"
+
+def get_default_attachment(service: str, key: str, value: str, version: int = utils.get_bot_version()) -> dict:
 	"""
-	Возвращает шаблон записи для кэша вложений сервиса.
+	Возвращает шаблон записи для кэшированного вложения.
 
-	:param service: Сервис, для которого должен быть создан шаблон кэша вложений.
+	:param service: Сервис, с которым ассоциировано вложение.
+	:param key: Захешированный ключ вложения.
+	:param value: Зашифрованное значение вложения.
 	"""
 
 	return {
 		"DocVer": version,
-		"Service": service,
-		"Attachments": {}
+		"Service": service, # Сервис, с которым ассоциировано вложение.
+		"Key": key, # Ключ вложения, захешированный при помощи SHA-256.
+		"Value": value # Значение вложения, зашифрованное оригинальным ключом.
 	}
 
-async def get_group(chat: int | Chat) -> Document | None:
+def get_message_mapping_id(service: str, service_owner_id: int, service_message_id: int) -> str:
 	"""
-	Возвращает информацию о группе из базы данных. Учтите, что данный метод не создаёт группу, если она не была найдена.
+	Возвращает ID документа в БД, в котором хранится связь ID сообщений в Telegram и в сервисе.
+
+	:param service: Сервис, через который было отправлено сообщение.
+	:param service_owner_id: ID пользователя сервиса, который связан с этим сообщением.
+	:param service_message_id: ID (первого) сообщения в сервисе.
+	"""
+
+	return f"msgmap_{service}_{service_owner_id}_{service_message_id}"
+
+MESSAGE_MAPPING_VIEW_MAP = """function (doc) {
+	if (doc._id.indexOf("msgmap_") !== 0) {
+		return;
+	}
+
+	["TelegramIDs", "ServiceIDs", "ConversationIDs"].forEach(function (field) {
+		(doc[field] || []).forEach(function (id) {
+			emit([doc.Service, doc.OwnerID, field, id], null);
+		});
+	});
+}"""
+"""Map-функция view, по которому ищутся связи ID сообщений. Для каждого ID сообщения создаётся отдельная запись с ключом вида `[сервис, ID пользователя сервиса, поле, ID сообщения]`."""
+
+async def create_message_mapping_view() -> None:
+	"""
+	Создаёт (либо обновляет) view в БД, используемый для поиска связей ID сообщений по ID сообщения. В отличие от Mango-запроса с `$elemMatch`, поиск по ключу view не перебирает все связи пользователя.
 	"""
 
 	db = await get_db()
 
-	async def _get():
-		try:
-			return await db[f"group_{chat.id if isinstance(chat, Chat) else chat}"]
-		except NotFoundError:
-			return None
+	ddoc = await db.design_doc("msgmap-ids", exists_ok=True)
+	await ddoc.create_view("by-id", MESSAGE_MAPPING_VIEW_MAP, exists_ok=True)
+
+async def find_message_mapping(service: str, service_owner_id: int, field: Literal["TelegramIDs", "ServiceIDs", "ConversationIDs"], message_id: int) -> Document | None:
+	"""
+	Ищет в БД документ связи ID сообщений, у которого в поле `field` есть ID `message_id`. Возвращает None, если такой записи нет.
+
+	:param service: Сервис, через который было отправлено сообщение.
+	:param service_owner_id: ID пользователя сервиса, который связан с этим сообщением.
+	:param field: Поле, в котором производится поиск.
+	:param message_id: ID сообщения.
+	"""
+
+	db = await get_db()
+
+	response = await View(db, "msgmap-ids", "by-id").get(key=json.dumps([service, service_owner_id, field, message_id]), include_docs=True, limit=1)
+	for doc in response.docs():
+		return doc
+
+	return None
+
+def get_default_message_mapping(service: str, service_owner_id: int, telegram_message_ids: list[int], service_message_ids: list[int], service_conversation_message_ids: list[int] | None, sent_via_bot: bool, version: int = utils.get_bot_version()) -> dict:
+	"""
+	Возвращает шаблон записи связи ID сообщений в Telegram и в сервисе.
+	"""
+
+	return {
+		"DocVer": version,
+
+		"Service": service, # Сервис, через который было отправлено сообщение.
+		"OwnerID": service_owner_id, # ID пользователя сервиса, связанного с сообщением.
+		"TelegramIDs": telegram_message_ids, # ID сообщения(-ий) в Telegram.
+		"ServiceIDs": service_message_ids, # ID сообщения(-ий) в сервисе.
+		"ConversationIDs": service_conversation_message_ids, # ID сообщения(-ий) в сервисе относительно беседы.
+		"SentViaBot": sent_via_bot, # Отправлено ли сообщение через бота.
+		"CreatedAt": utils.get_timestamp() # Дата сохранения записи.
+	}
+
+def get_longpoll_checkpoint_id(service: str, service_owner_id: int) -> str:
+	"""
+	Возвращает ID документа в БД, в котором хранится последняя обработанная позиция longpoll'а пользователя сервиса.
+
+	:param service: Сервис, с которым связан longpoll.
+	:param service_owner_id: ID пользователя сервиса.
+	"""
+
+	return f"lpcheckpoint_{service}_{service_owner_id}"
+
+def get_default_longpoll_checkpoint(service: str, service_owner_id: int, ts: int, pts: int | None, version: int = utils.get_bot_version()) -> dict:
+	"""
+	Возвращает шаблон записи последней обработанной позиции longpoll'а.
+	"""
+
+	return {
+		"DocVer": version,
+
+		"Service": service, # Сервис, с которым связан longpoll.
+		"OwnerID": service_owner_id, # ID пользователя сервиса.
+		"TS": ts, # Последний обработанный ts longpoll'а.
+		"PTS": pts, # Последний обработанный pts longpoll'а, используется для получения пропущенных событий.
+		"UpdatedAt": utils.get_timestamp() # Дата обновления записи.
+	}
+
+async def get_group(chat: int | Chat) -> Document | None:
+	"""
+	Возвращает информацию о группе из базы данных. Учтите, что данный метод не создаёт группу, если она не была найдена.
+	"""
 
-	group_db = await _get()
+	group_db = await get_document(f"group_{chat.id if isinstance(chat, Chat) else chat}")
 	if group_db is None or group_db["DocVer"] == utils.get_bot_version():
 		return group_db
 
@@ -2,12 +2,16 @@
 
 import asyncio
 import base64
+import bisect
 import random
-from typing import Any, Literal, Sequence, cast
+import sys
+from collections import OrderedDict
+from typing import Any, Callable, Iterator, Literal, Sequence, cast
 
 import aiohttp
 import cachetools
 from aiocouch import Document, NotFoundError
+from aiocouch.bulk import BulkOperation
 from aiogram import Bot
 from aiogram.exceptions import (TelegramAPIError, TelegramBadRequest,
                                 TelegramForbiddenError)
@@ -28,7 +32,14 @@ from pyrate_limiter.limiter import Limiter
 
 import utils
 from config import config
-from DB import get_attachment_cache, get_db, get_default_subgroup, get_group
+from consts import (DB_WRITE_FLUSH_BATCH_SIZE, DB_WRITE_FLUSH_INTERVAL,
+                    MESSAGE_MAPPING_NEGATIVE_CACHE_TTL,
+                    QUEUE_WAIT_HISTOGRAM_BUCKETS)
+from DB import (find_message_mapping, get_attachment_id, get_db,
+                get_default_attachment, get_default_longpoll_checkpoint,
+                get_default_message_mapping, get_default_subgroup,
+                get_document, get_group, get_longpoll_checkpoint_id,
+                get_message_mapping_id)
 from DB import get_user as db_get_user
 from exceptions import DisallowedInDebugException
 from services.service_api_base import BaseTelehooperServiceAPI, ServiceDialogue
@@ -38,10 +49,18 @@ from settings import SETTINGS_TREE, SettingsHandler
 
 # Да, я знаю что это плохой способ. Знаю. Ни к чему другому, адекватному я не пришёл.
 _saved_connections = {}
-_service_dialogues: list["TelehooperSubGroup"] = []
-_cached_message_ids: dict[int, list["TelehooperMessage"]] = {}
-_cached_attachments: list["TelehooperCachedAttachment"] = []
+_service_dialogues: "TelehooperSubGroupRegistry" # Создаётся после объявления класса.
+_cached_message_ids: "TelehooperMessageStorage" # Создаётся после объявления класса.
+_pending_message_writes: dict[str, tuple[int, "TelehooperMessage"] | None] = {}
+_missing_message_ids: cachetools.TTLCache[tuple[str, str, int, int], bool] = cachetools.TTLCache(10000, MESSAGE_MAPPING_NEGATIVE_CACHE_TTL)
+_db_flush_event = asyncio.Event()
+_db_flush_task: asyncio.Task | None = None
+_cached_attachments: dict[tuple[str, str], "TelehooperCachedAttachment"] = {}
+_pending_attachment_writes: dict[str, "TelehooperCachedAttachment | None"] = {}
+_pending_checkpoint_writes: dict[str, tuple[str, int, int, int | None] | None] = {}
 _media_group_messages: dict[str, list] = {}
+_group_limiters: dict[tuple[int, int], Limiter] = {}
+_queue_wait_histogram: dict[int, list[int]] = {}
 _start_timestamp = utils.get_timestamp()
 
 settings = SettingsHandler(SETTINGS_TREE)
@@ -289,9 +308,6 @@ class TelehooperGroup:
 	bot: Bot
 	"""Объект "главного" бота Telehooper в Telegram."""
 
-	limiter: Limiter
-	"""Лимитер для этой группы."""
-
 	def __init__(self, creator: TelehooperUser, document: Document, chat: Chat, bot: Bot) -> None:
 		"""
 		Инициализирует объект группы.
@@ -309,10 +325,6 @@ class TelehooperGroup:
 
 		self._parse_document(document)
 
-		# 1 сообщение в секунду,
-		# 20 сообщений в минуту.
-		self.limiter = Limiter([Rate(1, 1), Rate(20, 60)])
-
 	def _parse_document(self, group: Document) -> None:
 		"""
 		Парсит значение документа группы в объект группы.
@@ -345,17 +357,37 @@ class TelehooperGroup:
 
 		return self.document
 
-	async def acquire_queue(self, key: str, max_delay: int | float | None = None) -> bool:
+	def get_limiter(self, bot_id: int) -> Limiter:
+		"""
+		Возвращает лимитер для отправки сообщений в эту группу указанным ботом. Лимитеры хранятся глобально (по паре из ID группы и ID бота), поэтому все объекты этой группы используют один и тот же лимитер.
+
+		:param bot_id: ID бота (или минибота), который отправляет сообщения.
+		"""
+
+		key = (self.chat.id, bot_id)
+
+		limiter = _group_limiters.get(key)
+		if not limiter:
+			# 1 сообщение в секунду,
+			# 20 сообщений в минуту.
+			limiter = _group_limiters[key] = Limiter([Rate(1, 1), Rate(20, 60)])
+
+		return limiter
+
+	async def acquire_queue(self, bot_id: int, max_delay: int | float | None = None) -> bool:
 		"""
 		Пытается получить место в очереди. Если место не было получено, то бот будет спать до тех пор, пока не получит место. Возвращает `True`, если место было получено, иначе `False`, если места вообще нет.
 
-		:param key: Ключ, по которому нужно получить место в очереди.
+		:param bot_id: ID бота (или минибота), для которого нужно получить место в очереди.
 		:param max_delay: Максимальное время ожидания в секундах. Если ожидание превысит это время, то метод вернёт `False`.
 		"""
 
+		limiter = self.get_limiter(bot_id)
+		waited = 0.0
+
 		while True:
 			try:
-				self.limiter.try_acquire(key)
+				limiter.try_acquire(str(bot_id))
 			except BucketFullException as err:
 				delay_time = float(err.meta_info["remaining_time"])
 
@@ -364,7 +396,10 @@ class TelehooperGroup:
 					return False
 
 				await asyncio.sleep(delay_time)
+				waited += delay_time
 			else:
+				TelehooperAPI.record_queue_wait(bot_id, waited)
+
 				return True
 
 	async def convert_to_dialogue_group(self, user: TelehooperUser, dialogue: ServiceDialogue, pinned_message: Message, serviceAPI: BaseTelehooperServiceAPI) -> None:
@@ -546,7 +581,7 @@ class TelehooperGroup:
 
 		bot = await self.get_associated_bot(sender_id)
 
-		if not bypass_queue and not await self.acquire_queue(f"message-{bot.id}"):
+		if not bypass_queue and not await self.acquire_queue(bot.id):
 			return None
 
 		return [await bot.send_sticker(
@@ -573,7 +608,7 @@ class TelehooperGroup:
 
 		bot = await self.get_associated_bot(sender_id)
 
-		if not bypass_queue and not await self.acquire_queue(f"message-{bot.id}"):
+		if not bypass_queue and not await self.acquire_queue(bot.id):
 			return None
 
 		return [await bot.send_location(
@@ -600,7 +635,7 @@ class TelehooperGroup:
 
 		bot = await self.get_associated_bot(sender_id)
 
-		if not bypass_queue and not await self.acquire_queue(f"message-{bot.id}"):
+		if not bypass_queue and not await self.acquire_queue(bot.id):
 			return None
 
 		return [await bot.send_video_note(
@@ -612,7 +647,7 @@ class TelehooperGroup:
 			allow_sending_without_reply=True
 		)]
 
-	async def send_message(self, text: str, attachments: list[InputMediaAudio | InputMediaDocument | InputMediaPhoto | InputMediaVideo] | None = None, reply_to: int | None = None, topic: int = 0, silent: bool = False, keyboard: InlineKeyboardMarkup | None = None, disable_web_preview: bool = False, web_preview_url: str | None = None, sender_id: int | None = None, bypass_queue: bool = False) -> list[int] | None:
+	async def send_message(self, text: str, attachments: list[InputMediaAudio | InputMediaDocument | InputMediaPhoto | InputMediaVideo] | None = None, reply_to: int | None = None, topic: int = 0, silent: bool = False, keyboard: InlineKeyboardMarkup | None = None, disable_web_preview: bool = False, web_preview_url: str | None = None, sender_id: int | None = None, bypass_queue: bool = False, on_sent: Callable[[Bot, list[Message]], None] | None = None) -> list[int] | None:
 		"""
 		Отправляет сообщение в группу. Возвращает ID отправленного(-ых) сообщений.
 
@@ -626,11 +661,12 @@ class TelehooperGroup:
 		:param web_preview_url: URL страницы, для которой должен быть сделан превью ссылки. Работает лишь в случае, если disable_web_preview = False.
 		:param sender_id: ID пользователя, с которым должен быть найден ассоциированный минибот.
 		:param bypass_queue: Отправить ли сообщение без учёта очереди.
+		:param on_sent: Функция, вызываемая с ботом, отправившим сообщение, и отправленными сообщениями. Используется, к примеру, для кэширования `file_id` отправленных вложений.
 		"""
 
 		bot = await self.get_associated_bot(sender_id)
 
-		if not bypass_queue and not await self.acquire_queue(f"message-{bot.id}"):
+		if not bypass_queue and not await self.acquire_queue(bot.id):
 			return None
 
 		if not attachments:
@@ -643,29 +679,34 @@ class TelehooperGroup:
 
 		# У нас есть хотя бы одно вложение, отправляем как медиа-группу.
 		if attachments:
-			return [i.message_id for i in await bot.send_media_group(
+			sent_messages = await bot.send_media_group(
 				chat_id=self.chat.id,
 				media=attachments,
 				message_thread_id=topic,
 				reply_to_message_id=reply_to,
 				disable_notification=silent,
 				allow_sending_without_reply=True
+			)
+		else:
+			# Вложений нету, отправляем как сообщение без вложений.
+			sent_messages = [await bot.send_message(
+				chat_id=self.chat.id,
+				message_thread_id=topic,
+				reply_to_message_id=reply_to,
+				text=text,
+				disable_notification=silent,
+				allow_sending_without_reply=True,
+				reply_markup=keyboard,
+				link_preview_options=LinkPreviewOptions(
+					is_disabled=disable_web_preview,
+					url=web_preview_url
+				)
 			)]
 
-		# Вложений нету, отправляем как сообщение без вложений.
-		return [(await bot.send_message(
-			chat_id=self.chat.id,
-			message_thread_id=topic,
-			reply_to_message_id=reply_to,
-			text=text,
-			disable_notification=silent,
-			allow_sending_without_reply=True,
-			reply_markup=keyboard,
-			link_preview_options=LinkPreviewOptions(
-				is_disabled=disable_web_preview,
-				url=web_preview_url
-			)
-		)).message_id]
+		if on_sent:
+			on_sent(bot, sent_messages)
+
+		return [i.message_id for i in sent_messages]
 
 	async def start_activity(self, type: Literal["typing", "upload_photo", "record_video", "upload_video", "record_audio", "upload_audio", "upload_document", "find_location", "record_video_note", "upload_video_note"] = "typing", topic: int = 0, sender_id: int | None = None, bypass_queue: bool = False) -> None:
 		"""
@@ -679,7 +720,7 @@ class TelehooperGroup:
 
 		bot = await self.get_associated_bot(sender_id)
 
-		if not bypass_queue and not await self.acquire_queue(f"message-{bot.id}"):
+		if not bypass_queue and not await self.acquire_queue(bot.id):
 			return None
 
 		await bot.send_chat_action(
@@ -701,7 +742,7 @@ class TelehooperGroup:
 
 		bot = await self.get_associated_bot(sender_id)
 
-		if not bypass_queue and not await self.acquire_queue(f"message-{bot.id}"):
+		if not bypass_queue and not await self.acquire_queue(bot.id):
 			return None
 
 		try:
@@ -731,7 +772,7 @@ class TelehooperGroup:
 
 		bot = await self.get_associated_bot(sender_id)
 
-		if not bypass_queue and not await self.acquire_queue(f"message-{bot.id}"):
+		if not bypass_queue and not await self.acquire_queue(bot.id):
 			return None
 
 		if isinstance(id, int):
@@ -805,13 +846,15 @@ class TelehooperGroup:
 		Возвращает список сервис-диалогов, связанных с данной группой.
 		"""
 
-		return [i for i in TelehooperAPI.get_all_subgroups() if i.parent.chat.id == self.chat.id]
+		return TelehooperAPI.get_subgroups_by_chat_id(self.chat.id)
 
 class TelehooperMessage:
 	"""
 	Класс, описывающий сообщение отправленного через Telehooper. Данный класс предоставляет доступ к ID сообщения в сервисе и в Telegram, а так же прочую информацию.
 	"""
 
+	__slots__ = ("service", "telegram_message_ids", "service_message_ids", "service_conversation_message_ids", "sent_via_bot")
+
 	service: str
 	"""Название сервиса, через который было отправлено сообщение."""
 	telegram_message_ids: list[int]
@@ -840,6 +883,204 @@ class TelehooperMessage:
 		self.service_conversation_message_ids = [service_conv_mids] if isinstance(service_conv_mids, int) else service_conv_mids
 		self.sent_via_bot = sent_via_bot
 
+	def estimate_size(self) -> int:
+		"""
+		Возвращает примерный размер данного объекта в памяти (в байтах), включая записи в индексах `TelehooperMessageStorage`.
+		"""
+
+		size = sys.getsizeof(self)
+		for mids in (self.telegram_message_ids, self.service_message_ids, self.service_conversation_message_ids):
+			if mids is None:
+				continue
+
+			# Сам список, int'ы внутри него, а так же ключ-tuple и слот в индексе для каждого ID.
+			size += sys.getsizeof(mids) + len(mids) * (28 + 64 + 32)
+
+		return size
+
+class TelehooperMessageStorage:
+	"""
+	Хранилище сохранённых сообщений (`TelehooperMessage`). Помимо списка сообщений для каждого пользователя сервиса хранит хэш-индексы по ID сообщения в Telegram, ID сообщения в сервисе и ID сообщения беседы в сервисе, благодаря чему поиск сообщения не зависит от количества сохранённых сообщений.
+
+	Размер хранилища ограничен как для каждого пользователя сервиса, так и в целом. При превышении лимита удаляются давно не использованные (LRU) сообщения.
+	"""
+
+	max_per_owner: int
+	"""Максимальное количество сообщений для одного пользователя сервиса. `0` — без ограничений."""
+	max_total: int
+	"""Максимальное количество сообщений во всём хранилище. `0` — без ограничений."""
+	evicted: int
+	"""Количество сообщений, которые были удалены из хранилища из-за превышения лимитов."""
+	size_bytes: int
+	"""Примерный размер всех хранимых сообщений в памяти, в байтах."""
+
+	_messages: dict[int, OrderedDict[TelehooperMessage, None]]
+	"""Сообщения, сгруппированные по ID пользователя сервиса, в порядке от давно использованных к недавно использованным."""
+	_lru: OrderedDict[TelehooperMessage, int]
+	"""Все сообщения хранилища и ID их владельцев, в порядке от давно использованных к недавно использованным."""
+	_telegram_index: dict[tuple[str, int, int], TelehooperMessage]
+	"""Индекс вида `(сервис, ID владельца, ID сообщения в Telegram)`."""
+	_service_index: dict[tuple[str, int, int], TelehooperMessage]
+	"""Индекс вида `(сервис, ID владельца, ID сообщения в сервисе)`."""
+	_conversation_index: dict[tuple[str, int, int], TelehooperMessage]
+	"""Индекс вида `(сервис, ID владельца, ID сообщения беседы в сервисе)`."""
+
+	def __init__(self, max_per_owner: int = 0, max_total: int = 0) -> None:
+		"""
+		Инициализирует пустое хранилище сообщений.
+
+		:param max_per_owner: Максимальное количество сообщений для одного пользователя сервиса. `0` — без ограничений.
+		:param max_total: Максимальное количество сообщений во всём хранилище. `0` — без ограничений.
+		"""
+
+		self.max_per_owner = max_per_owner
+		self.max_total = max_total
+		self.evicted = 0
+		self.size_bytes = 0
+
+		self._messages = {}
+		self._lru = OrderedDict()
+		self._telegram_index = {}
+		self._service_index = {}
+		self._conversation_index = {}
+
+	def _get_indexes(self, message: TelehooperMessage) -> list[tuple[dict[tuple[str, int, int], TelehooperMessage], list[int]]]:
+		"""
+		Возвращает список из пар вида `(индекс, ID сообщений для этого индекса)` для указанного сообщения.
+
+		:param message: Сообщение.
+		"""
+
+		return [
+			(self._telegram_index, message.telegram_message_ids),
+			(self._service_index, message.service_message_ids),
+			(self._conversation_index, message.service_conversation_message_ids or [])
+		]
+
+	def _touch(self, message: TelehooperMessage | None) -> TelehooperMessage | None:
+		"""
+		Помечает сообщение как недавно использованное, и возвращает его.
+
+		:param message: Сообщение.
+		"""
+
+		if message is None:
+			return None
+
+		owner_id = self._lru[message]
+
+		self._lru.move_to_end(message)
+		self._messages[owner_id].move_to_end(message)
+
+		return message
+
+	def add(self, service_owner_id: int, message: TelehooperMessage) -> None:
+		"""
+		Добавляет сообщение в хранилище, обновляя все индексы. Если после добавления превышен лимит, то давно не использованные сообщения будут удалены.
+
+		:param service_owner_id: ID пользователя сервиса, который связан с этим сообщением.
+		:param message: Сообщение.
+		"""
+
+		owner_messages = self._messages.setdefault(service_owner_id, OrderedDict())
+		owner_messages[message] = None
+		self._lru[message] = service_owner_id
+		self.size_bytes += message.estimate_size()
+
+		for index, mids in self._get_indexes(message):
+			for mid in mids:
+				index[(message.service, service_owner_id, mid)] = message
+
+		# Удаляем старые сообщения, если превышен лимит.
+		while self.max_per_owner and len(owner_messages) > self.max_per_owner:
+			self.remove(service_owner_id, next(iter(owner_messages)))
+			self.evicted += 1
+
+		while self.max_total and len(self._lru) > self.max_total:
+			oldest_message, oldest_owner_id = next(iter(self._lru.items()))
+
+			self.remove(oldest_owner_id, oldest_message)
+			self.evicted += 1
+
+	def remove(self, service_owner_id: int, message: TelehooperMessage) -> None:
+		"""
+		Удаляет сообщение из хранилища, обновляя все индексы. Если сообщения нет в хранилище, то ничего не происходит.
+
+		:param service_owner_id: ID пользователя сервиса, который связан с этим сообщением.
+		:param message: Сообщение.
+		"""
+
+		owner_messages = self._messages.get(service_owner_id)
+		if owner_messages is None or message not in owner_messages:
+			return
+
+		del owner_messages[message]
+		del self._lru[message]
+		self.size_bytes -= message.estimate_size()
+
+		if not owner_messages:
+			del self._messages[service_owner_id]
+
+		for index, mids in self._get_indexes(message):
+			for mid in mids:
+				key = (message.service, service_owner_id, mid)
+
+				# Индекс мог быть перезаписан более новым сообщением с тем же ID.
+				if index.get(key) is message:
+					del index[key]
+
+	def get_by_telegram_id(self, service_name: str, service_owner_id: int, message_id: int) -> TelehooperMessage | None:
+		"""
+		Возвращает сообщение по его ID в Telegram.
+
+		:param service_name: Название сервиса, через который было отправлено сообщение.
+		:param service_owner_id: ID пользователя сервиса, который связан с этим сообщением.
+		:param message_id: ID сообщения в Telegram.
+		"""
+
+		return self._touch(self._telegram_index.get((service_name, service_owner_id, message_id)))
+
+	def get_by_service_id(self, service_name: str, service_owner_id: int, message_id: int) -> TelehooperMessage | None:
+		"""
+		Возвращает сообщение по его ID в сервисе.
+
+		:param service_name: Название сервиса, через который было отправлено сообщение.
+		:param service_owner_id: ID пользователя сервиса, который связан с этим сообщением.
+		:param message_id: ID сообщения в сервисе.
+		"""
+
+		return self._touch(self._service_index.get((service_name, service_owner_id, message_id)))
+
+	def get_by_service_conversation_id(self, service_name: str, service_owner_id: int, conversation_message_id: int) -> TelehooperMessage | None:
+		"""
+		Возвращает сообщение по его ID беседы в сервисе.
+
+		:param service_name: Название сервиса, через который было отправлено сообщение.
+		:param service_owner_id: ID пользователя сервиса, который связан с этим сообщением.
+		:param conversation_message_id: ID сообщения беседы в сервисе.
+		"""
+
+		return self._touch(self._conversation_index.get((service_name, service_owner_id, conversation_message_id)))
+
+	def owners_count(self) -> int:
+		"""
+		Возвращает количество пользователей сервисов, у которых есть сохранённые сообщения.
+		"""
+
+		return len(self._messages)
+
+	def __len__(self) -> int:
+		"""
+		Возвращает общее количество сохранённых сообщений.
+		"""
+
+		return len(self._lru)
+
+_cached_message_ids = TelehooperMessageStorage(
+	max_per_owner=config.message_cache_max_per_user,
+	max_total=config.message_cache_max_total
+)
+
 class TelehooperCachedAttachment:
 	"""
 	Класс, описывающий вложение, которое было сохранено в Telegram. Данный класс предоставляет доступ к ID вложения в Telegram и в сервисе, а так же прочую информацию.
@@ -973,7 +1214,7 @@ class TelehooperSubGroup:
 			bypass_queue=bypass_queue
 		)
 
-	async def send_message_in(self, text: str, attachments: list[InputMediaAudio | InputMediaDocument | InputMediaPhoto | InputMediaVideo] | None = None, reply_to: int | None = None, silent: bool = False, keyboard: InlineKeyboardMarkup | None = None, disable_web_preview: bool = False, web_preview_url: str | None = None, sender_id: int | None = None, bypass_queue: bool = False) -> list[int] | None:
+	async def send_message_in(self, text: str, attachments: list[InputMediaAudio | InputMediaDocument | InputMediaPhoto | InputMediaVideo] | None = None, reply_to: int | None = None, silent: bool = False, keyboard: InlineKeyboardMarkup | None = None, disable_web_preview: bool = False, web_preview_url: str | None = None, sender_id: int | None = None, bypass_queue: bool = False, on_sent: Callable[[Bot, list[Message]], None] | None = None) -> list[int] | None:
 		"""
 		Отправляет сообщение в Telegram-группу.
 
@@ -986,6 +1227,7 @@ class TelehooperSubGroup:
 		:param web_preview_url: URL страницы, для которой должен быть сделан превью ссылки. Работает лишь в случае, если disable_web_preview = False.
 		:param sender_id: ID пользователя, с которым должен быть найден ассоциированный минибот.
 		:param bypass_queue: Отправить ли сообщение без учёта лимитов.
+		:param on_sent: Функция, вызываемая с ботом, отправившим сообщение, и отправленными сообщениями.
 		"""
 
 		return await self.parent.send_message(
@@ -998,7 +1240,8 @@ class TelehooperSubGroup:
 			disable_web_preview=disable_web_preview,
 			web_preview_url=web_preview_url,
 			sender_id=sender_id,
-			bypass_queue=bypass_queue
+			bypass_queue=bypass_queue,
+			on_sent=on_sent
 		)
 
 	async def start_activity(self, type: Literal["typing", "upload_photo", "record_video", "upload_video", "record_audio", "upload_audio", "upload_document", "find_location", "record_video_note", "upload_video_note"] = "typing", sender_id: int | None = None, bypass_queue: bool = False) -> None:
@@ -1191,6 +1434,129 @@ class TelehooperSubGroup:
 	def __repr__(self) -> str:
 		return f"<{self.service.service_name} TelehooperSubGroup for {self.service_dialogue_name}>"
 
+class TelehooperSubGroupRegistry:
+	"""
+	Хранилище всех TelehooperSubGroup в памяти бота. Хранит индексы по диалогу сервиса и по группе (и топику) Telegram, благодаря чему поиск сервис-диалога не зависит от их общего количества.
+	"""
+
+	_by_dialogue: dict[tuple[int, str, int], TelehooperSubGroup]
+	"""Индекс вида `(ID создателя группы, название сервиса, ID диалога в сервисе)`."""
+	_by_chat: dict[int, dict[int, TelehooperSubGroup]]
+	"""Индекс вида `ID группы в Telegram -> ID топика -> TelehooperSubGroup`."""
+
+	def __init__(self) -> None:
+		"""
+		Инициализирует пустое хранилище.
+		"""
+
+		self._by_dialogue = {}
+		self._by_chat = {}
+
+	def _dialogue_key(self, subgroup: TelehooperSubGroup) -> tuple[int, str, int]:
+		"""
+		Возвращает ключ индекса по диалогу сервиса для указанного сервис-диалога.
+
+		:param subgroup: Сервис-диалог.
+		"""
+
+		return (subgroup.parent.creatorID, subgroup.service.service_name, subgroup.service_chat_id)
+
+	def add(self, subgroup: TelehooperSubGroup) -> None:
+		"""
+		Добавляет сервис-диалог в хранилище.
+
+		:param subgroup: Сервис-диалог.
+		"""
+
+		# Если в этом топике уже был сервис-диалог, то он заменяется.
+		existing = self.get_by_chat(subgroup.parent.chat.id, subgroup.id)
+		if existing:
+			self.remove(existing)
+
+		self._by_dialogue[self._dialogue_key(subgroup)] = subgroup
+		self._by_chat.setdefault(subgroup.parent.chat.id, {})[subgroup.id] = subgroup
+
+	def remove(self, subgroup: TelehooperSubGroup) -> None:
+		"""
+		Удаляет сервис-диалог из хранилища. Вызывает ValueError, если сервис-диалога нет в хранилище.
+
+		:param subgroup: Сервис-диалог.
+		"""
+
+		chat_subgroups = self._by_chat.get(subgroup.parent.chat.id, {})
+		if chat_subgroups.get(subgroup.id) is not subgroup:
+			raise ValueError(f"{subgroup} не был сохранён в памяти бота")
+
+		del chat_subgroups[subgroup.id]
+		if not chat_subgroups:
+			del self._by_chat[subgroup.parent.chat.id]
+
+		key = self._dialogue_key(subgroup)
+		if self._by_dialogue.get(key) is subgroup:
+			del self._by_dialogue[key]
+
+	def get_by_service_dialogue(self, creator_id: int, service_name: str, service_chat_id: int) -> TelehooperSubGroup | None:
+		"""
+		Возвращает сервис-диалог по диалогу из сервиса, либо None, если он не найден.
+
+		:param creator_id: ID создателя (владельца) группы в Telegram.
+		:param service_name: Название сервиса.
+		:param service_chat_id: ID диалога в сервисе.
+		"""
+
+		return self._by_dialogue.get((creator_id, service_name, service_chat_id))
+
+	def get_by_chat(self, chat_id: int, topic_id: int = 0) -> TelehooperSubGroup | None:
+		"""
+		Возвращает сервис-диалог по группе и топику Telegram, либо None, если он не найден.
+
+		:param chat_id: ID группы в Telegram.
+		:param topic_id: ID топика Telegram.
+		"""
+
+		return self._by_chat.get(chat_id, {}).get(topic_id)
+
+	def get_by_chat_id(self, chat_id: int) -> list[TelehooperSubGroup]:
+		"""
+		Возвращает все сервис-диалоги, которые находятся в указанной группе Telegram.
+
+		:param chat_id: ID группы в Telegram.
+		"""
+
+		return list(self._by_chat.get(chat_id, {}).values())
+
+	def change_chat(self, old_chat_id: int, new_chat: Chat) -> None:
+		"""
+		Заменяет объект группы Telegram у всех сервис-диалогов группы `old_chat_id`. Используется, если группа в Telegram изменила свой ID (например, при конвертации в supergroup).
+
+		:param old_chat_id: Старый ID группы в Telegram.
+		:param new_chat: Новый объект группы в Telegram.
+		"""
+
+		# Сервис-диалоги одной группы могут иметь общий `parent`, поэтому их нельзя удалять по одному:
+		# после замены группы у первого сервис-диалога остальные искались бы уже по новому ID.
+		chat_subgroups = self._by_chat.pop(old_chat_id, {})
+		for subgroup in chat_subgroups.values():
+			subgroup.parent.chat = new_chat
+
+		self._by_chat.setdefault(new_chat.id, {}).update(chat_subgroups)
+
+	def __iter__(self) -> Iterator[TelehooperSubGroup]:
+		"""
+		Возвращает итератор по всем сервис-диалогам.
+		"""
+
+		return iter([subgroup for chat_subgroups in self._by_chat.values() for subgroup in chat_subgroups.values()])
+
+	def __len__(self) -> int:
+		"""
+		Возвращает количество сервис-диалогов.
+		"""
+
+		return sum(len(chat_subgroups) for chat_subgroups in self._by_chat.values())
+
+_service_dialogues = TelehooperSubGroupRegistry()
+
 class TelehooperAPI:
 	"""
 	Класс с различными API бота Telehooper.
@@ -1226,7 +1592,10 @@ class TelehooperAPI:
 		try:
 			user = (await (bot).get_chat_member(user_id, user_id)).user
 
-			return TelehooperUser(await (await get_db())[f"user_{user_id}"], user)
+			user_db = await get_document(f"user_{user_id}")
+			assert user_db, f"Пользователь с ID {user_id} не был найден в БД"
+
+			return TelehooperUser(user_db, user)
 		except:
 			return None
 
@@ -1289,7 +1658,7 @@ class TelehooperAPI:
 		:param group: TelehooperSubGroup, который нужно сохранить.
 		"""
 
-		_service_dialogues.append(group)
+		_service_dialogues.add(group)
 
 	@staticmethod
 	def delete_subgroup(group: TelehooperSubGroup) -> None:
@@ -1307,7 +1676,43 @@ class TelehooperAPI:
 		Возвращает все TelehooperSubGroup, которые были сохранены в памяти бота.
 		"""
 
-		return _service_dialogues
+		return list(_service_dialogues)
+
+	@staticmethod
+	def get_subgroups_by_chat_id(chat_id: int) -> list[TelehooperSubGroup]:
+		"""
+		Возвращает все TelehooperSubGroup, которые находятся в указанной Telegram-группе.
+
+		:param chat_id: ID группы в Telegram.
+		"""
+
+		return _service_dialogues.get_by_chat_id(chat_id)
+
+	@staticmethod
+	def change_subgroups_chat(old_chat_id: int, new_chat: Chat) -> None:
+		"""
+		Заменяет объект группы Telegram у всех TelehooperSubGroup группы `old_chat_id`. Используется при конвертации группы в supergroup, поскольку у группы меняется ID.
+
+		:param old_chat_id: Старый ID группы в Telegram.
+		:param new_chat: Новый объект группы в Telegram.
+		"""
+
+		_service_dialogues.change_chat(old_chat_id, new_chat)
+
+		# Лимитеры старой группы больше не понадобятся.
+		TelehooperAPI.remove_group_limiters(old_chat_id)
+
+	@staticmethod
+	def remove_group_limiters(chat_id: int, bot_id: int | None = None) -> None:
+		"""
+		Удаляет лимитеры отправки сообщений в группу (см. `TelehooperGroup.get_limiter()`). Используется, если бот был удалён из группы, либо если группа изменила свой ID.
+
+		:param chat_id: ID группы в Telegram.
+		:param bot_id: ID бота (или минибота), лимитер которого нужно удалить. Если не указано, то удаляются лимитеры всех ботов группы.
+		"""
+
+		for key in [key for key in _group_limiters if key[0] == chat_id and (bot_id is None or key[1] == bot_id)]:
+			del _group_limiters[key]
 
 	@staticmethod
 	def get_subgroup_by_service_dialogue(user: TelehooperUser, dialogue: ServiceDialogue) -> TelehooperSubGroup | None:
@@ -1320,19 +1725,7 @@ class TelehooperAPI:
 		:param dialogue: Диалог, который нужно найти.
 		"""
 
-		for servDialog in _service_dialogues:
-			if servDialog.parent.creatorID != user.telegramUser.id:
-				continue
-
-			if servDialog.service.service_name != dialogue.service_name:
-				continue
-
-			if servDialog.service_chat_id != dialogue.id:
-				continue
-
-			return servDialog
-
-		return None
+		return _service_dialogues.get_by_service_dialogue(user.telegramUser.id, dialogue.service_name, dialogue.id)
 
 	@staticmethod
 	def get_subgroup_by_chat(group: TelehooperGroup, topic_id: int = 0) -> TelehooperSubGroup | None:
@@ -1345,25 +1738,19 @@ class TelehooperAPI:
 		:param topic_id: ID топика Telegram. Если не указано, то возвращается главная группа.
 		"""
 
-		for servDialog in _service_dialogues:
-			if servDialog.parent.creatorID != group.creatorID:
-				continue
-
-			if servDialog.parent.chat.id != group.chat.id:
-				continue
-
-			if servDialog.id != topic_id:
-				continue
-
-			return servDialog
+		subgroup = _service_dialogues.get_by_chat(group.chat.id, topic_id)
+		if not subgroup or subgroup.parent.creatorID != group.creatorID:
+			return None
 
-		return None
+		return subgroup
 
 	@staticmethod
 	async def save_message(service_name: str, service_owner_id: int, telegram_message_id: int | list[int], service_message_id: int | list[int], service_conv_mids: int | list[int] | None = None, sent_via_bot: bool = True):
 		"""
 		Сохраняет ID отправленного сообщения в БД.
 
+		Сообщение сразу попадает в кэш, а запись в БД происходит в фоне, пачками (см. `flush_messages`).
+
 		:param service_name: Название сервиса, через который было отправлено сообщение.
 		:param service_owner_id: ID пользователя сервиса, который связан с этим сообщением.
 		:param telegram_message_id: ID сообщения(-ий) в Telegram.
@@ -1372,13 +1759,22 @@ class TelehooperAPI:
 		:param sent_via_bot: Отправлено ли сообщение через бота.
 		"""
 
-		_cached_message_ids.setdefault(service_owner_id, []).append(TelehooperMessage(
+		message = TelehooperMessage(
 			service=service_name,
 			telegram_mids=telegram_message_id,
 			service_mids=service_message_id,
 			service_conv_mids=service_conv_mids,
 			sent_via_bot=sent_via_bot
-		))
+		)
+
+		_cached_message_ids.add(service_owner_id, message)
+
+		# Сообщение могло ранее не найтись в БД, поэтому забываем об этом.
+		for field, mids in [("TelegramIDs", message.telegram_message_ids), ("ServiceIDs", message.service_message_ids), ("ConversationIDs", message.service_conversation_message_ids or [])]:
+			for mid in mids:
+				_missing_message_ids.pop((field, service_name, service_owner_id, mid), None)
+
+		TelehooperAPI._queue_message_write(get_message_mapping_id(service_name, service_owner_id, message.service_message_ids[0]), (service_owner_id, message))
 
 	@staticmethod
 	async def delete_message(service_name: str, service_owner_id: int, telegram_message_id: int | list[int] | None = None, service_message_id: int | list[int] | None = None):
@@ -1399,28 +1795,54 @@ class TelehooperAPI:
 		if isinstance(service_message_id, int):
 			service_message_id = [service_message_id]
 
-		telegram_message_id = cast(list[int], telegram_message_id)
-		service_message_id = cast(list[int], service_message_id)
+		messages = [await TelehooperAPI.get_message_by_telegram_id(service_name, service_owner_id, mid) for mid in telegram_message_id or []]
+		messages += [await TelehooperAPI.get_message_by_service_id(service_name, service_owner_id, mid) for mid in service_message_id or []]
 
-		for index, msg in enumerate(_cached_message_ids.get(service_owner_id, [])):
-			if msg.service != service_name:
+		for msg in messages:
+			if not msg:
 				continue
 
-			for mid in telegram_message_id:
-				if mid in msg.telegram_message_ids:
-					continue
+			_cached_message_ids.remove(service_owner_id, msg)
+			TelehooperAPI._queue_message_write(get_message_mapping_id(service_name, service_owner_id, msg.service_message_ids[0]), None)
+
+	@staticmethod
+	async def _load_message(service_name: str, service_owner_id: int, field: Literal["TelegramIDs", "ServiceIDs", "ConversationIDs"], message_id: int) -> TelehooperMessage | None:
+		"""
+		Загружает сообщение из БД, если его нет в кэше, и добавляет его в кэш. Возвращает None, если сообщение не было найдено.
 
-				del _cached_message_ids[service_owner_id][index]
+		:param service_name: Название сервиса, через который было отправлено сообщение.
+		:param service_owner_id: ID пользователя сервиса, который связан с этим сообщением.
+		:param field: Поле записи в БД, по которому производится поиск.
+		:param message_id: ID сообщения.
+		"""
 
-				return
+		missing_key = (field, service_name, service_owner_id, message_id)
+		if missing_key in _missing_message_ids:
+			return None
 
-			for mid in service_message_id:
-				if mid in msg.service_message_ids:
-					continue
+		try:
+			doc = await find_message_mapping(service_name, service_owner_id, field, message_id)
+		except Exception as error:
+			logger.warning(f"Не удалось загрузить связь ID сообщений из БД: {error}")
+
+			return None
+
+		# Запись могла быть удалена, но ещё не удалена из самой БД.
+		if not doc or (doc.id in _pending_message_writes and _pending_message_writes[doc.id] is None):
+			_missing_message_ids[missing_key] = True
+
+			return None
 
-				del _cached_message_ids[service_owner_id][index]
+		message = TelehooperMessage(
+			service=doc["Service"],
+			telegram_mids=doc["TelegramIDs"],
+			service_mids=doc["ServiceIDs"],
+			service_conv_mids=doc["ConversationIDs"],
+			sent_via_bot=doc["SentViaBot"]
+		)
+		_cached_message_ids.add(service_owner_id, message)
 
-				return
+		return message
 
 	@staticmethod
 	async def get_message_by_telegram_id(service_name: str, service_owner_id: int, message_id: int) -> TelehooperMessage | None:
@@ -1432,14 +1854,7 @@ class TelehooperAPI:
 		:param service_owner_id: ID пользователя сервиса, который связан с этим сообщением.
 		"""
 
-		for msg in _cached_message_ids.get(service_owner_id, []):
-			if msg.service != service_name:
-				continue
-
-			if message_id not in msg.telegram_message_ids:
-				continue
-
-			return msg
+		return _cached_message_ids.get_by_telegram_id(service_name, service_owner_id, message_id) or await TelehooperAPI._load_message(service_name, service_owner_id, "TelegramIDs", message_id)
 
 	@staticmethod
 	async def get_message_by_service_id(service_name: str, service_owner_id: int, message_id: int) -> TelehooperMessage | None:
@@ -1451,14 +1866,7 @@ class TelehooperAPI:
 		:param service_owner_id: ID пользователя сервиса, который связан с этим сообщением.
 		"""
 
-		for msg in _cached_message_ids.get(service_owner_id, []):
-			if msg.service != service_name:
-				continue
-
-			if message_id not in msg.service_message_ids:
-				continue
-
-			return msg
+		return _cached_message_ids.get_by_service_id(service_name, service_owner_id, message_id) or await TelehooperAPI._load_message(service_name, service_owner_id, "ServiceIDs", message_id)
 
 	@staticmethod
 	async def get_message_by_service_conversation_id(service_name: str, service_owner_id: int, conversation_message_id: int) -> TelehooperMessage | None:
@@ -1470,17 +1878,229 @@ class TelehooperAPI:
 		:param conversation_message_id: ID сообщения беседы в сервисе.
 		"""
 
-		for msg in _cached_message_ids.get(service_owner_id, []):
-			if msg.service != service_name:
-				continue
+		return _cached_message_ids.get_by_service_conversation_id(service_name, service_owner_id, conversation_message_id) or await TelehooperAPI._load_message(service_name, service_owner_id, "ConversationIDs", conversation_message_id)
 
-			if not msg.service_conversation_message_ids:
-				continue
+	@staticmethod
+	def _queue_message_write(doc_id: str, value: tuple[int, TelehooperMessage] | None) -> None:
+		"""
+		Добавляет запись (либо удаление, если `value` равен None) связи ID сообщений в очередь на сохранение в БД.
 
-			if conversation_message_id not in msg.service_conversation_message_ids:
-				continue
+		:param doc_id: ID документа в БД.
+		:param value: Пара из ID пользователя сервиса и сообщения, либо None для удаления.
+		"""
+
+		_pending_message_writes[doc_id] = value
+
+		TelehooperAPI._schedule_flush()
+
+	@staticmethod
+	def _queue_attachment_write(doc_id: str, value: TelehooperCachedAttachment | None) -> None:
+		"""
+		Добавляет запись (либо удаление, если `value` равен None) кэшированного вложения в очередь на сохранение в БД.
+
+		:param doc_id: ID документа в БД.
+		:param value: Вложение, либо None для удаления.
+		"""
+
+		_pending_attachment_writes[doc_id] = value
+
+		TelehooperAPI._schedule_flush()
+
+	@staticmethod
+	def _schedule_flush() -> None:
+		"""
+		Запускает фоновое сохранение ожидающих записей в БД, если оно ещё не запущено. Если записей накопилось слишком много, то сохранение произойдёт немедленно.
+		"""
+
+		global _db_flush_task
+
+
+		if len(_pending_message_writes) + len(_pending_attachment_writes) + len(_pending_checkpoint_writes) >= DB_WRITE_FLUSH_BATCH_SIZE:
+			_db_flush_event.set()
+
+		if _db_flush_task is None or _db_flush_task.done():
+			_db_flush_task = asyncio.create_task(TelehooperAPI._flush_loop())
+
+	@staticmethod
+	async def _flush_loop() -> None:
+		"""
+		Бесконечный цикл, сохраняющий ожидающие записи в БД раз в `DB_WRITE_FLUSH_INTERVAL` секунд, либо раньше, если накопилось `DB_WRITE_FLUSH_BATCH_SIZE` записей.
+		"""
+
+		while True:
+			try:
+				await asyncio.wait_for(_db_flush_event.wait(), timeout=DB_WRITE_FLUSH_INTERVAL)
+			except asyncio.TimeoutError:
+				pass
+
+			_db_flush_event.clear()
+			await TelehooperAPI.flush_pending_writes()
+
+	@staticmethod
+	async def flush_pending_writes() -> bool:
+		"""
+		Сохраняет в БД все ожидающие записи: связи ID сообщений, кэшированные вложения и позиции longpoll'ов. Возвращает `True`, если всё было сохранено успешно.
+		"""
+
+		messages_saved = await TelehooperAPI.flush_messages()
+		attachments_saved = await TelehooperAPI.flush_attachments()
+		checkpoints_saved = await TelehooperAPI.flush_longpoll_checkpoints()
+
+		return messages_saved and attachments_saved and checkpoints_saved
+
+	@staticmethod
+	async def _flush_queue(pending_writes: dict[str, Any], build_doc: Callable[[Any], dict], description: str) -> bool:
+		"""
+		Сохраняет все ожидающие записи из очереди в БД одним bulk-запросом. Записи со значением `None` удаляют документ, при этом несуществующие документы пропускаются. В случае ошибки записи возвращаются в очередь. Возвращает `True`, если все записи были сохранены.
+
+		:param pending_writes: Очередь записей: ID документа и значение, либо `None` для удаления документа.
+		:param build_doc: Функция, создающая содержимое документа из значения записи.
+		:param description: Описание записей для логов, например, `связей ID сообщений`.
+		"""
+
+		if not pending_writes:
+			return True
+
+		pending = pending_writes.copy()
+		pending_writes.clear()
+
+		try:
+			db = await get_db()
+
+			async with BulkOperation(db) as bulk:
+				async for doc in db.docs(list(pending.keys()), create=True):
+					value = pending[doc.id]
+
+					# Несуществующие документы удалять не нужно: иначе в БД был бы создан пустой документ.
+					if value is None:
+						if doc.exists:
+							doc["_deleted"] = True
+							bulk.append(doc)
+
+						continue
+
+					doc.update(build_doc(value))
+					bulk.append(doc)
+
+			if bulk.error:
+				logger.warning(f"Не удалось сохранить {len(bulk.error)} {description} в БД, попробую позже.")
+
+				# Возвращаем записи в очередь, не перезаписывая более новые.
+				for doc in bulk.error:
+					pending_writes.setdefault(doc.id, pending[doc.id])
+
+				return False
+		except Exception as error:
+			logger.warning(f"Не удалось сохранить {len(pending)} {description} в БД, попробую позже: {error}")
+
+			# Возвращаем записи в очередь, не перезаписывая более новые.
+			for doc_id, value in pending.items():
+				pending_writes.setdefault(doc_id, value)
+
+			return False
+
+		return True
+
+	@staticmethod
+	async def flush_messages() -> bool:
+		"""
+		Сохраняет все ожидающие записи связи ID сообщений в БД одним bulk-запросом. В случае ошибки записи возвращаются в очередь. Возвращает `True`, если все записи были сохранены.
+		"""
+
+		def _build_doc(value: tuple[int, TelehooperMessage]) -> dict:
+			owner_id, msg = value
+
+			return get_default_message_mapping(
+				msg.service,
+				owner_id,
+				msg.telegram_message_ids,
+				msg.service_message_ids,
+				msg.service_conversation_message_ids,
+				msg.sent_via_bot
+			)
+
+		return await TelehooperAPI._flush_queue(_pending_message_writes, _build_doc, "связей ID сообщений")
+
+	@staticmethod
+	async def flush_attachments() -> bool:
+		"""
+		Сохраняет все ожидающие записи кэшированных вложений в БД одним bulk-запросом. Каждое вложение хранится в отдельном документе, поэтому в БД отправляются только новые или удалённые вложения. В случае ошибки записи возвращаются в очередь. Возвращает `True`, если все записи были сохранены.
+		"""
+
+		return await TelehooperAPI._flush_queue(
+			_pending_attachment_writes,
+			lambda attachment: get_default_attachment(attachment.service_name, attachment.key, attachment.value),
+			"кэшированных вложений"
+		)
+
+	@staticmethod
+	async def flush_longpoll_checkpoints() -> bool:
+		"""
+		Сохраняет все ожидающие записи позиций longpoll'ов в БД одним bulk-запросом. Для каждого пользователя сохраняется лишь последняя позиция, поэтому частые обновления позиции не приводят к частым записям в БД. В случае ошибки записи возвращаются в очередь. Возвращает `True`, если все записи были сохранены.
+		"""
+
+		return await TelehooperAPI._flush_queue(
+			_pending_checkpoint_writes,
+			lambda value: get_default_longpoll_checkpoint(*value),
+			"позиций longpoll'ов"
+		)
+
+	@staticmethod
+	def save_longpoll_checkpoint(service_name: str, service_owner_id: int, ts: int, pts: int | None) -> None:
+		"""
+		Добавляет в очередь на сохранение в БД последнюю обработанную позицию longpoll'а пользователя сервиса. С этой позиции longpoll продолжит работу после перезапуска бота.
+
+		:param service_name: Название сервиса.
+		:param service_owner_id: ID пользователя сервиса.
+		:param ts: Последний обработанный ts longpoll'а.
+		:param pts: Последний обработанный pts longpoll'а.
+		"""
+
+		_pending_checkpoint_writes[get_longpoll_checkpoint_id(service_name, service_owner_id)] = (service_name, service_owner_id, ts, pts)
+
+		TelehooperAPI._schedule_flush()
+
+	@staticmethod
+	def delete_longpoll_checkpoint(service_name: str, service_owner_id: int) -> None:
+		"""
+		Добавляет в очередь на удаление из БД позицию longpoll'а пользователя сервиса. Используется при отключении сервиса.
+
+		:param service_name: Название сервиса.
+		:param service_owner_id: ID пользователя сервиса.
+		"""
+
+		_pending_checkpoint_writes[get_longpoll_checkpoint_id(service_name, service_owner_id)] = None
+
+		TelehooperAPI._schedule_flush()
+
+	@staticmethod
+	async def get_longpoll_checkpoint(service_name: str, service_owner_id: int) -> tuple[int, int | None] | None:
+		"""
+		Возвращает последнюю обработанную позицию longpoll'а (пару из ts и pts) пользователя сервиса, либо None, если её нет.
+
+		:param service_name: Название сервиса.
+		:param service_owner_id: ID пользователя сервиса.
+		"""
 
-			return msg
+		doc_id = get_longpoll_checkpoint_id(service_name, service_owner_id)
+
+		if doc_id in _pending_checkpoint_writes:
+			value = _pending_checkpoint_writes[doc_id]
+
+			return (value[2], value[3]) if value else None
+
+		try:
+			db = await get_db()
+
+			doc = await db[doc_id]
+		except NotFoundError:
+			return None
+		except Exception as error:
+			logger.warning(f"Не удалось загрузить позицию longpoll'а {doc_id} из БД, события будут получаться с текущей позиции: {error}")
+
+			return None
+
+		return doc["TS"], doc["PTS"]
 
 	@staticmethod
 	async def save_attachment(service_name: str, key: str, value: str, encrypt: bool = True, save_in_db: bool = True):
@@ -1494,35 +2114,40 @@ class TelehooperAPI:
 		:param save_in_db: Если True, то данное вложение будет сохранено в БД.
 		"""
 
+		hashed_key = utils.sha256_hash(key) if encrypt else key
+
 		# Проверяем, что данное вложение не существует в БД.
-		if await TelehooperAPI.get_attachment(service_name, key):
+		if (service_name, hashed_key) in _cached_attachments:
 			return
 
-		# Шифруем поля, если это нужно.
+		# Шифруем значение, если это нужно.
 		if encrypt:
 			logger.debug(f"Шифрую ключ {key} через SHA, а значение {value} через оригинальный ключ.")
 
 			value = utils.encrypt_with_key(value, key)
-			key = utils.sha256_hash(key)
 
-		_cached_attachments.append(TelehooperCachedAttachment(
+		_cached_attachments[(service_name, hashed_key)] = TelehooperCachedAttachment(
 			service_name=service_name,
-			key=key,
+			key=hashed_key,
 			value=value
-		))
+		)
 
 		# Если это нужно, то сохраняем вложение в БД.
 		if save_in_db:
-			doc = await get_attachment_cache(service_name)
-			doc["Attachments"] = {}
+			TelehooperAPI._queue_attachment_write(get_attachment_id(service_name, hashed_key), _cached_attachments[(service_name, hashed_key)])
 
-			for attachment in _cached_attachments:
-				doc["Attachments"].update(attachment.as_dict())
+	@staticmethod
+	def load_attachments(service_name: str, attachments: dict[str, str]) -> None:
+		"""
+		Загружает в память сразу все вложения сервиса из записи кэша вложений в БД. В отличии от `save_attachment`, не проверяет вложения на дубликаты и не сохраняет их в БД.
 
-			try:
-				await doc.save()
-			except:
-				pass
+		:param service_name: Название сервиса, с которым ассоциированы вложения.
+		:param attachments: Словарь из вложений, где ключ — захешированный ключ вложения, а значение — зашифрованное значение вложения.
+		"""
+
+		_cached_attachments.update(
+			((service_name, key), TelehooperCachedAttachment(service_name, key, value)) for key, value in attachments.items()
+		)
 
 	@staticmethod
 	async def get_attachment(service_name: str, key: str) -> str | None:
@@ -1533,16 +2158,11 @@ class TelehooperAPI:
 		:param key: Уникальный ключ вложения. Не должен быть хэширован.
 		"""
 
-		for attachment in _cached_attachments:
-			if attachment.service_name != service_name:
-				continue
-
-			if attachment.key != utils.sha256_hash(key):
-				continue
-
-			return utils.decrypt_with_key(attachment.value, key)
+		attachment = _cached_attachments.get((service_name, utils.sha256_hash(key)))
+		if not attachment:
+			return None
 
-		return None
+		return utils.decrypt_with_key(attachment.value, key)
 
 	@staticmethod
 	async def delete_attachment(service_name: str, key: str) -> None:
@@ -1553,19 +2173,10 @@ class TelehooperAPI:
 		:param key: Уникальный ключ вложения. Не должен быть хэширован.
 		"""
 
-		# Проходим по вложениям, ищем наше вложение.
-		for index, attachment in enumerate(_cached_attachments):
-			if attachment.service_name != service_name:
-				continue
-
-			if attachment.key != utils.sha256_hash(key):
-				continue
-
-			del _cached_attachments[index]
+		hashed_key = utils.sha256_hash(key)
 
-			return
-
-		# TODO: Удалить вложение из БД.
+		if _cached_attachments.pop((service_name, hashed_key), None):
+			TelehooperAPI._queue_attachment_write(get_attachment_id(service_name, hashed_key), None)
 
 	@staticmethod
 	async def edit_or_resend_message(bot: Bot, text: str, chat_id: int, message_to_edit: Message | int | None, thread_id: int | None = None, reply_markup: InlineKeyboardMarkup | ReplyKeyboardMarkup | ReplyKeyboardRemove | ForceReply | None = None, disable_web_page_preview: bool = False, allow_sending_without_reply: bool = False, query: CallbackQuery | None = None) -> Message | int | None:
@@ -1670,10 +2281,14 @@ class TelehooperAPI:
 			# Сохраняем изменения в БД.
 			await db_group.save()
 
+			TelehooperAPI.remove_group_limiters(chat, bot.id)
+
 			return
 
 		logger.debug(f"Группа с ID {chat} была отправлена на удаление.")
 
+		TelehooperAPI.remove_group_limiters(chat)
+
 		telehooper_user = None
 		try:
 			telehooper_user = await TelehooperAPI.get_user_by_id(db_group["Creator"], bot)
@@ -1681,7 +2296,7 @@ class TelehooperAPI:
 			pass
 
 		# Отключаем все сервис-диалоги, связанные с этой группой.
-		for i in [i for i in TelehooperAPI.get_all_subgroups() if i.parent.chat.id == chat]:
+		for i in TelehooperAPI.get_subgroups_by_chat_id(chat):
 			TelehooperAPI.delete_subgroup(i)
 
 		# Удаляем группу из памяти пользователя, если объект пользователя существует.
@@ -1722,6 +2337,32 @@ class TelehooperAPI:
 
 		return list(_saved_connections.values())
 
+	@staticmethod
+	def record_queue_wait(bot_id: int, wait_time: float) -> None:
+		"""
+		Сохраняет время ожидания места в очереди на отправку сообщений в гистограмму для указанного бота. Гистограмма используется для определения того, хватает ли миниботов.
+
+		:param bot_id: ID бота (или минибота).
+		:param wait_time: Время ожидания в секундах.
+		"""
+
+		histogram = _queue_wait_histogram.setdefault(bot_id, [0] * (len(QUEUE_WAIT_HISTOGRAM_BUCKETS) + 1))
+
+		histogram[bisect.bisect_left(QUEUE_WAIT_HISTOGRAM_BUCKETS, wait_time)] += 1
+
+	@staticmethod
+	def get_queue_wait_histogram(bot_id: int | None = None) -> list[int]:
+		"""
+		Возвращает гистограмму времени ожидания места в очереди на отправку сообщений. Значение по индексу `i` — количество ожиданий, длившихся не более `QUEUE_WAIT_HISTOGRAM_BUCKETS[i]` секунд; последнее значение — количество более долгих ожиданий.
+
+		:param bot_id: ID бота (или минибота). Если не указано, то возвращается сумма гистограмм всех ботов.
+		"""
+
+		if bot_id is not None:
+			return list(_queue_wait_histogram.get(bot_id, [0] * (len(QUEUE_WAIT_HISTOGRAM_BUCKETS) + 1)))
+
+		return [sum(counts) for counts in zip(*_queue_wait_histogram.values())] or [0] * (len(QUEUE_WAIT_HISTOGRAM_BUCKETS) + 1)
+
 	@staticmethod
 	async def get_users_with_role(role: str, allow_any: bool = True) -> list[int]:
 		"""
@@ -37,6 +37,18 @@ class Configuration(BaseSettings):
 	ffmpeg_path: str | None = Field(None, description="Путь к binary ffmpeg. Используется для конвертации GIF из Telegram (которые на деле являются mp4-видео) в 'настоящие' GIF для сервисов")
 	"""Путь к binary ffmpeg. Используется для конвертации GIF из Telegram (которые на деле являются mp4-видео) в 'настоящие' GIF для сервисов."""
 
+	message_cache_max_per_user: int = Field(5000, description="Максимальное количество хранимых в памяти связей ID сообщений для одного пользователя сервиса. Используй 0 для отключения ограничения", ge=0)
+	"""Максимальное количество хранимых в памяти связей ID сообщений для одного пользователя сервиса. Используй 0 для отключения ограничения."""
+	message_cache_max_total: int = Field(200000, description="Максимальное количество хранимых в памяти связей ID сообщений для всех пользователей. Используй 0 для отключения ограничения", ge=0)
+	"""Максимальное количество хранимых в памяти связей ID сообщений для всех пользователей. Используй 0 для отключения ограничения."""
+
+	media_spool_path: str | None = Field(None, description="Путь к папке, в которой временно хранятся загруженные с серверов сервисов вложения, что бы при повторной отправке в Telegram их не нужно было загружать заново. По умолчанию используется папка во временной директории системы")
+	"""Путь к папке, в которой временно хранятся загруженные с серверов сервисов вложения, что бы при повторной отправке в Telegram их не нужно было загружать заново. По умолчанию используется папка во временной директории системы."""
+	media_spool_max_size_mb: int = Field(1024, description="Максимальный размер папки с временно хранимыми вложениями в МБ. При превышении удаляются давно не использованные вложения", ge=0)
+	"""Максимальный размер папки с временно хранимыми вложениями в МБ. При превышении удаляются давно не использованные вложения."""
+	media_spool_mmap: bool = Field(False, description="Читать ли временно хранимые вложения через memory-mapping вместо обычного чтения файлов")
+	"""Читать ли временно хранимые вложения через memory-mapping вместо обычного чтения файлов."""
+
 	debug: bool = Field(False, description="Включает режим отладки")
 	"""Включает режим отладки."""
 
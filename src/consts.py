@@ -151,3 +151,17 @@ MAX_LOCAL_SERVER_UPLOAD_FILE_SIZE_BYTES = 250 * 1024 * 1024
 """Максимальный размер файла в байтах для выгрузки файла в Telegram при использовании локального сервера Bot API. По-умолчанию равен 250 МБ."""
 MAX_LOCAL_SERVER_DOWNLOAD_FILE_SIZE_BYTES = 250 * 1024 * 1024
 """Максимальный размер файла в байтах для загрузки файла из Telegram при использовании локального сервера Bot API. По-умолчанию равен 250 МБ."""
+DB_WRITE_FLUSH_INTERVAL = 5
+"""Интервал в секундах, с которым записи, ожидающие сохранения (связи ID сообщений, кэш вложений), сохраняются в БД."""
+DB_WRITE_FLUSH_BATCH_SIZE = 250
+"""Количество записей, ожидающих сохранения в БД, при котором запись будет произведена раньше интервала `DB_WRITE_FLUSH_INTERVAL`."""
+MESSAGE_MAPPING_NEGATIVE_CACHE_TTL = 60
+"""Время в секундах, в течении которого бот запоминает, что связь ID сообщения не была найдена в БД, что бы не делать повторные запросы."""
+DOCUMENT_CACHE_MAX_SIZE = 5000
+"""Максимальное количество документов пользователей и групп, хранимых в кэше документов БД."""
+DOCUMENT_CACHE_TTL = 5 * 60
+"""Время в секундах, в течении которого документ из БД хранится в кэше документов."""
+QUEUE_WAIT_HISTOGRAM_BUCKETS = [0, 0.5, 1, 2, 5, 10, 30, 60]
+"""Границы (в секундах) корзин гистограммы времени ожидания места в очереди на отправку сообщений в Telegram-группы."""
+LOG_PAYLOAD_MAX_LENGTH = 2000
+"""Максимальная длина (в символах) значения, подставляемого в отладочные сообщения через `debug_lazy()` из `logger.py`. Более длинные значения обрезаются."""
@@ -1,9 +1,15 @@
 # coding: utf-8
 
 import sys
+from typing import Callable
 
 from loguru import logger
 
+from consts import LOG_PAYLOAD_MAX_LENGTH
+
+
+_debug_enabled = True
+"""Выводятся ли отладочные сообщения. По умолчанию loguru выводит их, пока не будет вызван `init_logger()`."""
 
 def init_logger(debug: bool = False) -> None:
 	"""
@@ -24,3 +30,58 @@ def init_logger(debug: bool = False) -> None:
 	)
 	logger.add(sys.stderr, level="DEBUG" if debug else "INFO", diagnose=True)
 
+	set_debug_enabled(debug)
+
+def set_debug_enabled(enabled: bool) -> None:
+	"""
+	Указывает, выводятся ли отладочные сообщения. Вызывается из `init_logger()`.
+
+	:param enabled: Выводятся ли отладочные сообщения.
+	"""
+
+	global _debug_enabled
+
+	_debug_enabled = enabled
+
+def is_debug_enabled() -> bool:
+	"""
+	Возвращает, выводятся ли отладочные сообщения.
+	"""
+
+	return _debug_enabled
+
+def truncate(value: object, max_length: int = LOG_PAYLOAD_MAX_LENGTH) -> str:
+	"""
+	Преобразовывает значение в строку, обрезая её до `max_length` символов.
+
+	:param value: Значение.
+	:param max_length: Максимальная длина строки.
+	"""
+
+	value = str(value)
+	if len(value) <= max_length:
+		return value
+
+	return f"{value[:max_length]}... (+{len(value) - max_length} символов)"
+
+def debug_lazy(message: str, *args: Callable[[], object]) -> None:
+	"""
+	Выводит отладочное сообщение, вычисляя подставляемые в него значения лишь в режиме отладки.
+
+	В отличие от `logger.debug(f"...")`, при выключенном режиме отладки не вызывает `repr()` у больших объектов, например, у ответов API. Значения подставляются в `message` через `str.format()`, а строковые значения обрезаются до `LOG_PAYLOAD_MAX_LENGTH` символов.
+
+	Пример использования:
+	```python
+	debug_lazy("[VK] {} response: {}", lambda: method, lambda: response)
+	```
+
+	:param message: Шаблон сообщения.
+	:param args: Функции, возвращающие подставляемые значения.
+	"""
+
+	if not _debug_enabled:
+		return
+
+	values = [arg() for arg in args]
+
+	logger.opt(depth=1).debug(message, *[value if isinstance(value, (int, float)) else truncate(value) for value in values])
@@ -5,9 +5,15 @@ import asyncio
 from loguru import logger
 
 import utils
+from api import TelehooperAPI
 from config import config
 from DB import get_db
 from logger import init_logger
+from services.vk.media import close_media_session as close_vk_media_session
+from services.vk.media import get_media_spool as get_vk_media_spool
+from services.vk.vk_api.api import close_session as close_vk_session
+from services.vk.vk_api.supervisor import \
+    get_supervisor as get_vk_longpoll_supervisor
 from telegram import bot
 
 
@@ -62,6 +68,9 @@ async def bot_init() -> None:
 	logger.info("Загружаю кэш вложений...")
 	await bot.load_cached_attachments()
 
+	# Подготавливаем БД для сохранённых сообщений.
+	await bot.init_saved_messages()
+
 	# Устанавливаем команды.
 	await bot.set_commands()
 
@@ -70,6 +79,17 @@ async def bot_init() -> None:
 	await bot.bot.delete_webhook(drop_pending_updates=True)
 	await bot.dispatcher.start_polling(bot.bot, allowed_updates=bot.dispatcher.resolve_used_update_types())
 
+	# Сохраняем в БД записи, которые ещё не были записаны.
+	await TelehooperAPI.flush_pending_writes()
+
+	# Закрываем общие сессии для API, вложений и longpoll'ов ВКонтакте.
+	await close_vk_session()
+	await close_vk_media_session()
+	await get_vk_longpoll_supervisor().close()
+
+	# Удаляем временно хранимые вложения.
+	get_vk_media_spool().clear()
+
 # Запускаем бота.
 if __name__ == "__main__":
 	loop = asyncio.new_event_loop()
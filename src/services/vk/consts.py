@@ -18,8 +18,80 @@ VK_MESSAGES_API_RESTRICTION_DOCS_VK_URL = "https://dev.vk.com/reference/roadmap#
 """Ссылка на документацию ВКонтакте, описывающую ограничения Messages API."""
 VK_MESSAGES_API_RESTRICTION_DOCS_GITHUB_URL = f"{GITHUB_SOURCES_URL}/blob/rewrite/src/services/vk/README.md#ограничения-messaging-api"
 """Ссылка на Github-документацию об ограничении VK Messaging API."""
+VK_API_URL = "https://api.vk.com/method"
+"""URL, по которому выполняются запросы к API ВКонтакте."""
+VK_API_CONNECTIONS_LIMIT = 100
+"""Максимальное количество одновременных соединений в общей aiohttp-сессии для API ВКонтакте."""
+VK_API_CONNECTIONS_PER_HOST = 50
+"""Максимальное количество одновременных соединений к одному хосту в общей aiohttp-сессии для API ВКонтакте."""
+VK_API_DNS_CACHE_TTL = 5 * 60
+"""Время (в секундах), в течении которого кэшируются DNS-записи для API ВКонтакте."""
+VK_API_KEEPALIVE_TIMEOUT = 60
+"""Время (в секундах), в течении которого неиспользуемое keep-alive соединение к API ВКонтакте остаётся открытым."""
+VK_API_REQUEST_TIMEOUT = 60
+"""Максимальное время (в секундах) выполнения одного запроса к API ВКонтакте."""
+VK_API_BATCH_WINDOW = 0.05
+"""Время (в секундах), в течении которого вызовы API ВКонтакте накапливаются для объединения в один запрос `execute`."""
+VK_API_BATCH_MAX_CALLS = 25
+"""Максимальное количество вызовов API ВКонтакте в одном запросе `execute`. Ограничено самим ВКонтакте."""
+VK_API_RATE_LIMIT = 3
+"""Максимальное количество запросов в секунду к API ВКонтакте для одного токена."""
+VK_API_RATE_LIMIT_MIN = 0.5
+"""Минимальное количество запросов в секунду к API ВКонтакте, до которого может замедлиться планировщик запросов при получении ошибок 6."""
+VK_API_RATE_LIMIT_INCREASE = 0.05
+"""Величина, на которую увеличивается скорость (запросов в секунду) планировщика запросов после каждого успешного запроса."""
+VK_API_RATE_LIMIT_DECREASE = 0.5
+"""Множитель, на который умножается скорость планировщика запросов при получении ошибки 6."""
+VK_API_RATE_LIMIT_RETRIES = 3
+"""Максимальное количество повторных попыток запроса к API ВКонтакте после получения ошибки 6."""
+VK_API_RATE_LIMIT_BACKOFF = 1
+"""Начальная задержка (в секундах) перед повторной попыткой запроса после получения ошибки 6. Удваивается с каждой попыткой."""
+VK_API_RATE_LIMIT_BACKOFF_MAX = 10
+"""Максимальная задержка (в секундах) перед повторной попыткой запроса после получения ошибки 6."""
+VK_LONGPOLL_TIMEOUT_SLACK = 10
+"""Время (в секундах), которое добавляется к `wait` longpoll'а при ожидании ответа от longpoll-сервера."""
+VK_LONGPOLL_CONNECT_TIMEOUT = 10
+"""Максимальное время (в секундах) подключения к longpoll-серверу."""
+VK_LONGPOLL_SERVER_REFRESH_RETRIES = 3
+"""Количество подряд идущих ошибок соединения с longpoll-сервером, после которых запрашивается новый longpoll-сервер."""
+VK_LONGPOLL_RETRY_DELAY_MAX = 5
+"""Максимальная задержка (в секундах) перед повторным подключением к longpoll-серверу после ошибки соединения."""
+VK_LONGPOLL_MAX_WORKERS = 8
+"""Максимальное количество longpoll-событий одного пользователя, обрабатываемых одновременно (из разных чатов)."""
+VK_LONGPOLL_MAX_PENDING_EVENTS = 500
+"""Максимальное количество необработанных longpoll-событий одного пользователя, после которого получение новых событий приостанавливается."""
 VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT = 5
 """Максимальное количество глобальных ошибок VK Longpoll, при достижении которых автоматически отключается longpoll."""
+VK_LONGPOLL_CONNECTIONS_LIMIT = 10_000
+"""Максимальное количество одновременных соединений в общей aiohttp-сессии для longpoll-серверов ВКонтакте."""
+VK_LONGPOLL_START_INTERVAL = 0.02
+"""Минимальный интервал (в секундах) между запусками (и перезапусками) longpoll'ов разных пользователей."""
+VK_LONGPOLL_MAX_CONNECTING = 20
+"""Максимальное количество longpoll'ов, одновременно запрашивающих longpoll-сервер через `messages.getLongPollServer`."""
+VK_LONGPOLL_RESTART_BACKOFF = 2
+"""Начальная задержка (в секундах) перед перезапуском longpoll'а после глобальной ошибки. Удваивается с каждой ошибкой."""
+VK_LONGPOLL_RESTART_BACKOFF_MAX = 120
+"""Максимальная задержка (в секундах) перед перезапуском longpoll'а после глобальной ошибки."""
+VK_MEDIA_CHUNK_SIZE = 64 * 1024
+"""Размер части (в байтах), которыми вложения ВКонтакте передаются в Telegram при потоковой передаче. Определяет потребление памяти на одну передачу."""
+VK_MEDIA_CONNECT_TIMEOUT = 10
+"""Максимальное время (в секундах) подключения к серверу ВКонтакте при загрузке вложения."""
+VK_MEDIA_READ_TIMEOUT = 60
+"""Максимальное время (в секундах) ожидания очередной части вложения при его загрузке с серверов ВКонтакте."""
+VK_MEDIA_CONNECTIONS_LIMIT = 20
+"""Максимальное количество одновременных соединений в aiohttp-сессии для загрузки вложений ВКонтакте. Загрузка вложений использует отдельную сессию, чтобы не занимать соединения, необходимые для API ВКонтакте."""
+VK_ATTACHMENTS_MAX_CONCURRENCY = 4
+"""Максимальное количество вложений, одновременно подготавливаемых (загружаемых с серверов ВКонтакте) для сообщений одного пользователя."""
+VK_MEDIA_SPOOL_MAX_SIZE = 1024 * 1024 * 1024
+"""Максимальный размер (в байтах) спула вложений `MediaSpool` по умолчанию."""
+VK_VIDEO_PROBE_CACHE_MAX_SIZE = 5000
+"""Максимальное количество размеров файлов видео (для каждого из качеств), хранимых в кэше."""
+VK_VIDEO_PROBE_CACHE_TTL = 60 * 60
+"""Время (в секундах), в течении которого размер файла видео определённого качества хранится в кэше."""
+VK_FILE_CACHE_MAX_SIZE = 20000
+"""Максимальное количество `file_id` вложений ВКонтакте, хранимых в кэше `TelegramFileCache`."""
+VK_FILE_CACHE_TTL = 24 * 60 * 60
+"""Время (в секундах), в течении которого `file_id` вложения ВКонтакте хранится в кэше `TelegramFileCache`."""
 VK_REACTION_EMOJIS = {
 	"❤": 1,
 	"🔥": 2,
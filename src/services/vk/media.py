@@ -0,0 +1,757 @@
+# coding: utf-8
+
+import asyncio
+import contextlib
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from typing import TYPE_CHECKING, AsyncGenerator, cast
+
+import aiofiles
+import aiohttp
+import cachetools
+from aiogram.types import InputFile, Message
+
+from config import config
+from logger import debug_lazy
+from services.vk.consts import (VK_API_DNS_CACHE_TTL, VK_API_KEEPALIVE_TIMEOUT,
+                                VK_FILE_CACHE_MAX_SIZE, VK_FILE_CACHE_TTL,
+                                VK_MEDIA_CHUNK_SIZE, VK_MEDIA_CONNECT_TIMEOUT,
+                                VK_MEDIA_CONNECTIONS_LIMIT,
+                                VK_MEDIA_READ_TIMEOUT, VK_MEDIA_SPOOL_MAX_SIZE,
+                                VK_VIDEO_PROBE_CACHE_MAX_SIZE,
+                                VK_VIDEO_PROBE_CACHE_TTL)
+
+if TYPE_CHECKING:
+	from aiofiles.threadpool.binary import AsyncBufferedIOBase
+	from aiogram import Bot
+
+
+class AttachmentsPrepareStats:
+	"""
+	Статистика времени подготовки вложений сообщений ВКонтакте. Отображается в `/status`.
+	"""
+
+	count: int
+	"""Количество сообщений с вложениями."""
+	total: float
+	"""Суммарное время (в секундах) подготовки вложений."""
+	max: float
+	"""Максимальное время (в секундах) подготовки вложений одного сообщения."""
+
+	def __init__(self) -> None:
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	@property
+	def average(self) -> float:
+		"""
+		Среднее время (в секундах) подготовки вложений одного сообщения.
+		"""
+
+		return self.total / self.count if self.count else 0.0
+
+_prepare_stats = AttachmentsPrepareStats()
+
+def record_attachments_prepare_time(seconds: float) -> None:
+	"""
+	Учитывает время подготовки вложений одного сообщения в статистике.
+
+	:param seconds: Время (в секундах), затраченное на подготовку всех вложений сообщения.
+	"""
+
+	_prepare_stats.count += 1
+	_prepare_stats.total += seconds
+	_prepare_stats.max = max(_prepare_stats.max, seconds)
+
+def get_attachments_prepare_stats() -> AttachmentsPrepareStats:
+	"""
+	Возвращает статистику времени подготовки вложений сообщений.
+	"""
+
+	return _prepare_stats
+
+class TelegramFileCache:
+	"""
+	Кэш `file_id` вложений ВКонтакте (фотографий, видео, документов и аудио), уже загруженных в Telegram. Общий для всех пользователей бота, поэтому одно и то же вложение, пересланное в несколько диалогов (например, популярная картинка в большой беседе), загружается с серверов ВКонтакте и выгружается в Telegram лишь один раз.
+
+	Поскольку `file_id` в Telegram действителен лишь для того бота, который загрузил файл, ключом кэша является пара из ID бота и ключа вложения ВКонтакте (результат `get_attachment_key()`, например, `photo123_456`).
+	"""
+
+	hits: int
+	"""Количество запросов к кэшу, для которых был найден `file_id`."""
+	misses: int
+	"""Количество запросов к кэшу, для которых `file_id` не был найден."""
+
+	_cache: cachetools.TTLCache[tuple[int, str], str]
+
+	def __init__(self, max_size: int = VK_FILE_CACHE_MAX_SIZE, ttl: float = VK_FILE_CACHE_TTL) -> None:
+		"""
+		Инициализирует пустой кэш.
+
+		:param max_size: Максимальное количество хранимых `file_id`. При превышении удаляются давно не использованные.
+		:param ttl: Время (в секундах), в течении которого хранится `file_id`.
+		"""
+
+		self.hits = 0
+		self.misses = 0
+
+		self._cache = cachetools.TTLCache(max_size, ttl)
+
+	def get(self, bot_id: int, key: str) -> str | None:
+		"""
+		Возвращает `file_id` вложения, если оно уже было загружено в Telegram указанным ботом.
+
+		:param bot_id: ID Telegram-бота, который будет отправлять вложение.
+		:param key: Ключ вложения ВКонтакте.
+		"""
+
+		file_id = self._cache.get((bot_id, key))
+
+		if file_id:
+			self.hits += 1
+		else:
+			self.misses += 1
+
+		return file_id
+
+	def save(self, bot_id: int, key: str, file_id: str) -> None:
+		"""
+		Сохраняет `file_id` вложения, загруженного в Telegram.
+
+		:param bot_id: ID Telegram-бота, который загрузил вложение.
+		:param key: Ключ вложения ВКонтакте.
+		:param file_id: `file_id` вложения в Telegram.
+		"""
+
+		self._cache[(bot_id, key)] = file_id
+
+	def delete(self, bot_id: int, key: str) -> None:
+		"""
+		Удаляет `file_id` вложения из кэша. Если вложения нет в кэше, то ничего не происходит.
+
+		:param bot_id: ID Telegram-бота.
+		:param key: Ключ вложения ВКонтакте.
+		"""
+
+		self._cache.pop((bot_id, key), None)
+
+	@property
+	def hit_rate(self) -> float:
+		"""
+		Доля запросов к кэшу (от `0` до `1`), для которых был найден `file_id`.
+		"""
+
+		requests = self.hits + self.misses
+
+		return self.hits / requests if requests else 0.0
+
+	def __len__(self) -> int:
+		"""
+		Возвращает количество хранимых `file_id`.
+		"""
+
+		return len(self._cache)
+
+_file_cache = TelegramFileCache()
+
+def get_file_cache() -> TelegramFileCache:
+	"""
+	Возвращает общий для всех пользователей кэш `file_id` вложений ВКонтакте.
+	"""
+
+	return _file_cache
+
+def get_message_file_id(message: Message) -> str | None:
+	"""
+	Возвращает `file_id` фотографии, видео, документа или аудио из отправленного Telegram-сообщения.
+
+	:param message: Сообщение Telegram.
+	"""
+
+	if message.photo:
+		return message.photo[-1].file_id
+
+	media = message.video or message.document or message.audio
+
+	return media.file_id if media else None
+
+_media_session: aiohttp.ClientSession | None = None
+_media_session_loop: asyncio.AbstractEventLoop | None = None
+
+def get_media_session() -> aiohttp.ClientSession:
+	"""
+	Возвращает aiohttp-сессию для загрузки вложений с серверов ВКонтакте. Сессия отделена от общей сессии API ВКонтакте (`get_session()`) и имеет свой лимит соединений, поэтому долгие загрузки больших файлов не мешают запросам к API.
+
+	Сессия создаётся при первом вызове, а так же пересоздаётся, если она была закрыта или если она была создана в другом event loop'е.
+	"""
+
+	global _media_session, _media_session_loop
+
+	loop = asyncio.get_running_loop()
+	if _media_session is None or _media_session.closed or _media_session_loop is not loop:
+		_media_session = aiohttp.ClientSession(
+			connector=aiohttp.TCPConnector(
+				limit=VK_MEDIA_CONNECTIONS_LIMIT,
+				ttl_dns_cache=VK_API_DNS_CACHE_TTL,
+				keepalive_timeout=VK_API_KEEPALIVE_TIMEOUT
+			)
+		)
+		_media_session_loop = loop
+
+	return _media_session
+
+async def close_media_session() -> None:
+	"""
+	Закрывает aiohttp-сессию, созданную через `get_media_session()`. Вызывается при остановке бота.
+	"""
+
+	global _media_session, _media_session_loop
+
+	if _media_session is not None and not _media_session.closed:
+		await _media_session.close()
+
+	_media_session = None
+	_media_session_loop = None
+
+_video_size_cache: cachetools.TTLCache[tuple[str, str], int] = cachetools.TTLCache(VK_VIDEO_PROBE_CACHE_MAX_SIZE, VK_VIDEO_PROBE_CACHE_TTL)
+
+async def probe_file_size(url: str) -> int | None:
+	"""
+	Узнаёт размер файла на серверах ВКонтакте, не загружая его. Сначала делается HEAD-запрос; если сервер не передал в нём `Content-Length`, то запрашивается лишь первый байт файла (`Range: bytes=0-0`), а размер берётся из `Content-Range`. Возвращает `None`, если размер узнать не удалось.
+
+	:param url: URL файла на серверах ВКонтакте.
+	"""
+
+	session = get_media_session()
+	timeout = aiohttp.ClientTimeout(
+		total=None,
+		sock_connect=VK_MEDIA_CONNECT_TIMEOUT,
+		sock_read=VK_MEDIA_READ_TIMEOUT
+	)
+
+	try:
+		async with session.head(url, timeout=timeout, allow_redirects=True) as response:
+			if response.status == 200 and response.content_length:
+				return response.content_length
+
+		async with session.get(url, headers={"Range": "bytes=0-0"}, timeout=timeout) as response:
+			if response.status == 206:
+				total = response.headers.get("Content-Range", "").rpartition("/")[2]
+
+				return int(total) if total.isdigit() else None
+
+			# Сервер проигнорировал Range и начал передавать весь файл; закрываем соединение, не читая его.
+			response.close()
+
+			if response.status == 200 and response.content_length:
+				return response.content_length
+	except (aiohttp.ClientError, asyncio.TimeoutError):
+		pass
+
+	return None
+
+async def probe_video_sizes(video_key: str, urls: dict[str, str]) -> dict[str, int | None]:
+	"""
+	Одновременно узнаёт размеры файлов всех качеств видео. Размеры кэшируются для каждого видео, поэтому при повторной пересылке того же видео запросы не делаются. Неудачные попытки узнать размер не кэшируются.
+
+	:param video_key: Ключ видео ВКонтакте, например, `video123_456`.
+	:param urls: Словарь вида `{качество: URL файла}`.
+	"""
+
+	sizes: dict[str, int | None] = {}
+	missing: list[str] = []
+
+	for quality in urls:
+		try:
+			sizes[quality] = _video_size_cache[(video_key, quality)]
+		except KeyError:
+			missing.append(quality)
+
+	for quality, size in zip(missing, await asyncio.gather(*[probe_file_size(urls[quality]) for quality in missing])):
+		if size is not None:
+			_video_size_cache[(video_key, quality)] = size
+
+		sizes[quality] = size
+
+	return sizes
+
+def select_video_quality(qualities: list[str], sizes: dict[str, int | None], max_size: int) -> str | None:
+	"""
+	Возвращает лучшее качество видео, размер файла которого не превышает `max_size`. Если такого качества нет, но размер некоторых качеств неизвестен, то возвращается худшее из них, поскольку оно с наибольшей вероятностью не превысит лимит. Возвращает `None`, если все качества превышают лимит.
+
+	:param qualities: Качества видео, в порядке от лучшего к худшему.
+	:param sizes: Размеры файлов качеств, полученные через `probe_video_sizes()`.
+	:param max_size: Максимальный размер файла в байтах.
+	"""
+
+	for quality in qualities:
+		size = sizes.get(quality)
+
+		if size is not None and size <= max_size:
+			return quality
+
+	unknown_size_qualities = [quality for quality in qualities if sizes.get(quality) is None]
+
+	return unknown_size_qualities[-1] if unknown_size_qualities else None
+
+class MediaSpoolEntry:
+	"""
+	Файл в спуле вложений `MediaSpool`.
+	"""
+
+	path: str
+	"""Путь к файлу на диске."""
+	size: int
+	"""Размер файла в байтах. Известен лишь после завершения загрузки."""
+	pins: int
+	"""Количество `StreamingInputFile`, использующих этот файл. Используемые файлы не удаляются из спула."""
+	complete: bool
+	"""Был ли файл полностью загружен."""
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+		self.size = 0
+		self.pins = 1
+		self.complete = False
+
+# Имена файлов спула: SHA-256 хэш ключа файла, с суффиксом `.part` для незавершённых загрузок.
+_spool_file_name_pattern = re.compile(r"[0-9a-f]{64}(\.part)?")
+
+class MediaSpool:
+	"""
+	Спул вложений: папка на диске, в которую вложения записываются при первой загрузке с серверов ВКонтакте. Повторные отправки вложения в Telegram (после таймаута, при ручной выгрузке вложений, либо при отдельной отправке аудио и документов) читают его с диска, не загружая его с серверов ВКонтакте заново.
+
+	Размер спула ограничен: при превышении лимита удаляются давно не использованные (LRU) файлы, которые в данный момент не используются ни одним `StreamingInputFile`.
+	"""
+
+	directory: str
+	"""Путь к папке спула."""
+	max_size: int
+	"""Максимальный суммарный размер файлов спула в байтах."""
+	use_mmap: bool
+	"""Читать ли файлы спула через memory-mapping вместо обычного чтения файлов."""
+	size: int
+	"""Суммарный размер загруженных файлов спула в байтах."""
+	evicted: int
+	"""Количество файлов, удалённых из спула из-за превышения лимита."""
+
+	_entries: OrderedDict[str, MediaSpoolEntry]
+	"""Файлы спула по их ключам, в порядке от давно использованных к недавно использованным."""
+	_prepared: bool
+	"""Была ли папка спула создана и очищена от файлов, оставшихся после прошлого запуска."""
+
+	def __init__(self, directory: str | None = None, max_size: int = VK_MEDIA_SPOOL_MAX_SIZE, use_mmap: bool = False) -> None:
+		"""
+		Инициализирует пустой спул. Папка спула будет создана при первой записи в неё.
+
+		:param directory: Путь к папке спула. По умолчанию используется папка во временной директории системы.
+		:param max_size: Максимальный суммарный размер файлов спула в байтах.
+		:param use_mmap: Читать ли файлы спула через memory-mapping.
+		"""
+
+		self.directory = directory or os.path.join(tempfile.gettempdir(), "telehooper-media")
+		self.max_size = max_size
+		self.use_mmap = use_mmap
+		self.size = 0
+		self.evicted = 0
+
+		self._entries = OrderedDict()
+		self._prepared = False
+
+	def _prepare_directory(self) -> None:
+		"""
+		Создаёт папку спула, удаляя из неё файлы спула, оставшиеся после прошлого запуска бота. Остальные файлы в папке не удаляются.
+		"""
+
+		if self._prepared:
+			return
+
+		os.makedirs(self.directory, exist_ok=True)
+		for name in os.listdir(self.directory):
+			if not _spool_file_name_pattern.fullmatch(name):
+				continue
+
+			with contextlib.suppress(OSError):
+				os.remove(os.path.join(self.directory, name))
+
+		self._prepared = True
+
+	def reserve(self, key: str) -> str:
+		"""
+		Добавляет в спул новый файл, используемый вызвавшим `StreamingInputFile`, и возвращает путь, по которому его нужно записать. После записи необходимо вызвать `commit()`, а при ошибке — `discard()`. Ключ не должен быть занят другим файлом (см. `is_reserved()`).
+
+		:param key: Ключ файла, например, его URL.
+		"""
+
+		assert key not in self._entries, f"Файл {key} уже есть в спуле"
+
+		self._prepare_directory()
+
+		entry = MediaSpoolEntry(os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest()))
+		self._entries[key] = entry
+
+		return entry.path + ".part"
+
+	def commit(self, key: str) -> str:
+		"""
+		Помечает файл, записанный по пути из `reserve()`, как загруженный, и возвращает путь к нему.
+
+		:param key: Ключ файла.
+		"""
+
+		entry = self._entries[key]
+
+		os.replace(entry.path + ".part", entry.path)
+		entry.size = os.path.getsize(entry.path)
+		entry.complete = True
+
+		self.size += entry.size
+		self._evict()
+
+		return entry.path
+
+	def discard(self, key: str) -> None:
+		"""
+		Удаляет из спула файл, загрузка которого не удалась.
+
+		:param key: Ключ файла.
+		"""
+
+		entry = self._entries.pop(key, None)
+		if entry is None:
+			return
+
+		for path in (entry.path + ".part", entry.path):
+			with contextlib.suppress(FileNotFoundError):
+				os.remove(path)
+
+		if entry.complete:
+			self.size -= entry.size
+
+	def is_reserved(self, key: str) -> bool:
+		"""
+		Возвращает `True`, если файл с этим ключом есть в спуле, в том числе если он ещё загружается.
+
+		:param key: Ключ файла.
+		"""
+
+		return key in self._entries
+
+	def acquire(self, key: str) -> str | None:
+		"""
+		Возвращает путь к полностью загруженному файлу, помечая его как используемый, либо `None`, если такого файла нет в спуле. После использования файла необходимо вызвать `release()`.
+
+		:param key: Ключ файла.
+		"""
+
+		entry = self._entries.get(key)
+		if entry is None or not entry.complete:
+			return None
+
+		entry.pins += 1
+		self._entries.move_to_end(key)
+
+		return entry.path
+
+	def release(self, key: str) -> None:
+		"""
+		Помечает файл как более не используемый вызвавшим `StreamingInputFile`. Файл остаётся в спуле, пока не будет вытеснен более новыми файлами.
+
+		:param key: Ключ файла.
+		"""
+
+		entry = self._entries.get(key)
+		if entry is None:
+			return
+
+		entry.pins -= 1
+		self._evict()
+
+	def _evict(self) -> None:
+		"""
+		Удаляет давно не использованные неиспользуемые файлы, пока размер спула превышает лимит.
+		"""
+
+		while self.size > self.max_size:
+			key = next((key for key, entry in self._entries.items() if entry.complete and entry.pins <= 0), None)
+			if key is None:
+				break
+
+			self.discard(key)
+			self.evicted += 1
+
+	async def read(self, path: str, chunk_size: int) -> AsyncGenerator[bytes, None]:
+		"""
+		Читает файл спула по частям.
+
+		:param path: Путь к файлу, полученный через `acquire()` либо `commit()`.
+		:param chunk_size: Размер части в байтах.
+		"""
+
+		if self.use_mmap:
+			with open(path, "rb") as file:
+				if not os.fstat(file.fileno()).st_size:
+					return
+
+				with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+					for offset in range(0, len(mapped), chunk_size):
+						yield mapped[offset:offset + chunk_size]
+
+			return
+
+		async with aiofiles.open(path, "rb") as file:
+			while chunk := await file.read(chunk_size):
+				yield chunk
+
+	def clear(self) -> None:
+		"""
+		Удаляет все файлы спула. Вызывается при остановке бота.
+		"""
+
+		for key in list(self._entries):
+			self.discard(key)
+
+	def __len__(self) -> int:
+		"""
+		Возвращает количество файлов в спуле.
+		"""
+
+		return len(self._entries)
+
+_media_spool: MediaSpool | None = None
+
+def get_media_spool() -> MediaSpool:
+	"""
+	Возвращает общий для всех пользователей спул вложений.
+	"""
+
+	global _media_spool
+
+	if _media_spool is None:
+		_media_spool = MediaSpool(
+			directory=config.media_spool_path,
+			max_size=config.media_spool_max_size_mb * 1024 * 1024,
+			use_mmap=config.media_spool_mmap
+		)
+
+	return _media_spool
+
+class StreamingInputFile(InputFile):
+	"""
+	`InputFile`, который передаёт файл с серверов ВКонтакте в Telegram по частям, не загружая его целиком в память. Потребление памяти на одну передачу ограничено размером части `chunk_size`.
+
+	Во время первой передачи файл параллельно записывается в спул вложений (`MediaSpool`). Если Telegram прервал передачу (например, из-за таймаута), то файл догружается в спул в фоне. Повторные передачи читают файл из спула, поэтому файл никогда не загружается с серверов ВКонтакте дважды. Файлы с одинаковым `key` (по умолчанию — URL) используют одну и ту же уже загруженную копию в спуле.
+	"""
+
+	url: str
+	"""URL файла на серверах ВКонтакте."""
+	key: str
+	"""Ключ файла в спуле вложений."""
+	size: int | None
+	"""Размер файла в байтах, если сервер передал его в `Content-Length`."""
+	spool: MediaSpool
+	"""Спул вложений, в который записывается файл."""
+	spool_path: str | None
+	"""Путь к копии файла в спуле, если файл был полностью загружен."""
+
+	_response: aiohttp.ClientResponse | None
+	"""Открытый ответ сервера, созданный в `open()` и ещё не прочитанный в `read()`."""
+	_reader: AsyncGenerator[bytes, None] | None
+	"""Генератор последней передачи файла, созданный в `read()`."""
+	_download: asyncio.Task | None
+	"""Задача, догружающая файл в спул после того, как передача была прервана."""
+
+	def __init__(self, url: str, filename: str, chunk_size: int = VK_MEDIA_CHUNK_SIZE, key: str | None = None, spool: MediaSpool | None = None) -> None:
+		"""
+		Инициализирует файл. Загрузка файла начнётся лишь при вызове `open()` либо `read()`.
+
+		:param url: URL файла на серверах ВКонтакте.
+		:param filename: Название файла, которое будет передано в Telegram.
+		:param chunk_size: Размер части (в байтах), которыми передаётся файл.
+		:param key: Ключ файла в спуле вложений. По умолчанию используется URL.
+		:param spool: Спул вложений. По умолчанию используется общий спул из `get_media_spool()`.
+		"""
+
+		super().__init__(filename=filename, chunk_size=chunk_size)
+
+		self.url = url
+		self.key = key or url
+		self.size = None
+		self.spool = spool if spool is not None else get_media_spool()
+		self.spool_path = None
+
+		self._response = None
+		self._reader = None
+		self._download = None
+
+	async def _request(self) -> aiohttp.ClientResponse:
+		"""
+		Начинает загрузку файла с серверов ВКонтакте.
+		"""
+
+		response = await get_media_session().get(
+			self.url,
+			timeout=aiohttp.ClientTimeout(
+				total=None,
+				sock_connect=VK_MEDIA_CONNECT_TIMEOUT,
+				sock_read=VK_MEDIA_READ_TIMEOUT
+			)
+		)
+
+		if response.status != 200:
+			response.release()
+
+			raise Exception(f"Не удалось загрузить файл «{self.filename}»: HTTP {response.status}")
+
+		length = response.headers.get("Content-Length")
+		self.size = int(length) if length else None
+
+		return response
+
+	async def _acquire_spooled(self, previous_reader: AsyncGenerator[bytes, None] | None) -> bool:
+		"""
+		Дожидается завершения прерванной ранее передачи и фоновой загрузки файла, и возвращает `True`, если файл есть в спуле.
+
+		:param previous_reader: Генератор предыдущей передачи файла.
+		"""
+
+		# Генератор прерванной передачи мог ещё не быть закрыт; закрываем его, что бы файл начал догружаться в спул.
+		if previous_reader is not None:
+			with contextlib.suppress(RuntimeError):
+				await previous_reader.aclose()
+
+		if self._download is not None:
+			download, self._download = self._download, None
+
+			await download
+
+		if self.spool_path is None:
+			self.spool_path = self.spool.acquire(self.key)
+
+		return self.spool_path is not None
+
+	async def open(self) -> int | None:
+		"""
+		Начинает загрузку файла, не читая его содержимое, и возвращает его размер, если сервер передал его. Содержимое файла будет прочитано позже, в `read()`. Если файл уже есть в спуле, то запрос к серверам ВКонтакте не делается.
+
+		Если файл не будет отправлен, то необходимо вызвать `close()`.
+		"""
+
+		if self.spool_path is None and self._response is None:
+			self.spool_path = self.spool.acquire(self.key)
+
+			if self.spool_path is not None:
+				self.size = os.path.getsize(self.spool_path)
+			else:
+				self._response = await self._request()
+
+		return self.size
+
+	def read(self, bot: "Bot") -> AsyncGenerator[bytes, None]:
+		self._reader = self._read(self._reader)
+
+		return self._reader
+
+	async def _read(self, previous_reader: AsyncGenerator[bytes, None] | None) -> AsyncGenerator[bytes, None]:
+		"""
+		Передаёт файл по частям: из спула, если файл уже был загружен, либо с серверов ВКонтакте, параллельно записывая его в спул.
+
+		:param previous_reader: Генератор предыдущей передачи файла.
+		"""
+
+		if await self._acquire_spooled(previous_reader):
+			async for chunk in self.spool.read(cast(str, self.spool_path), self.chunk_size):
+				yield chunk
+
+			return
+
+		# Тот же файл прямо сейчас загружается другим `StreamingInputFile`. Ожидание его загрузки могло бы
+		# никогда не завершиться (например, если оба файла находятся в одной медиа-группе), поэтому загружаем свою копию.
+		if self.spool.is_reserved(self.key):
+			self.key = f"{self.key}#{id(self)}"
+
+		spool_path = self.spool.reserve(self.key)
+
+		try:
+			response = self._response or await self._request()
+			file = await aiofiles.open(spool_path, "wb")
+		except BaseException:
+			self.spool.discard(self.key)
+
+			raise
+		finally:
+			self._response = None
+
+		completed = False
+		try:
+			async for chunk in response.content.iter_chunked(self.chunk_size):
+				await file.write(chunk)
+
+				yield chunk
+
+			completed = True
+		finally:
+			if completed:
+				await file.close()
+				response.release()
+
+				self.spool_path = self.spool.commit(self.key)
+			else:
+				# Передача была прервана; догружаем файл в спул в фоне, что бы повторная передача не загружала его заново.
+				self._download = asyncio.create_task(self._finish_download(response, file))
+
+	async def _finish_download(self, response: aiohttp.ClientResponse, file: "AsyncBufferedIOBase") -> None:
+		"""
+		Догружает в спул файл, передача которого была прервана. Если загрузка не удалась, то файл удаляется из спула, и при следующей передаче будет загружен заново.
+
+		:param response: Ответ сервера, из которого читается файл.
+		:param file: Открытый для записи файл в спуле.
+		"""
+
+		try:
+			async for chunk in response.content.iter_chunked(self.chunk_size):
+				await file.write(chunk)
+
+			await file.close()
+
+			self.spool_path = self.spool.commit(self.key)
+		except BaseException as error:
+			await file.close()
+			self.spool.discard(self.key)
+
+			if not isinstance(error, Exception):
+				raise
+
+			debug_lazy("Не удалось догрузить файл {} в спул: {}", lambda: self.filename, lambda: error)
+		finally:
+			response.release()
+
+	async def close(self) -> None:
+		"""
+		Прерывает незавершённую загрузку файла и помечает его копию в спуле как неиспользуемую. Сама копия остаётся в спуле, пока не будет вытеснена более новыми файлами.
+		"""
+
+		if self._reader is not None:
+			reader, self._reader = self._reader, None
+
+			with contextlib.suppress(RuntimeError):
+				await reader.aclose()
+
+		if self._download is not None:
+			download, self._download = self._download, None
+
+			download.cancel()
+			await asyncio.gather(download, return_exceptions=True)
+
+		if self._response is not None:
+			self._response.close()
+			self._response = None
+
+		if self.spool_path is not None:
+			self.spool.release(self.key)
+			self.spool_path = None
@@ -4,8 +4,9 @@ from __future__ import annotations
 
 import asyncio
 import json
+import time
 from asyncio.exceptions import TimeoutError
-from typing import TYPE_CHECKING, Literal, Optional, cast
+from typing import TYPE_CHECKING, Callable, Literal, Optional, cast
 
 import aiohttp
 import cachetools
@@ -31,26 +32,34 @@ from pyrate_limiter.limiter import Limiter
 import utils
 from config import config
 from DB import get_user
+from logger import debug_lazy
 from services.service_api_base import (BaseTelehooperServiceAPI,
                                        ServiceDialogue,
                                        ServiceDisconnectReason,
                                        TelehooperServiceUserInfo)
-from services.vk.consts import (VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT,
+from services.vk.consts import (VK_ATTACHMENTS_MAX_CONCURRENCY,
                                 VK_REACTION_EMOJIS)
 from services.vk.exceptions import (AccessDeniedException,
                                     TokenRevokedException,
                                     TooManyRequestsException)
+from services.vk.media import (StreamingInputFile, get_file_cache,
+                               get_message_file_id, probe_video_sizes,
+                               record_attachments_prepare_time,
+                               select_video_quality)
 from services.vk.utils import (create_message_link, extract_id_from_domain,
                                get_attachment_key, get_message_mentions,
                                prepare_sticker, random_id)
 from services.vk.vk_api.api import VKAPI
 from services.vk.vk_api.longpoll import (BaseVKLongpollEvent,
+                                         LongpollEventDispatcher,
                                          LongpollMessageEditEvent,
                                          LongpollMessageFlagsEdit,
                                          LongpollNewMessageEvent,
                                          LongpollTypingEventMultiple,
-                                         LongpollVoiceMessageEvent,
-                                         VKAPILongpoll)
+                                         LongpollVoiceMessageEvent)
+from services.vk.vk_api.scheduler import remove_scheduler
+from services.vk.vk_api.supervisor import (LongpollState, SupervisedLongpoll,
+                                           get_supervisor as get_longpoll_supervisor)
 
 if TYPE_CHECKING:
 	from api import TelehooperMessage, TelehooperSubGroup, TelehooperUser
@@ -72,14 +81,14 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 	"""Задача, выполняющая longpoll."""
 	_cachedUsersInfo: cachetools.TLRUCache[int, TelehooperServiceUserInfo] # 50 элементов, 30 минут хранения.
 	"""Кэшированные данные о пользователях ВКонтакте для быстрого повторного получения."""
-	_globalErrorAmount: int
-	"""Количество глобальных ошибок. При достижении определённого количества ошибок (см. `VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT`), VK longpoll автоматически отключается от бота."""
 	_lastOnlineStatus: int = 0
 	"""UNIX-timestamp последнего обновления статуса онлайна через бота. Используется для настройки `Services.VK.SetOnline`."""
 	_autoReadChats: dict[int, asyncio.Task]
 	"""Словарь, хранящий asyncio.Task для 'прочитывания' сообщений после их отправки собеседником. Используется для настройки `Services.VK.AutoRead`."""
+	_attachmentSemaphore: asyncio.Semaphore
+	"""Семафор, ограничивающий количество одновременно подготавливаемых вложений сообщений этого пользователя."""
 
-	def __init__(self, token: SecretStr, vk_user_id: int, user: "TelehooperUser", limiter: Limiter = Limiter([Rate(2, 1), Rate(20, 60)])) -> None:
+	def __init__(self, token: SecretStr, vk_user_id: int, user: "TelehooperUser", limiter: Limiter | None = None) -> None:
 		super().__init__("VK", vk_user_id, user)
 
 		self.token = token
@@ -87,85 +96,109 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 
 		self.vkAPI = VKAPI(self.token)
 
-		self.limiter = limiter
+		# Лимитер отвечает лишь за частоту отправки сообщений от имени пользователя,
+		# а частота всех запросов к API ограничивается планировщиком запросов внутри VKAPI.
+		self.limiter = limiter or Limiter([Rate(2, 1), Rate(20, 60)])
 		self._cachedUsersInfo = cachetools.TLRUCache(maxsize=50, ttu=lambda _, value, now: now + 30 * 60)
-		self._globalErrorAmount = 0
 		self._autoReadChats = {}
+		self._attachmentSemaphore = asyncio.Semaphore(VK_ATTACHMENTS_MAX_CONCURRENCY)
 
 	async def start_listening(self, bot: Bot | None = None) -> asyncio.Task:
-		async def handle_updates() -> None:
-			while self._globalErrorAmount < VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT:
-				try:
-					longpoll = VKAPILongpoll(self.vkAPI)
+		from api import TelehooperAPI
 
-					async for event in longpoll.listen_for_updates():
-						await self.handle_longpoll_update(event)
-				except TokenRevokedException as e:
-					# Отправляем сообщение, если у нас есть объект бота.
-					if bot:
-						try:
-							await bot.send_message(
-								chat_id=self.user.telegramUser.id,
-								text=(
-									"<b>⚠️ Потеряно соединение с ВКонтакте</b>.\n"
-									"\n"
-									"Telehooper потерял соединение со страницей «ВКонтакте», поскольку владелец страницы отозвал доступ к ней через настройки «Приватности» страницы.\n"
-									"\n"
-									"ℹ️ Вы можете повторно подключиться к «ВКонтакте», используя команду /connect.\n"
-								)
-							)
-						except:
-							pass
 
-					# Совершаем отключение.
-					await self.disconnect_service(ServiceDisconnectReason.EXTERNAL)
+		# События из разных чатов обрабатываются параллельно, что бы, к примеру, долгая загрузка видео
+		# в одном чате не задерживала сообщения из других чатов и получение новых событий с longpoll-сервера.
+		dispatcher = LongpollEventDispatcher(self.handle_longpoll_update)
 
-					break
-				except Exception as error:
-					self._globalErrorAmount += 1
-					threshold_reached = self._globalErrorAmount >= VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT
-					logger.exception(f"Глобальная ошибка #{self._globalErrorAmount}/{VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT} обновления ВКонтакте, со связанным Telegram-пользователем {utils.get_telegram_logging_info(self.user.telegramUser)}:", error)
+		# Позиция longpoll'а сохраняется лишь после обработки всех событий до неё. Запись в БД производится
+		# в фоне, и для каждого пользователя сохраняется лишь последняя позиция.
+		dispatcher.on_acknowledge = lambda ts, pts: TelehooperAPI.save_longpoll_checkpoint(self.service_name, self.service_user_id, ts, pts)
 
-					# Отправляем сообщение, если у нас есть объект бота.
-					if bot:
-						upper_text = (
-							"Ввиду произошедшей ошибки, какое-то из событий, произошедшее на стороне ВКонтакте могло быть пропущено. 😕\n"
-							"\n"
-							f"Учтите, бот будет вынужден принудительно отсоединить Вашу страницу от себя если подобная ошибка произойдёт ещё {VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT - self._globalErrorAmount + 1} раз(-а)."
-						)
-						if threshold_reached:
-							upper_text = (
-								f"Поскольку Telehooper уже {VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT} раз(-а) сталкивася с ошибками, бот будет вынужден отсоединить Вашу страницу ВКонтакте от себя с целью предотвращения дальнейших ошибок и предупреждений.\n"
+		# Longpoll'ы всех пользователей запускаются и перезапускаются через общий supervisor.
+		supervisor = get_longpoll_supervisor()
+
+		# Продолжаем с позиции, на которой longpoll остановился до перезапуска бота.
+		checkpoint = await TelehooperAPI.get_longpoll_checkpoint(self.service_name, self.service_user_id)
+
+		async def run(longpoll: SupervisedLongpoll) -> None:
+			vk_longpoll = supervisor.create_longpoll(self.vkAPI, longpoll, checkpoint=dispatcher.acknowledged_position or checkpoint, on_position=dispatcher.mark)
+
+			async for event in vk_longpoll.listen_for_updates():
+				await dispatcher.dispatch(event)
+
+		async def on_error(error: Exception, longpoll: SupervisedLongpoll) -> bool:
+			if isinstance(error, TokenRevokedException):
+				# Отправляем сообщение, если у нас есть объект бота.
+				if bot:
+					try:
+						await bot.send_message(
+							chat_id=self.user.telegramUser.id,
+							text=(
+								"<b>⚠️ Потеряно соединение с ВКонтакте</b>.\n"
+								"\n"
+								"Telehooper потерял соединение со страницей «ВКонтакте», поскольку владелец страницы отозвал доступ к ней через настройки «Приватности» страницы.\n"
 								"\n"
-								"<b>⚠️ Вы не будете получать новые сообщения в боте Telehooper</b> до тех пор, пока Вы не подключите свою страницу снова."
+								"ℹ️ Вы можете повторно подключиться к «ВКонтакте», используя команду /connect.\n"
 							)
+						)
+					except:
+						pass
 
-						try:
-							await bot.send_message(
-								chat_id=self.user.telegramUser.id,
-								text=(
-									"<b>⚠️ Ошибка при работе с ВКонтакте</b>.\n"
-									"\n"
-									"Что-то пошло не так, и Telehooper столкнулся с серьёзной ошибкой при работе с «ВКонтакте».\n"
-									f"{upper_text}\n"
-									"\n"
-									"<b>Текст ошибки, если Вас попросили его отправить</b>:\n"
-									f"<code>{error.__class__.__name__}: {error}</code>.\n"
-									"\n"
-									f"ℹ️ Если проблема не проходит через время - попробуйте попросить помощи либо создать баг-репорт (Github Issue), по ссылке в команде <a href=\"{utils.create_command_url('/h 6')}\">/help</a>."
+				# Совершаем отключение.
+				await self.disconnect_service(ServiceDisconnectReason.EXTERNAL)
 
-								)
-							)
-						except:
-							pass
+				return False
+
+			threshold_reached = longpoll.state is LongpollState.FAILED
+			logger.exception(f"Глобальная ошибка #{longpoll.errors}/{supervisor.max_errors} обновления ВКонтакте, со связанным Telegram-пользователем {utils.get_telegram_logging_info(self.user.telegramUser)}:", error)
+
+			# Отправляем сообщение, если у нас есть объект бота.
+			if bot:
+				upper_text = (
+					"Ввиду произошедшей ошибки, какое-то из событий, произошедшее на стороне ВКонтакте могло быть пропущено. 😕\n"
+					"\n"
+					f"Учтите, бот будет вынужден принудительно отсоединить Вашу страницу от себя если подобная ошибка произойдёт ещё {supervisor.max_errors - longpoll.errors + 1} раз(-а)."
+				)
+				if threshold_reached:
+					upper_text = (
+						f"Поскольку Telehooper уже {supervisor.max_errors} раз(-а) сталкивася с ошибками, бот будет вынужден отсоединить Вашу страницу ВКонтакте от себя с целью предотвращения дальнейших ошибок и предупреждений.\n"
+						"\n"
+						"<b>⚠️ Вы не будете получать новые сообщения в боте Telehooper</b> до тех пор, пока Вы не подключите свою страницу снова."
+					)
+
+				try:
+					await bot.send_message(
+						chat_id=self.user.telegramUser.id,
+						text=(
+							"<b>⚠️ Ошибка при работе с ВКонтакте</b>.\n"
+							"\n"
+							"Что-то пошло не так, и Telehooper столкнулся с серьёзной ошибкой при работе с «ВКонтакте».\n"
+							f"{upper_text}\n"
+							"\n"
+							"<b>Текст ошибки, если Вас попросили его отправить</b>:\n"
+							f"<code>{error.__class__.__name__}: {error}</code>.\n"
+							"\n"
+							f"ℹ️ Если проблема не проходит через время - попробуйте попросить помощи либо создать баг-репорт (Github Issue), по ссылке в команде <a href=\"{utils.create_command_url('/h 6')}\">/help</a>."
+
+						)
+					)
+				except:
+					pass
 
 			# Если было превышено количество ошибок, то делаем принудительное отключение страницы.
-			if self._globalErrorAmount >= VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT:
-				logger.warning(f"Telegram-пользователь {utils.get_telegram_logging_info(self.user.telegramUser)} превысил порог в {VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT} глобальных ошибок VK longpoll, совершаю принудительное отключение страницы")
+			if threshold_reached:
+				logger.warning(f"Telegram-пользователь {utils.get_telegram_logging_info(self.user.telegramUser)} превысил порог в {supervisor.max_errors} глобальных ошибок VK longpoll, совершаю принудительное отключение страницы")
 
 				await self.disconnect_service(ServiceDisconnectReason.ERRORED)
 
-		self._longPollTask = asyncio.create_task(handle_updates())
+				return False
+
+			return True
+
+		self._longPollTask = supervisor.start(self.service_user_id, run, on_error)
+		self._longPollTask.add_done_callback(lambda _: dispatcher.cancel())
+
 		return self._longPollTask
 
 	async def handle_longpoll_update(self, event: BaseVKLongpollEvent) -> None:
@@ -175,7 +208,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 		:param event: Событие, полученное с longpoll-сервера.
 		"""
 
-		logger.debug(f"[VK] Новое событие {event.__class__.__name__}: {event.event_data}")
+		debug_lazy("[VK] Новое событие {}: {}", lambda: event.__class__.__name__, lambda: event.event_data)
 
 		if type(event) is LongpollNewMessageEvent:
 			await self.handle_vk_message(event)
@@ -404,14 +437,18 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 						else:
 							await subgroup.parent.unpin_message(telegram_message.telegram_message_ids[0])
 
-		logger.debug(f"[VK] Сообщение с текстом \"{event.text}\", для подгруппы \"{subgroup.service_dialogue_name}\"")
+		debug_lazy("[VK] Сообщение с текстом \"{}\", для подгруппы \"{}\"", lambda: event.text, lambda: subgroup.service_dialogue_name)
 
 		message_url = None
 		keyboard = None
 		original_message_sender_id = event.from_id if event.from_id != self.service_user_id else None
+		media_files: list[StreamingInputFile] = []
 		try:
 			attachment_media: list[InputMediaAudio | InputMediaDocument | InputMediaPhoto | InputMediaVideo] = []
 			attachment_items: list[str] = []
+			attachment_slots: list[tuple[list[InputMediaAudio | InputMediaDocument | InputMediaPhoto | InputMediaVideo], list[str]]] = []
+			file_cache_keys: dict[int, str] = {}
+			cached_file_media: dict[int, str] = {}
 			use_compact_names = await self.user.get_setting("Services.VK.CompactNames")
 			use_mobile_vk = await self.user.get_setting("Services.VK.MobileVKURLs")
 			message_url = create_message_link(event.peer_id, event.message_id, use_mobile=use_mobile_vk)
@@ -602,364 +639,486 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 
 					return
 
+				def attach_file(media: InputMediaAudio | InputMediaDocument | InputMediaPhoto | InputMediaVideo, cache_key: str, from_cache: bool, attachment_media: list[InputMediaAudio | InputMediaDocument | InputMediaPhoto | InputMediaVideo]) -> None:
+					"""
+					Прикрепляет вложение к сообщению, запоминая, был ли его `file_id` взят из кэша. `file_id` вложений, которые не были найдены в кэше, будут сохранены в кэш после отправки сообщения, а недействительные `file_id` из кэша будут удалены из него при ошибке отправки.
+
+					:param media: Вложение.
+					:param cache_key: Ключ вложения в кэше `file_id`.
+					:param from_cache: Было ли вложение взято из кэша `file_id`.
+					:param attachment_media: Список, в который добавляется вложение.
+					"""
+
+					if from_cache:
+						cached_file_media[id(media)] = cache_key
+					else:
+						file_cache_keys[id(media)] = cache_key
+
+					attachment_media.append(media)
+
 				# Проходимся по всем вложениям.
-				if message_extended and "attachments" in message_extended:
-					for attch_index, attachment in enumerate(message_extended["attachments"]):
-						attachment_type = attachment["type"]
-						attachment = attachment[attachment["type"]]
-
-						if attachment_type == "photo":
-							# Проходимся по всем размерам фотографии и выбираем самый большой.
-							sizes_sorted = sorted(attachment["sizes"], key=lambda size: size["width"] * size["height"], reverse=True)
-
-							attachment_media.append(
-								InputMediaPhoto(
-									type=InputMediaType.PHOTO,
-									media=sizes_sorted[0]["url"],
+				async def prepare_attachment(attch_index: int, attachment: dict, attachment_media: list[InputMediaAudio | InputMediaDocument | InputMediaPhoto | InputMediaVideo], attachment_items: list[str]) -> bool:
+					"""
+					Подготавливает одно вложение сообщения, добавляя его в `attachment_media` либо ссылку на него в `attachment_items`. Возвращает `True`, если вложение было отправлено отдельным сообщением (например, стикер), и дальнейшая обработка сообщения не нужна.
+
+					:param attch_index: Индекс вложения в сообщении.
+					:param attachment: Вложение, полученное через API.
+					:param attachment_media: Список, в который добавляются медиа-вложения.
+					:param attachment_items: Список, в который добавляются ссылки на вложения.
+					"""
+
+					nonlocal webpage_preview_url
+
+					attachment_type = attachment["type"]
+					attachment = attachment[attachment["type"]]
+
+					if attachment_type == "photo":
+						# Проходимся по всем размерам фотографии и выбираем самый большой.
+						sizes_sorted = sorted(attachment["sizes"], key=lambda size: size["width"] * size["height"], reverse=True)
+
+						# Если эта фотография уже была загружена в Telegram, то используем её file_id.
+						cache_key = get_attachment_key(attachment, "photo", include_access_key=False)
+						file_id = file_cache.get(sending_bot.id, cache_key)
+
+						attach_file(
+							InputMediaPhoto(
+								type=InputMediaType.PHOTO,
+								media=file_id or sizes_sorted[0]["url"],
+								parse_mode="HTML"
+							),
+							cache_key,
+							bool(file_id),
+							attachment_media
+						)
+					elif attachment_type == "video":
+						# Так как ВК не выдают прямую ссылку на видео, необходимо её извлечь из API.
+						# Что важно, передать ссылку напрямую не получается, поскольку ВК проверяет
+						# UserAgent и IP адрес, с которого был сделан запрос.
+
+						# Проверяем, видеосообщение (кружочек) ли это?
+						is_video_note = attachments.get(f"attach{attch_index + 1}_kind") == "video_message"
+
+						# Если это видео уже было загружено в Telegram, то не загружаем его повторно.
+						# Видеосообщения отправляются отдельным сообщением, поэтому они не кэшируются.
+						cache_key = get_attachment_key(attachment, "video", include_access_key=False)
+						file_id = None if is_video_note else file_cache.get(sending_bot.id, cache_key)
+						if file_id:
+							attach_file(
+								InputMediaVideo(
+									type=InputMediaType.VIDEO,
+									media=file_id,
 									parse_mode="HTML"
-								)
+								),
+								cache_key,
+								True,
+								attachment_media
 							)
-						elif attachment_type == "video":
-							# Так как ВК не выдают прямую ссылку на видео, необходимо её извлечь из API.
-							# Что важно, передать ссылку напрямую не получается, поскольку ВК проверяет
-							# UserAgent и IP адрес, с которого был сделан запрос.
 
-							# Проверяем, видеосообщение (кружочек) ли это?
-							is_video_note = attachments.get(f"attach{attch_index + 1}_kind") == "video_message"
+							return False
 
-							# Для отображения прогресса отправки сообщения с вложениями, бот должен показать пользователям надпись "Telehooper отправляет видео...".
-							# Если мы находимся в беседе, то нужно найти того минибота, который связан с пользователем, который отправляет видео.
-							upload_bot = subgroup.parent.bot
-							if is_convo:
-								upload_bot = await subgroup.parent.get_associated_bot(original_message_sender_id) or subgroup.parent.bot
+						# Для отображения прогресса отправки сообщения с вложениями, бот должен показать пользователям надпись "Telehooper отправляет видео...".
+						# Если мы находимся в беседе, то нужно найти того минибота, который связан с пользователем, который отправляет видео.
+						upload_bot = subgroup.parent.bot
+						if is_convo:
+							upload_bot = await subgroup.parent.get_associated_bot(original_message_sender_id) or subgroup.parent.bot
 
-							async with ChatActionSender(chat_id=subgroup.parent.chat.id, action="upload_video", bot=upload_bot):
-								video = (await self.vkAPI.video_get(videos=get_attachment_key(attachment)))["items"][0]
-								if "files" not in video:
-									# В случаях, если видео помечено как "доступно только подписчикам", ВК не даёт ссылок на скачивание.
-									# В таких случаях мы просто отображаем видео как ссылку на него.
+						async with ChatActionSender(chat_id=subgroup.parent.chat.id, action="upload_video", bot=upload_bot):
+							video = (await self.vkAPI.video_get(videos=get_attachment_key(attachment)))["items"][0]
+							if "files" not in video:
+								# В случаях, если видео помечено как "доступно только подписчикам", ВК не даёт ссылок на скачивание.
+								# В таких случаях мы просто отображаем видео как ссылку на него.
 
-									attachment_items.append(f"<a href=\"{'m.' if use_mobile_vk else ''}vk.com/wall{video['owner_id']}_{attachment['id']}\">📹 Видео с закрытым доступом</a>")
+								attachment_items.append(f"<a href=\"{'m.' if use_mobile_vk else ''}vk.com/wall{video['owner_id']}_{attachment['id']}\">📹 Видео с закрытым доступом</a>")
 
-									continue
+								return False
 
-								video = video["files"]
+							video = video["files"]
 
-								# Если это внешнее видео (т.е., ссылка на Youtube или подобное),
-								# то в таком случае прямых ссылок на файлы будут отсутствовать.
-								#
-								# В таком случае нужно просто добавить ссылку на видео как вложение.
-								if "external" in video:
-									attachment_items.append(f"<a href=\"{video['external']}\">📹 Внешнее видео</a>")
+							# Если это внешнее видео (т.е., ссылка на Youtube или подобное),
+							# то в таком случае прямых ссылок на файлы будут отсутствовать.
+							#
+							# В таком случае нужно просто добавить ссылку на видео как вложение.
+							if "external" in video:
+								attachment_items.append(f"<a href=\"{video['external']}\">📹 Внешнее видео</a>")
 
-									continue
+								return False
 
-								# Делаем список из возможных качеств для видео.
-								video_quality_list = ["mp4_1080", "mp4_720", "mp4_480", "mp4_360", "mp4_240", "mp4_144"]
-								video_hd_quality_list = ["mp4_1080"]
+							# Делаем список из возможных качеств для видео.
+							video_quality_list = ["mp4_1080", "mp4_720", "mp4_480", "mp4_360", "mp4_240", "mp4_144"]
+							video_hd_quality_list = ["mp4_1080"]
 
-								# Составляем список качеств видео, которые были переданы ВКонтакте.
-								present_video_quality_list = [quality for quality in video_quality_list if quality in video]
+							# Составляем список качеств видео, которые были переданы ВКонтакте.
+							present_video_quality_list = [quality for quality in video_quality_list if quality in video]
+							if not present_video_quality_list:
+								raise Exception("ВКонтакте не вернул ссылку на видео")
 
-								# Узнаём, разрешены ли HD-видео.
-								hd_video_allowed = await self.user.get_setting("Services.VK.HDVideo")
+							# Узнаём, разрешены ли HD-видео.
+							hd_video_allowed = await self.user.get_setting("Services.VK.HDVideo")
 
-								for quality in present_video_quality_list:
-									is_last = quality == present_video_quality_list[-1]
-									is_hd = quality in video_hd_quality_list
+							# Если HD-видео не разрешены, то пропускаем HD-качества, но лишь в случае, если есть видео другого качества.
+							allowed_video_quality_list = [quality for quality in present_video_quality_list if hd_video_allowed or quality not in video_hd_quality_list] or present_video_quality_list
 
-									# Нам нужно убедиться, что если это HD видео, и есть видео другого качества,
-									# то в таком случае нужно пропустить такой формат.
-									if is_hd and not is_last and not hd_video_allowed:
-										continue
+							# Одновременно узнаём размеры файлов всех качеств, не загружая сами файлы,
+							# и выбираем самое большое видео, размер которого не превышает лимит.
+							video_sizes = await probe_video_sizes(cache_key, {quality: video[quality] for quality in allowed_video_quality_list})
+							quality = select_video_quality(allowed_video_quality_list, video_sizes, utils.max_upload_bytes())
 
-									logger.debug(f"Найдено видео с качеством {quality}: {video[quality]}")
+							debug_lazy("Размеры качеств видео {}: {}, выбрано качество {}", lambda: cache_key, lambda: video_sizes, lambda: quality)
 
-									# Загружаем видео.
-									async with aiohttp.ClientSession() as client:
-										async with client.get(video[quality]) as response:
-											assert response.status == 200, f"Не удалось загрузить видео с качеством {quality}"
+							if quality is None:
+								# Передаём ссылку на видео, если файл подходящего размера не был найден.
+								attachment_items.append(f"<a href=\"{'m.' if use_mobile_vk else ''}vk.com/{cache_key}\">📹 Видео «{attachment['title']}»</a>")
 
-											content_size = int(response.headers.get("Content-Length", "0"))
-											assert content_size, "Не был выдан размер файла для загрузки"
+								return False
 
-											# Пытаемся найти самое большое видео, размер которого не превышает лимит.
-											if content_size > utils.max_upload_bytes():
-												if is_last:
-													# Передаём ссылку на видео, если файл меньшего размера не был найден.
-													attachment_items.append(f"<a href=\"{'m.' if use_mobile_vk else ''}vk.com/{get_attachment_key(attachment, 'video', include_access_key=False)}\">📹 Видео «{attachment['title']}»</a>")
+							# Начинаем загрузку видео. Само видео будет передано в Telegram по частям во время отправки сообщения.
+							video_file = StreamingInputFile(
+								video[quality],
+								filename=f"VK video note {attachment['id']}.mp4" if is_video_note else f"{attachment['title'].strip()} {quality[4:]}p.mp4"
+							)
+							media_files.append(video_file)
 
-													break
+							# Если размер качества не удалось узнать заранее, то проверяем размер, переданный сервером при загрузке.
+							content_size = await video_file.open()
+							if content_size and content_size > utils.max_upload_bytes():
+								await video_file.close()
 
-												logger.debug(f"Файл качества {quality} оказался слишком большой ({content_size} байт).")
+								attachment_items.append(f"<a href=\"{'m.' if use_mobile_vk else ''}vk.com/{cache_key}\">📹 Видео «{attachment['title']}»</a>")
 
-												continue
+								return False
 
-											# По-настоящему загружаем видео.
-											video_bytes = await response.read()
+							# Если мы получили видеосообщение (кружочек), то нужно отправить его как сообщение.
+							if is_video_note:
+								# Отправляем видеосообщение.
+								msg = await subgroup.send_video_note(
+									input=video_file,
+									silent=is_outbox,
+									reply_to=reply_to,
+									sender_id=original_message_sender_id
+								)
 
-									# Если мы получили видеосообщение (кружочек), то нужно отправить его как сообщение.
-									if is_video_note:
-										# Отправляем видеосообщение.
-										msg = await subgroup.send_video_note(
-											input=BufferedInputFile(video_bytes, filename=f"VK video note {attachment['id']}.mp4"),
-											silent=is_outbox,
-											reply_to=reply_to,
-											sender_id=original_message_sender_id
-										)
+								# Если произошёл rate limit, то msg будет None.
+								if not msg:
+									return True
 
-										# Если произошёл rate limit, то msg будет None.
-										if not msg:
-											return
+								# Сохраняем в память.
+								await TelehooperAPI.save_message(
+									"VK",
+									self.service_user_id,
+									msg[0].message_id,
+									event.message_id,
+									message_extended["conversation_message_id"],
+									sent_via_bot=False
+								)
 
-										# Сохраняем в память.
-										await TelehooperAPI.save_message(
-											"VK",
-											self.service_user_id,
-											msg[0].message_id,
-											event.message_id,
-											message_extended["conversation_message_id"],
-											sent_via_bot=False
-										)
-
-										assert msg[0].video_note, "Видеосообщение не было отправлено"
-
-										return
-
-									# Прикрепляем видео.
-									attachment_media.append(
-										InputMediaVideo(
-											type=InputMediaType.VIDEO,
-											media=BufferedInputFile(
-												video_bytes,
-												filename=f"{attachment['title'].strip()} {quality[4:]}p.mp4"
-											),
-											parse_mode="HTML"
-										)
-									)
+								assert msg[0].video_note, "Видеосообщение не было отправлено"
 
-									break
-								else:
-									raise Exception("ВКонтакте не вернул ссылку на видео")
-						elif attachment_type == "audio_message":
-							attachment_media.append(
-								InputMediaAudio(
-									type=InputMediaType.AUDIO,
-									media=attachment["link_ogg"],
+								return True
+
+							# Прикрепляем видео.
+							attach_file(
+								InputMediaVideo(
+									type=InputMediaType.VIDEO,
+									media=video_file,
 									parse_mode="HTML"
-								)
+								),
+								cache_key,
+								False,
+								attachment_media
 							)
-						elif attachment_type == "sticker":
-							async def _downloadSticker(url: str, is_animated: bool) -> bytes:
-								"""
-								Загружает стикер по указанному URL.
+					elif attachment_type == "audio_message":
+						attachment_media.append(
+							InputMediaAudio(
+								type=InputMediaType.AUDIO,
+								media=attachment["link_ogg"],
+								parse_mode="HTML"
+							)
+						)
+					elif attachment_type == "sticker":
+						async def _downloadSticker(url: str, is_animated: bool) -> bytes:
+							"""
+							Загружает стикер по указанному URL.
 
-								Если стикер является анимированным, то данный метод его ещё и сконвертирует в формат .tgs.
+							Если стикер является анимированным, то данный метод его ещё и сконвертирует в формат .tgs.
 
-								:param url: URL на данный файл со стикером.
-								:param is_animated: Указывает, что после загрузки стикера он должен сконвертироваться в формат .tgs.
-								"""
+							:param url: URL на данный файл со стикером.
+							:param is_animated: Указывает, что после загрузки стикера он должен сконвертироваться в формат .tgs.
+							"""
 
-								logger.debug(f"Загружаю стикер с URL {url}")
+							debug_lazy("Загружаю стикер с URL {}", lambda: url)
 
-								async with aiohttp.ClientSession() as client:
-									async with client.get(sticker_url) as response:
-										assert response.status == 200, f"Не удалось загрузить стикер с ID {attachment_cache_name}"
+							async with aiohttp.ClientSession() as client:
+								async with client.get(sticker_url) as response:
+									assert response.status == 200, f"Не удалось загрузить стикер с ID {attachment_cache_name}"
 
-										sticker_bytes = await response.read()
+									sticker_bytes = await response.read()
 
-								if is_animated:
-									sticker_bytes = await utils.convert_to_tgs_sticker(sticker_bytes)
+							if is_animated:
+								sticker_bytes = await utils.convert_to_tgs_sticker(sticker_bytes)
 
-								return sticker_bytes
+							return sticker_bytes
 
-							is_animated = "animation_url" in attachment
-							sticker_url = attachment.get("animation_url") if is_animated else attachment["images_with_background"][-1]["url"]
-							attachment_cache_name = f"sticker{attachment['sticker_id']}{'anim' if is_animated else 'static'}"
+						is_animated = "animation_url" in attachment
+						sticker_url = attachment.get("animation_url") if is_animated else attachment["images_with_background"][-1]["url"]
+						attachment_cache_name = f"sticker{attachment['sticker_id']}{'anim' if is_animated else 'static'}"
 
-							# Пытаемся получить информацию о данном стикере из кэша вложений.
-							sticker_bytes = None
-							cached_sticker = await TelehooperAPI.get_attachment("VK", attachment_cache_name)
+						# Пытаемся получить информацию о данном стикере из кэша вложений.
+						sticker_bytes = None
+						cached_sticker = await TelehooperAPI.get_attachment("VK", attachment_cache_name)
 
-							# Если стикер был найден в кэше, то скачиваем его.
-							if not cached_sticker:
-								logger.debug(f"Не был найден кэш для стикера с ID {attachment_cache_name}")
+						# Если стикер был найден в кэше, то скачиваем его.
+						if not cached_sticker:
+							debug_lazy("Не был найден кэш для стикера с ID {}", lambda: attachment_cache_name)
 
-								# Загружаем стикер.
-								sticker_bytes = await _downloadSticker(sticker_url, is_animated)
+							# Загружаем стикер.
+							sticker_bytes = await _downloadSticker(sticker_url, is_animated)
 
-							# Отправляем стикер.
-							# Иногда стикеры, сохранённые в кэше ломаются. Если такое происходит, то бот удаляет стикер из кэша.
-							try:
-								msg = await subgroup.send_sticker(
-									sticker=cached_sticker if cached_sticker else BufferedInputFile(
-										file=cast(bytes, sticker_bytes),
-										filename="sticker.tgs" if is_animated else f"VK sticker {attachment['sticker_id']}.png"
-									),
-									silent=is_outbox,
-									reply_to=reply_to,
-									sender_id=original_message_sender_id
-								)
-							except TelegramBadRequest:
-								# Поскольку кэш стикера оказался поломанным, стоит отправить стикер по-новой, игнорируя кэш.
-								await TelehooperAPI.delete_attachment("VK", attachment_cache_name)
-								sticker_bytes = await _downloadSticker(sticker_url, is_animated)
-
-								msg = await subgroup.send_sticker(
-									sticker=BufferedInputFile(
-										file=cast(bytes, sticker_bytes),
-										filename="sticker.tgs" if is_animated else f"VK sticker {attachment['sticker_id']}.png"
-									),
-									silent=is_outbox,
-									reply_to=reply_to,
-									sender_id=original_message_sender_id
-								)
+						# Отправляем стикер.
+						# Иногда стикеры, сохранённые в кэше ломаются. Если такое происходит, то бот удаляет стикер из кэша.
+						try:
+							msg = await subgroup.send_sticker(
+								sticker=cached_sticker if cached_sticker else BufferedInputFile(
+									file=cast(bytes, sticker_bytes),
+									filename="sticker.tgs" if is_animated else f"VK sticker {attachment['sticker_id']}.png"
+								),
+								silent=is_outbox,
+								reply_to=reply_to,
+								sender_id=original_message_sender_id
+							)
+						except TelegramBadRequest:
+							# Поскольку кэш стикера оказался поломанным, стоит отправить стикер по-новой, игнорируя кэш.
+							await TelehooperAPI.delete_attachment("VK", attachment_cache_name)
+							sticker_bytes = await _downloadSticker(sticker_url, is_animated)
+
+							msg = await subgroup.send_sticker(
+								sticker=BufferedInputFile(
+									file=cast(bytes, sticker_bytes),
+									filename="sticker.tgs" if is_animated else f"VK sticker {attachment['sticker_id']}.png"
+								),
+								silent=is_outbox,
+								reply_to=reply_to,
+								sender_id=original_message_sender_id
+							)
 
-							# Если произошёл rate limit, то msg будет None.
-							if not msg:
-								return
+						# Если произошёл rate limit, то msg будет None.
+						if not msg:
+							return True
 
-							assert msg[0].sticker, "Стикер не был отправлен"
+						assert msg[0].sticker, "Стикер не был отправлен"
 
-							# Сохраняем в память.
-							await TelehooperAPI.save_message(
+						# Сохраняем в память.
+						await TelehooperAPI.save_message(
+							"VK",
+							self.service_user_id,
+							msg[0].message_id,
+							event.message_id,
+							message_extended["conversation_message_id"],
+							sent_via_bot=False
+						)
+
+						# Кэшируем стикер, если настройка у пользователя это позволяет.
+						if not cached_sticker and await self.user.get_setting("Security.MediaCache"):
+							await TelehooperAPI.save_attachment(
 								"VK",
-								self.service_user_id,
-								msg[0].message_id,
-								event.message_id,
-								message_extended["conversation_message_id"],
-								sent_via_bot=False
+								attachment_cache_name,
+								msg[0].sticker.file_id
 							)
 
-							# Кэшируем стикер, если настройка у пользователя это позволяет.
-							if not cached_sticker and await self.user.get_setting("Security.MediaCache"):
-								await TelehooperAPI.save_attachment(
-									"VK",
-									attachment_cache_name,
-									msg[0].sticker.file_id
-								)
+						return True
+					elif attachment_type == "doc":
+						# Если этот документ уже был загружен в Telegram, то не загружаем его повторно.
+						cache_key = get_attachment_key(attachment, "doc", include_access_key=False)
+						file_id = file_cache.get(sending_bot.id, cache_key)
+						if file_id:
+							attach_file(
+								InputMediaDocument(
+									type=InputMediaType.DOCUMENT,
+									media=file_id,
+									parse_mode="HTML"
+								),
+								cache_key,
+								True,
+								attachment_media
+							)
 
-							return
-						elif attachment_type == "doc":
-							# Для отображения прогресса отправки сообщения с вложениями, бот должен показать пользователям надпись "Telehooper отправляет документ...".
-							# Если мы находимся в беседе, то нужно найти того минибота, который связан с пользователем, который отправляет документ.
-							upload_bot = subgroup.parent.bot
-							if is_convo:
-								upload_bot = await subgroup.parent.get_associated_bot(original_message_sender_id) or subgroup.parent.bot
-
-							async with ChatActionSender(chat_id=subgroup.parent.chat.id, action="upload_document", bot=upload_bot):
-								async with aiohttp.ClientSession() as client:
-									async with client.get(attachment["url"]) as response:
-										assert response.status == 200, f"Не удалось загрузить документ с ID {attachment['id']}"
-
-										content_size = int(response.headers.get("Content-Length", "0"))
-										assert content_size, "Не был выдан размер файла для загрузки"
-
-										# Проверяем, не превышает ли размер файла лимит.
-										if content_size > utils.max_upload_bytes():
-											attachment_items.append(f"<a href=\"{message_url}\">📁 Документ «{attachment['title']}»</a>")
-
-											break
-
-										# По-настоящему загружаем документ.
-										file_bytes = await response.read()
-
-								# Прикрепляем документ.
-								attachment_media.append(
-									InputMediaDocument(
-										type=InputMediaType.DOCUMENT,
-										media=BufferedInputFile(
-											file=file_bytes,
-											filename=attachment["title"]
-										),
-										parse_mode="HTML"
-									)
-								)
-						elif attachment_type == "audio":
-							# Обрабатываем музыку.
+							return False
 
-							# В некоторых случаях, ВК может не передавать ссылку на аудио.
-							# В таком случае, бот просто прикрепит музыку как текстовое вложение.
-							if not attachment.get("url"):
-								attachment_items.append(f"<a href=\"{message_url}\">🎵 {attachment['artist']} - {attachment['title']}</a>")
+						# Для отображения прогресса отправки сообщения с вложениями, бот должен показать пользователям надпись "Telehooper отправляет документ...".
+						# Если мы находимся в беседе, то нужно найти того минибота, который связан с пользователем, который отправляет документ.
+						upload_bot = subgroup.parent.bot
+						if is_convo:
+							upload_bot = await subgroup.parent.get_associated_bot(original_message_sender_id) or subgroup.parent.bot
 
-								continue
-
-							# Для отображения прогресса отправки сообщения с вложениями, бот должен показать пользователям надпись "Telehooper отправляет аудио...".
-							# Если мы находимся в беседе, то нужно найти того минибота, который связан с пользователем, который отправляет аудио.
-							upload_bot = subgroup.parent.bot
-							if is_convo:
-								upload_bot = await subgroup.parent.get_associated_bot(original_message_sender_id) or subgroup.parent.bot
-
-							async with ChatActionSender(chat_id=subgroup.parent.chat.id, action="upload_audio", bot=upload_bot):
-								async with aiohttp.ClientSession() as client:
-									async with client.get(attachment["url"]) as response:
-										assert response.status == 200, f"Не удалось загрузить аудио с ID {attachment['id']}"
-
-										content_size = int(response.headers.get("Content-Length", "0"))
-										assert content_size, "Не был выдан размер файла для загрузки"
-
-										# Проверяем, не превышает ли размер файла лимит.
-										if content_size > utils.max_upload_bytes():
-											attachment_items.append(f"<a href=\"{message_url}\">🎵 {attachment['artist']} - {attachment['title']}</a>")
-
-											break
-
-										# По-настоящему загружаем аудио.
-										file_bytes = await response.read()
-
-								# Прикрепляем аудио.
-								attachment_media.append(
-									InputMediaAudio(
-										type=InputMediaType.AUDIO,
-										media=BufferedInputFile(
-											file=file_bytes,
-											filename=f"{attachment['artist']} - {attachment['title']}.mp3"
-										),
-										title=attachment["title"],
-										performer=attachment["artist"],
-										parse_mode="HTML"
-									)
-								)
-						elif attachment_type == "graffiti":
-							attachment_media.append(
-								InputMediaPhoto(
-									type=InputMediaType.PHOTO,
-									media=attachment["url"],
+						async with ChatActionSender(chat_id=subgroup.parent.chat.id, action="upload_document", bot=upload_bot):
+							# Начинаем загрузку документа. Сам документ будет передан в Telegram по частям во время отправки сообщения.
+							doc_file = StreamingInputFile(attachment["url"], filename=attachment["title"])
+							media_files.append(doc_file)
+
+							# Если сервер не передал размер файла, то используем размер, который вернул API.
+							content_size = await doc_file.open() or attachment.get("size")
+
+							# Проверяем, не превышает ли размер файла лимит.
+							if content_size and content_size > utils.max_upload_bytes():
+								await doc_file.close()
+
+								attachment_items.append(f"<a href=\"{message_url}\">📁 Документ «{attachment['title']}»</a>")
+
+								return False
+
+							# Прикрепляем документ.
+							attach_file(
+								InputMediaDocument(
+									type=InputMediaType.DOCUMENT,
+									media=doc_file,
 									parse_mode="HTML"
-								)
+								),
+								cache_key,
+								False,
+								attachment_media
 							)
-						elif attachment_type == "wall":
-							# Получаем информацию о том, откуда был взят этот пост.
-							post_creator_info = await self.get_user_info(attachment["from_id"])
-
-							attachment_items.append(f"<a href=\"{'m.' if use_mobile_vk else ''}vk.com/wall{attachment['owner_id']}_{attachment['id']}\">🔄 Запись от {'пользователя' if attachment['owner_id'] > 0 else 'группы'} {utils.telegram_safe_str(post_creator_info.name)}</a>")
-						elif attachment_type == "link":
-							webpage_preview_url = attachment["url"]
-						elif attachment_type == "poll":
-							attachment_items.append(f"<a href=\"{message_url}\">📊 Опрос: «{attachment['question']}»</a>")
-						elif attachment_type == "gift":
-							attachment_media.append(
-								InputMediaPhoto(
-									type=InputMediaType.PHOTO,
-									media=attachment["thumb_256"],
+					elif attachment_type == "audio":
+						# Обрабатываем музыку.
+
+						# В некоторых случаях, ВК может не передавать ссылку на аудио.
+						# В таком случае, бот просто прикрепит музыку как текстовое вложение.
+						if not attachment.get("url"):
+							attachment_items.append(f"<a href=\"{message_url}\">🎵 {attachment['artist']} - {attachment['title']}</a>")
+
+							return False
+
+						# Если это аудио уже было загружено в Telegram, то не загружаем его повторно.
+						cache_key = get_attachment_key(attachment, "audio", include_access_key=False)
+						file_id = file_cache.get(sending_bot.id, cache_key)
+						if file_id:
+							attach_file(
+								InputMediaAudio(
+									type=InputMediaType.AUDIO,
+									media=file_id,
+									title=attachment["title"],
+									performer=attachment["artist"],
 									parse_mode="HTML"
-								)
+								),
+								cache_key,
+								True,
+								attachment_media
 							)
 
-							attachment_items.append(f"<a href=\"{message_url}\">🎁 Подарок</a>")
-						elif attachment_type == "market":
-							attachment_items.append(f"<a href=\"{message_url}\">🛒 Товар: «{attachment['title']}»</a>")
-						elif attachment_type == "market_album":
-							pass
-						elif attachment_type == "wall_reply":
-							commented_post_creator_info = await self.get_user_info(attachment["owner_id"])
+							return False
 
-							attachment_items.append(f"<a href=\"{message_url}\">📝 Комментарий к записи от {commented_post_creator_info.name}</a>")
-						elif attachment_type == "story":
-							attachment_items.append(f"<a href=\"{message_url}\">📝 История</a>")
-						else:
-							raise TypeError(f"Неизвестный тип вложения \"{attachment_type}\"")
+						# Для отображения прогресса отправки сообщения с вложениями, бот должен показать пользователям надпись "Telehooper отправляет аудио...".
+						# Если мы находимся в беседе, то нужно найти того минибота, который связан с пользователем, который отправляет аудио.
+						upload_bot = subgroup.parent.bot
+						if is_convo:
+							upload_bot = await subgroup.parent.get_associated_bot(original_message_sender_id) or subgroup.parent.bot
+
+						async with ChatActionSender(chat_id=subgroup.parent.chat.id, action="upload_audio", bot=upload_bot):
+							# Начинаем загрузку аудио. Само аудио будет передано в Telegram по частям во время отправки сообщения.
+							audio_file = StreamingInputFile(attachment["url"], filename=f"{attachment['artist']} - {attachment['title']}.mp3")
+							media_files.append(audio_file)
+
+							# Если сервер не передал размер файла, то его размер не проверяется.
+							content_size = await audio_file.open()
+
+							# Проверяем, не превышает ли размер файла лимит.
+							if content_size and content_size > utils.max_upload_bytes():
+								await audio_file.close()
+
+								attachment_items.append(f"<a href=\"{message_url}\">🎵 {attachment['artist']} - {attachment['title']}</a>")
+
+								return False
+
+							# Прикрепляем аудио.
+							attach_file(
+								InputMediaAudio(
+									type=InputMediaType.AUDIO,
+									media=audio_file,
+									title=attachment["title"],
+									performer=attachment["artist"],
+									parse_mode="HTML"
+								),
+								cache_key,
+								False,
+								attachment_media
+							)
+					elif attachment_type == "graffiti":
+						attachment_media.append(
+							InputMediaPhoto(
+								type=InputMediaType.PHOTO,
+								media=attachment["url"],
+								parse_mode="HTML"
+							)
+						)
+					elif attachment_type == "wall":
+						# Получаем информацию о том, откуда был взят этот пост.
+						post_creator_info = await self.get_user_info(attachment["from_id"])
+
+						attachment_items.append(f"<a href=\"{'m.' if use_mobile_vk else ''}vk.com/wall{attachment['owner_id']}_{attachment['id']}\">🔄 Запись от {'пользователя' if attachment['owner_id'] > 0 else 'группы'} {utils.telegram_safe_str(post_creator_info.name)}</a>")
+					elif attachment_type == "link":
+						webpage_preview_url = attachment["url"]
+					elif attachment_type == "poll":
+						attachment_items.append(f"<a href=\"{message_url}\">📊 Опрос: «{attachment['question']}»</a>")
+					elif attachment_type == "gift":
+						attachment_media.append(
+							InputMediaPhoto(
+								type=InputMediaType.PHOTO,
+								media=attachment["thumb_256"],
+								parse_mode="HTML"
+							)
+						)
+
+						attachment_items.append(f"<a href=\"{message_url}\">🎁 Подарок</a>")
+					elif attachment_type == "market":
+						attachment_items.append(f"<a href=\"{message_url}\">🛒 Товар: «{attachment['title']}»</a>")
+					elif attachment_type == "market_album":
+						pass
+					elif attachment_type == "wall_reply":
+						commented_post_creator_info = await self.get_user_info(attachment["owner_id"])
+
+						attachment_items.append(f"<a href=\"{message_url}\">📝 Комментарий к записи от {commented_post_creator_info.name}</a>")
+					elif attachment_type == "story":
+						attachment_items.append(f"<a href=\"{message_url}\">📝 История</a>")
+					else:
+						raise TypeError(f"Неизвестный тип вложения \"{attachment_type}\"")
+
+					return False
+
+				# Подготавливаем все вложения одновременно, сохраняя их исходный порядок.
+				if message_extended and "attachments" in message_extended:
+					# Вложения, уже загруженные в Telegram, берутся из общего кэша file_id. Поскольку file_id
+					# действителен лишь для загрузившего файл бота, кэш ищется для бота, который отправит сообщение.
+					file_cache = get_file_cache()
+					sending_bot = await subgroup.parent.get_associated_bot(original_message_sender_id)
+
+					prepare_started_at = time.perf_counter()
+					attachment_slots.extend(([], []) for _ in message_extended["attachments"])
+
+					async def _prepare(index: int, attachment: dict) -> bool:
+						async with self._attachmentSemaphore:
+							return await prepare_attachment(index, attachment, *attachment_slots[index])
+
+					prepare_tasks = [asyncio.create_task(_prepare(index, attachment)) for index, attachment in enumerate(message_extended["attachments"])]
+					try:
+						prepare_results = await asyncio.gather(*prepare_tasks)
+					except BaseException:
+						# Если одно из вложений не удалось подготовить, то остальные больше не нужны.
+						for task in prepare_tasks:
+							task.cancel()
+
+						await asyncio.gather(*prepare_tasks, return_exceptions=True)
+
+						raise
+
+					prepare_time = time.perf_counter() - prepare_started_at
+					record_attachments_prepare_time(prepare_time)
+					debug_lazy("[VK] Подготовка {} вложений сообщения {} заняла {:.2f} сек.", lambda: len(prepare_tasks), lambda: event.message_id, lambda: prepare_time)
+
+					# Одно из вложений было отправлено отдельным сообщением.
+					if any(prepare_results):
+						return
+
+					for slot_media, slot_items in attachment_slots:
+						attachment_media.extend(slot_media)
+						attachment_items.extend(slot_items)
 
 			# Проверяем, не было ли это событие беседы из ВК.
 			if is_convo and event.source_act: # TODO
@@ -967,20 +1126,55 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 
 				return
 
-			# Подготавливаем текст сообщения, который будет отправлен.
-			msg_prefix = await self.get_message_prefix(event, is_outbox=is_outbox, has_attachments=bool(attachment_items))
-			msg_body = await self.parse_message_mentions(utils.telegram_safe_str(event.text), use_mobile_vk=use_mobile_vk)
-			msg_suffix = ""
+			async def prepare_message_text() -> str:
+				"""
+				Подготавливает текст сообщения, который будет отправлен, вместе со ссылками на вложения.
+				"""
+
+				msg_prefix = await self.get_message_prefix(event, is_outbox=is_outbox, has_attachments=bool(attachment_items))
+				msg_body = await self.parse_message_mentions(utils.telegram_safe_str(event.text), use_mobile_vk=use_mobile_vk)
+				msg_suffix = ""
+
+				# Добавляем ссылки на вложения, если таковые есть.
+				if attachment_items:
+					if msg_body:
+						msg_suffix += "\n\n————————\n"
+
+					msg_suffix += "  |  ".join(attachment_items) + "."
+
+				# Композируем полное сообщение.
+				return msg_prefix + msg_body + msg_suffix
+
+			async def prepare_uncached_attachments() -> bool:
+				"""
+				Удаляет из кэша `file_id` вложения, которые были взяты из него, и заново подготавливает их из исходных вложений ВКонтакте. Вызывается, если Telegram отклонил сообщение, поскольку `file_id` из кэша мог стать недействительным. Возвращает `True`, если такие вложения были.
+				"""
+
+				cached_indexes = [index for index, (slot_media, _) in enumerate(attachment_slots) if any(id(media) in cached_file_media for media in slot_media)]
+				if not cached_indexes:
+					return False
+
+				for cache_key in cached_file_media.values():
+					file_cache.delete(sending_bot.id, cache_key)
+
+				cached_file_media.clear()
 
-			# Добавляем ссылки на вложения, если таковые есть.
-			if attachment_items:
-				if msg_body:
-					msg_suffix += "\n\n————————\n"
+				# Вложения больше нет в кэше, поэтому оно будет подготовлено по исходному URL.
+				for index in cached_indexes:
+					attachment_slots[index] = ([], [])
 
-				msg_suffix += "  |  ".join(attachment_items) + "."
+					await prepare_attachment(index, message_extended["attachments"][index], *attachment_slots[index])
 
-			# Композируем полное сообщение.
-			full_message_text = msg_prefix + msg_body + msg_suffix
+				attachment_media.clear()
+				attachment_items.clear()
+				for slot_media, slot_items in attachment_slots:
+					attachment_media.extend(slot_media)
+					attachment_items.extend(slot_items)
+
+				return True
+
+			# Подготавливаем текст сообщения, который будет отправлен.
+			full_message_text = await prepare_message_text()
 
 			# Извлекаем первый URL из полного сообщения, что бы понять, нужно ли нам прятать веб-превью или нет.
 			full_message_first_url = utils.extract_url(full_message_text)
@@ -999,24 +1193,47 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 				if force_manual_files_upload:
 					logger.debug("Пытаюсь вручную загрузить вложения...")
 
+					manual_files: list[StreamingInputFile] = []
 					for index, attachment in enumerate(attachment_media_downloaded):
-						if isinstance(attachment.media, InputFile):
+						# Вложения, взятые из кэша file_id, уже находятся на серверах Telegram,
+						# а StreamingInputFile при повторной отправке читаются из спула вложений.
+						if isinstance(attachment.media, InputFile) or id(attachment) in cached_file_media:
 							continue
 
-						logger.debug(f"Вручную загружаю вложение {attachment}...")
+						debug_lazy("Вручную загружаю вложение {}...", lambda: attachment)
 
-						# TODO: Сделать asyncio.gather() для загрузки всех вложений одновременно.
-						async with aiohttp.ClientSession() as session:
-							async with session.get(attachment.media) as response:
-								assert response.status == 200, f"Не удалось загрузить вложение с URL {attachment.media}"
+						# Вложение будет загружено и передано в Telegram по частям во время отправки сообщения.
+						attachment_file = StreamingInputFile(attachment.media, filename="Media")
+						media_files.append(attachment_file)
+						manual_files.append(attachment_file)
 
-								attachment_bytes = await response.read()
+						attachment_media_downloaded[index].media = attachment_file
 
-						# Вложение загружено, меняем в массиве с вложениями.
-						attachment_media_downloaded[index].media = BufferedInputFile(
-							file=attachment_bytes,
-							filename="Media"
-						)
+					# Начинаем загрузку всех вложений одновременно.
+					await asyncio.gather(*[attachment_file.open() for attachment_file in manual_files])
+
+				# Сохраняем file_id загруженных вложений в общий кэш, если настройка у пользователя это позволяет.
+				media_cache_allowed = await self.user.get_setting("Security.MediaCache")
+
+				def cache_sent_files(sent_attachments: list[InputMediaAudio | InputMediaDocument | InputMediaPhoto | InputMediaVideo]) -> Callable[[Bot, list[Message]], None]:
+					"""
+					Возвращает функцию, которая после отправки сообщения сохраняет file_id отправленных вложений в кэш.
+
+					:param sent_attachments: Вложения, в том порядке, в котором они были переданы в Telegram.
+					"""
+
+					def _on_sent(bot: Bot, messages: list[Message]) -> None:
+						if not media_cache_allowed:
+							return
+
+						for attachment, message in zip(sent_attachments, messages):
+							cache_key = file_cache_keys.get(id(attachment))
+							file_id = get_message_file_id(message)
+
+							if cache_key and file_id:
+								get_file_cache().save(bot.id, cache_key, file_id)
+
+					return _on_sent
 
 				# Высылаем сообщение.
 				#
@@ -1030,15 +1247,17 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 				separate_attachs = normal_attachments and (audio_attachments or doc_attachments)
 
 				sent_message_ids = []
+				first_attachments = normal_attachments or audio_attachments or doc_attachments
 				msg_special = await subgroup.send_message_in(
 					full_message_text,
-					attachments=normal_attachments or audio_attachments or doc_attachments, # type: ignore
+					attachments=first_attachments, # type: ignore
 					silent=is_outbox,
 					reply_to=reply_to,
 					keyboard=keyboard,
 					sender_id=original_message_sender_id,
 					disable_web_preview=first_message_text_url != full_message_first_url,
-					web_preview_url=webpage_preview_url
+					web_preview_url=webpage_preview_url,
+					on_sent=cache_sent_files(first_attachments)
 				)
 
 				# Если произошёл rate limit, то ответ на отправку сообщений будет равен None.
@@ -1057,7 +1276,8 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 							silent=is_outbox,
 							reply_to=msg_special[0],
 							sender_id=original_message_sender_id,
-							disable_web_preview=first_message_text_url != full_message_first_url
+							disable_web_preview=first_message_text_url != full_message_first_url,
+							on_sent=cache_sent_files(audio_attachments) # type: ignore
 						)
 
 						if msg_audio:
@@ -1071,7 +1291,8 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 							silent=is_outbox,
 							reply_to=msg_special[0],
 							sender_id=original_message_sender_id,
-							disable_web_preview=first_message_text_url != full_message_first_url
+							disable_web_preview=first_message_text_url != full_message_first_url,
+							on_sent=cache_sent_files(doc_attachments) # type: ignore
 						)
 
 						if msg_docs:
@@ -1099,6 +1320,18 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 
 			async with ChatActionSender.upload_document(chat_id=subgroup.parent.chat.id, bot=upload_bot, initial_sleep=1):
 				try:
+					await _send_and_save()
+				except TelegramBadRequest:
+					# file_id из кэша мог стать недействительным, к примеру, если Telegram удалил файл.
+					# В таком случае отправляем эти вложения заново, используя исходные вложения ВКонтакте.
+					if not await prepare_uncached_attachments():
+						raise
+
+					logger.debug("Telegram отклонил вложения из кэша file_id, отправляю их заново")
+
+					full_message_text = await prepare_message_text()
+					full_message_first_url = utils.extract_url(full_message_text)
+
 					await _send_and_save()
 				except (TelegramNetworkError, TimeoutError):
 					logger.debug("Таймаут при попытке отправить сообщения, пробую загрузить вложения вручную")
@@ -1121,7 +1354,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 				async def read_task(chat_id: int, timer: int) -> None:
 					await asyncio.sleep(timer)
 
-					logger.debug(f"Помечаю чат {chat_id} как прочитанный, поскольку прошло {timer} секунд с момента отправки.")
+					debug_lazy("Помечаю чат {} как прочитанный, поскольку прошло {} секунд с момента отправки.", lambda: chat_id, lambda: timer)
 					try:
 						await self.read_message(chat_id)
 					except:
@@ -1159,6 +1392,10 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 				)
 			except:
 				pass
+		finally:
+			# Удаляем копии загруженных вложений с диска.
+			for media_file in media_files:
+				await media_file.close()
 
 	async def handle_vk_typing(self, event: LongpollTypingEventMultiple | LongpollVoiceMessageEvent) -> None:
 		"""
@@ -1179,7 +1416,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 		# Получаем список всех "печатающих" пользователей.
 		typing_users = [event.user_ids] if isinstance(event.user_ids, int) else event.user_ids
 
-		logger.debug(f"[VK] Событие печати для подгруппы \"{subgroup.service_dialogue_name}\", {len(typing_users)} печатающих")
+		debug_lazy("[VK] Событие печати для подгруппы \"{}\", {} печатающих", lambda: subgroup.service_dialogue_name, lambda: len(typing_users))
 
 		try:
 			for user_id in typing_users:
@@ -1210,7 +1447,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 		if not event.update_timestamp:
 			return
 
-		logger.debug(f"[VK] Событие редактирования сообщения для подгруппы \"{subgroup.service_dialogue_name}\"")
+		debug_lazy("[VK] Событие редактирования сообщения для подгруппы \"{}\"", lambda: subgroup.service_dialogue_name)
 
 		# Пытаемся получить ID сообщения в Telegram, которое нужно отредактировать.
 		telegram_message = await subgroup.service.get_message_by_service_id(self.service_user_id, event.message_id)
@@ -1243,7 +1480,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 
 		# Редактируем сообщение.
 		try:
-			logger.debug(f"Редактирую сообщение с ID {telegram_message.telegram_message_ids[0]}")
+			debug_lazy("Редактирую сообщение с ID {}", lambda: telegram_message.telegram_message_ids[0])
 
 			await subgroup.edit_message(
 				full_message_text,
@@ -1254,7 +1491,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 		except TelegramForbiddenError:
 			pass
 		except Exception as error:
-			logger.debug(f"Отредактировать сообщение не удалось: {error}")
+			debug_lazy("Отредактировать сообщение не удалось: {}", lambda: error)
 
 	async def handle_vk_message_flags_change(self, event: LongpollMessageFlagsEdit) -> None:
 		"""
@@ -1275,7 +1512,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 		if not subgroup:
 			return
 
-		logger.debug(f"[VK] Событие удаления сообщения с ВК convMID {event.conversation_message_id} для подгруппы \"{subgroup.service_dialogue_name}\"")
+		debug_lazy("[VK] Событие удаления сообщения с ВК convMID {} для подгруппы \"{}\"", lambda: event.conversation_message_id, lambda: subgroup.service_dialogue_name)
 
 		# Пытаемся получить ID сообщения в Telegram, которое нужно отредактировать.
 		telegram_message = await subgroup.service.get_message_by_service_conversation_id(self.service_user_id, event.conversation_message_id)
@@ -1286,7 +1523,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 		# Удаляем сообщение.
 		sender_id = subgroup.service.service_user_id if subgroup.service.service_user_id != self.service_user_id else None
 		try:
-			logger.debug(f"Удаляю сообщения с ID {telegram_message.telegram_message_ids}")
+			debug_lazy("Удаляю сообщения с ID {}", lambda: telegram_message.telegram_message_ids)
 
 			await subgroup.delete_message(
 				telegram_message.telegram_message_ids,
@@ -1407,6 +1644,9 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 		return bool(self._cachedDialogues)
 
 	async def disconnect_service(self, reason: ServiceDisconnectReason = ServiceDisconnectReason.INITIATED_BY_USER) -> None:
+		from api import TelehooperAPI
+
+
 		db_user = await get_user(self.user.telegramUser)
 
 		assert "VK" in db_user["Connections"]
@@ -1436,6 +1676,12 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 
 			self._longPollTask.cancel()
 
+		# Удаляем сохранённую позицию longpoll'а.
+		TelehooperAPI.delete_longpoll_checkpoint(self.service_name, self.service_user_id)
+
+		# Удаляем планировщик запросов к API, поскольку токен больше не используется.
+		remove_scheduler(self.token)
+
 		# Удаляем из памяти.
 		try:
 			del self.token
@@ -1629,7 +1875,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 			if chat.name != subgroup.service_dialogue_name:
 				continue
 
-			logger.debug(f"Найден реальный ID беседы: {chat.id}")
+			debug_lazy("Найден реальный ID беседы: {}", lambda: chat.id)
 
 			return chat.id
 
@@ -1643,7 +1889,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 		try:
 			message_text = msg.text or msg.caption or ""
 
-			logger.debug(f"[TG] Обработка сообщения в Telegram: \"{message_text or '<пусто>'}\" в \"{subgroup}\" {'с вложениями' if attachments else ''}")
+			debug_lazy("[TG] Обработка сообщения в Telegram: \"{}\" в \"{}\" {}", lambda: message_text or '<пусто>', lambda: subgroup, lambda: 'с вложениями' if attachments else '')
 
 			# Обрабатываем случай удаления пользователя из группы.
 			# Если был удалён основной или минибот, то нам нужно удалить группу либо минибота оттуда.
@@ -1718,7 +1964,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 							continue
 
 						service_user_id = serviceAPI.service_user_id
-						logger.debug(f"ID пользователя во ВКонтакте, на сообщение которого сделали reply {service_user_id}")
+						debug_lazy("ID пользователя во ВКонтакте, на сообщение которого сделали reply {}", lambda: service_user_id)
 
 				saved_message = await self.get_message_by_telegram_id(service_user_id, msg.reply_to_message.message_id)
 
@@ -1809,7 +2055,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 						else:
 							raise TypeError(f"Неизвестный тип вложения {attch_type}")
 
-						logger.debug(f"URL для загрузки вложений типа {attch_type}: {upload_url}")
+						debug_lazy("URL для загрузки вложений типа {}: {}", lambda: attch_type, lambda: upload_url)
 
 						# Выгружаем вложения на сервера ВК.
 						if upload_url:
@@ -1819,7 +2065,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 								form_data = aiohttp.FormData()
 
 								async def _download(index, file_id: str) -> tuple[int, bytes]:
-									logger.debug(f"Загружаю вложение #{index} из Telegram с FileID {file_id}")
+									debug_lazy("Загружаю вложение #{} из Telegram с FileID {}", lambda: index, lambda: file_id)
 
 									file = await subgroup.parent.bot.download(file_id)
 									assert file, "Не удалось загрузить вложение из Telegram"
@@ -1945,7 +2191,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 
 				attachments_to_send = ",".join(cast(list[str], attachments_vk))
 
-				logger.debug(f"Вложения для отправки: {attachments_to_send}")
+				debug_lazy("Вложения для отправки: {}", lambda: attachments_to_send)
 
 			# Если у нас нет вложений, а так же нет текста сообщения, то мы не можем отправить сообщение.
 			if not attachments_to_send and not message_text:
@@ -2020,7 +2266,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 		from api import TelehooperAPI
 
 
-		logger.debug(f"[TG] Обработка удаления сообщения в Telegram: \"{msg.text}\" в \"{subgroup}\"")
+		debug_lazy("[TG] Обработка удаления сообщения в Telegram: \"{}\" в \"{}\"", lambda: msg.text, lambda: subgroup)
 
 		saved_message = await self.get_message_by_telegram_id(self.service_user_id, msg.message_id)
 
@@ -2072,11 +2318,11 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 		await TelehooperAPI.delete_message(
 			"VK",
 			self.service_user_id,
-			saved_message.service_message_ids
+			service_message_id=saved_message.service_message_ids
 		)
 
 	async def handle_telegram_message_edit(self, msg: Message, subgroup: "TelehooperSubGroup", user: "TelehooperUser") -> None:
-		logger.debug(f"[TG] Обработка редактирования сообщения в Telegram: \"{msg.text}\" в \"{subgroup}\"")
+		debug_lazy("[TG] Обработка редактирования сообщения в Telegram: \"{}\" в \"{}\"", lambda: msg.text, lambda: subgroup)
 
 		saved_message = await self.get_message_by_telegram_id(self.service_user_id, msg.message_id)
 
@@ -2133,7 +2379,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 					pass
 
 	async def handle_telegram_message_reaction(self, msg: MessageReactionUpdated, subgroup: "TelehooperSubGroup", user: "TelehooperUser") -> None:
-		logger.debug(f"[TG] Обработка установки реакции в Telegram в \"{subgroup}\"")
+		debug_lazy("[TG] Обработка установки реакции в Telegram в \"{}\"", lambda: subgroup)
 
 		# Получаем ID беседы. Используется, если отправитель сообщения - не владелец группы.
 		peer_id = subgroup.service_chat_id
@@ -2191,7 +2437,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 			return
 
 	async def handle_telegram_message_read(self, subgroup: "TelehooperSubGroup", user: "TelehooperUser") -> None:
-		logger.debug(f"[TG] Обработка прочтения сообщения в Telegram в \"{subgroup}\"")
+		debug_lazy("[TG] Обработка прочтения сообщения в Telegram в \"{}\"", lambda: subgroup)
 
 		# Получаем ID беседы. Используется, если тот, кто прочитал сообщение - не владелец группы.
 		peer_id = subgroup.service_chat_id
@@ -2212,7 +2458,7 @@ class VKServiceAPI(BaseTelehooperServiceAPI):
 		assert query.data, "Не были переданы данные Callback query"
 		assert query.message, "Не были переданы кнопка для Callback query"
 
-		logger.debug(f"[TG] Обработка Inline callback query сервиса в Telegram в \"{subgroup}\"")
+		debug_lazy("[TG] Обработка Inline callback query сервиса в Telegram в \"{}\"", lambda: subgroup)
 
 		# Получаем информацию о сообщении, в котором находится эта кнопка.
 		saved_message = await self.get_message_by_telegram_id(self.service_user_id, query.message.message_id)
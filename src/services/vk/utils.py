@@ -28,80 +28,66 @@ def random_id() -> int:
 
 	return random.randint(-2147483647, 2147483648)
 
+def _message_flag(mask: int, doc: str) -> property:
+	"""
+	Создаёт property для `VKLongpollMessageFlags`, проверяющее наличие бита `mask` в флагах сообщения.
+
+	:param mask: Битовая маска флага.
+	:param doc: Описание флага.
+	"""
+
+	return property(lambda self: (self._input_flags & mask) != 0, doc=doc)
+
 class VKLongpollMessageFlags:
 	"""
 	Класс, который парсит флаги сообщения ВКонтакте.
 
+	Значения флагов вычисляются лишь при обращении к ним, поэтому создание объекта этого класса почти ничего не стоит.
+
 	Дополнительная информация: https://dev.vk.com/api/user-long-poll/getting-started#Флаги сообщений
 	"""
 
-	not_delivered: bool
-	"""Сообщение не было доставлено. Deprecated."""
-	delete_for_all: bool
-	"""Сообщение было удалено для всех пользователей."""
-	hidden: bool
-	"""Сообщение является ненастоящим, невидимым. Такие сообщения появляются при открытии диалога с сообществом."""
-	media: bool
-	"""Сообщение содержит медиа-вложения. Deprecated."""
-	fixed: bool
-	"""Сообщение было проверено пользователем на спам. Deprecated."""
-	deleted: bool
-	"""Сообщение удалено."""
-	spam: bool
-	"""Сообщение помечено как спам."""
-	friends: bool
-	"""Сообщение отправлено другом. Не применяется для сообщений из групповых бесед."""
-	chat: bool
-	"""Сообщение отправлено через чат. Deprecated."""
-	important: bool
-	"Помеченное сообщение как важное."
-	replied: bool
-	"""На сообщение был создан ответ."""
-	outbox: bool
-	"""Указывает, что сообщение является исходящим."""
-	unread: bool
-	"""Указывает, что сообщение является непрочитанным."""
+	__slots__ = ("_input_flags", )
+
+	FLAGS: dict[str, int] = {
+		"unread": 1,
+		"outbox": 2,
+		"replied": 4,
+		"important": 8,
+		"chat": 16,
+		"friends": 32,
+		"spam": 64,
+		"deleted": 128,
+		"fixed": 256,
+		"media": 512,
+		"hidden": 65536,
+		"delete_for_all": 1 << 6,
+		"not_delivered": 1 << 6
+	}
+	"""Названия флагов сообщения и их битовые маски."""
+
+	not_delivered = _message_flag(FLAGS["not_delivered"], "Сообщение не было доставлено. Deprecated.")
+	delete_for_all = _message_flag(FLAGS["delete_for_all"], "Сообщение было удалено для всех пользователей.")
+	hidden = _message_flag(FLAGS["hidden"], "Сообщение является ненастоящим, невидимым. Такие сообщения появляются при открытии диалога с сообществом.")
+	media = _message_flag(FLAGS["media"], "Сообщение содержит медиа-вложения. Deprecated.")
+	fixed = _message_flag(FLAGS["fixed"], "Сообщение было проверено пользователем на спам. Deprecated.")
+	deleted = _message_flag(FLAGS["deleted"], "Сообщение удалено.")
+	spam = _message_flag(FLAGS["spam"], "Сообщение помечено как спам.")
+	friends = _message_flag(FLAGS["friends"], "Сообщение отправлено другом. Не применяется для сообщений из групповых бесед.")
+	chat = _message_flag(FLAGS["chat"], "Сообщение отправлено через чат. Deprecated.")
+	important = _message_flag(FLAGS["important"], "Помеченное сообщение как важное.")
+	replied = _message_flag(FLAGS["replied"], "На сообщение был создан ответ.")
+	outbox = _message_flag(FLAGS["outbox"], "Указывает, что сообщение является исходящим.")
+	unread = _message_flag(FLAGS["unread"], "Указывает, что сообщение является непрочитанным.")
 
 	_input_flags: int
 	"""Сырое значение флагов сообщения."""
-	_flags_dict: dict[str, bool]
-	"""Словарь с флагами сообщения, их названиями и значениями."""
 
 	def __init__(self, flags: int) -> None:
 		self._input_flags = flags
 
-		self.unread = (flags & 1) != 0
-		self.outbox = (flags & 2) != 0
-		self.replied = (flags & 4) != 0
-		self.important = (flags & 8) != 0
-		self.chat = (flags & 16) != 0
-		self.friends = (flags & 32) != 0
-		self.spam = (flags & 64) != 0
-		self.deleted = (flags & 128) != 0
-		self.fixed = (flags & 256) != 0
-		self.media = (flags & 512) != 0
-		self.hidden = (flags & 65536) != 0
-		self.delete_for_all = (flags & (1 << 6)) != 0
-		self.not_delivered = (flags & (1 << 6)) != 0
-
-		self._flags_dict = {
-			"unread": self.unread,
-			"outbox": self.outbox,
-			"replied": self.replied,
-			"important": self.important,
-			"chat": self.chat,
-			"friends": self.friends,
-			"spam": self.spam,
-			"deleted": self.deleted,
-			"fixed": self.fixed,
-			"media": self.media,
-			"hidden": self.hidden,
-			"delete_for_all": self.delete_for_all,
-			"not_delivered": self.not_delivered
-		}
-
 	def __str__(self) -> str:
-		return f"VKLongpollMessageFlags({', '.join([flag for flag, value in self._flags_dict.items() if value])})"
+		return f"VKLongpollMessageFlags({', '.join([flag for flag, mask in self.FLAGS.items() if self._input_flags & mask])})"
 
 def create_message_link(peer_id: int | str | None, message_id: int | str, use_mobile: bool = False) -> str:
 	"""
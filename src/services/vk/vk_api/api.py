@@ -1,21 +1,75 @@
 # coding: utf-8
 
+import asyncio
+import json
+import random
 from typing import Any, Literal, cast
 
 import aiohttp
-from loguru import logger
 from pydantic import SecretStr
 
+from logger import debug_lazy
+from services.vk.consts import (VK_API_BATCH_MAX_CALLS, VK_API_BATCH_WINDOW,
+                                VK_API_CONNECTIONS_LIMIT,
+                                VK_API_CONNECTIONS_PER_HOST,
+                                VK_API_DNS_CACHE_TTL, VK_API_KEEPALIVE_TIMEOUT,
+                                VK_API_RATE_LIMIT_BACKOFF,
+                                VK_API_RATE_LIMIT_BACKOFF_MAX,
+                                VK_API_RATE_LIMIT_RETRIES,
+                                VK_API_REQUEST_TIMEOUT, VK_API_URL)
 from services.vk.exceptions import (AccessDeniedException,
                                     AccountDeactivatedException,
                                     BaseVKAPIException, CaptchaException,
                                     TokenRevokedException, TooManyRequestsException)
 from services.vk.utils import random_id
+from services.vk.vk_api.decoding import decode_json
+from services.vk.vk_api.scheduler import (METHOD_PRIORITIES, VKRequestPriority,
+                                          VKRequestScheduler, get_scheduler)
 
 
 ALL_USER_FIELDS = "activities, about, blacklisted, blacklisted_by_me, books, bdate, can_be_invited_group, can_post, can_see_all_posts, can_see_audio, can_send_friend_request, can_write_private_message, career, common_count, connections, contacts, city, country, crop_photo, domain, education, exports, followers_count, friend_status, has_photo, has_mobile, home_town, photo_100, photo_200, photo_200_orig, photo_400_orig, photo_50, sex, site, schools, screen_name, status, verified, games, interests, is_favorite, is_friend, is_hidden_from_feed, last_seen, maiden_name, military, movies, music, nickname, occupation, online, personal, photo_id, photo_max, photo_max_orig, quotes, relation, relatives, timezone, tv, universities"
 ALL_GROUP_FIELDS = "activity, ban_info, can_post, can_see_all_posts, city, contacts, counters, country, cover, description, finish_date, fixed_post, links, market, members_count, place, site, start_date, status, verified, photo_100, photo_200, photo_200_orig, photo_400_orig, photo_50"
 
+_session: aiohttp.ClientSession | None = None
+_session_loop: asyncio.AbstractEventLoop | None = None
+
+def get_session() -> aiohttp.ClientSession:
+	"""
+	Возвращает общую для всех объектов `VKAPI` aiohttp-сессию. Сессия держит keep-alive соединения к API ВКонтакте и кэширует DNS, благодаря чему для каждого запроса не создаётся новое TCP/TLS-соединение.
+
+	Сессия создаётся при первом вызове, а так же пересоздаётся, если она была закрыта или если она была создана в другом event loop'е.
+	"""
+
+	global _session, _session_loop
+
+	loop = asyncio.get_running_loop()
+	if _session is None or _session.closed or _session_loop is not loop:
+		_session = aiohttp.ClientSession(
+			connector=aiohttp.TCPConnector(
+				limit=VK_API_CONNECTIONS_LIMIT,
+				limit_per_host=VK_API_CONNECTIONS_PER_HOST,
+				ttl_dns_cache=VK_API_DNS_CACHE_TTL,
+				keepalive_timeout=VK_API_KEEPALIVE_TIMEOUT
+			),
+			timeout=aiohttp.ClientTimeout(total=VK_API_REQUEST_TIMEOUT)
+		)
+		_session_loop = loop
+
+	return _session
+
+async def close_session() -> None:
+	"""
+	Закрывает общую aiohttp-сессию, созданную через `get_session()`. Вызывается при остановке бота.
+	"""
+
+	global _session, _session_loop
+
+	if _session is not None and not _session.closed:
+		await _session.close()
+
+	_session = None
+	_session_loop = None
+
 class VKAPI:
 	"""
 	API для использования методов ВКонтакте.
@@ -25,6 +79,18 @@ class VKAPI:
 
 	token: SecretStr
 	version: str
+	api_url: str = VK_API_URL
+	"""URL, по которому выполняются запросы к API ВКонтакте."""
+
+	scheduler: VKRequestScheduler
+	"""Планировщик запросов, общий для всех объектов `VKAPI` с этим токеном."""
+
+	_batch: list[tuple[str, dict, asyncio.Future]]
+	"""Вызовы, ожидающие объединения в один запрос `execute`. См. `_batched_()`."""
+	_batch_timer: asyncio.TimerHandle | None
+	"""Таймер, по истечению которого накопленные вызовы будут отправлены."""
+	_batch_tasks: set[asyncio.Task]
+	"""Выполняющиеся в данный момент группы вызовов."""
 
 	def __init__(self, token: SecretStr, api_version: str = "5.131") -> None:
 		"""
@@ -36,13 +102,19 @@ class VKAPI:
 		self.token = token
 		self.version = api_version
 
+		self.scheduler = get_scheduler(token)
+
+		self._batch = []
+		self._batch_timer = None
+		self._batch_tasks = set()
+
 	@staticmethod
 	def _parse_response(response: dict, method: str) -> dict:
 		"""
 		Парсит ответ от ВКонтакте.
 		"""
 
-		logger.debug(f"[VK] {method} response: {response}")
+		debug_lazy("[VK] {} response: {}", lambda: method, lambda: response)
 
 		if response.get("error"):
 			error: dict | str = response["error"]
@@ -80,12 +152,13 @@ class VKAPI:
 
 		return {key: value for key, value in data.items() if value is not None}
 
-	async def _get_(self, method: str, params: dict[str, str | int | bool | float | None] | None = None) -> dict:
+	async def _get_raw_(self, method: str, params: dict[str, str | int | bool | float | None] | None = None, in_body: bool = False) -> dict:
 		"""
-		Выполняет GET-запрос к API ВКонтакте.
+		Выполняет GET-запрос к API ВКонтакте, возвращая ответ без его обработки через `_parse_response()`.
 
 		:param method: Метод API.
 		:param params: Параметры запроса.
+		:param in_body: Не используется; нужен для совместимости с `_post_raw_()`.
 		"""
 
 		if params is None:
@@ -94,16 +167,26 @@ class VKAPI:
 		params["access_token"] = self.token.get_secret_value()
 		params["v"] = self.version
 
-		async with aiohttp.ClientSession() as session:
-			async with session.get(f"https://api.vk.com/method/{method}", headers={"User-Agent": ""}, params=self._cleanup_none(params)) as response:
-				return self._parse_response(await response.json(), method)
+		async with get_session().get(f"{self.api_url}/{method}", headers={"User-Agent": ""}, params=self._cleanup_none(params)) as response:
+			return decode_json(await response.read())
 
-	async def _post_(self, method: str, params: dict[str, str | int | bool | float | None] | None = None) -> dict:
+	async def _get_(self, method: str, params: dict[str, str | int | bool | float | None] | None = None) -> dict:
+		"""
+		Выполняет GET-запрос к API ВКонтакте.
+
+		:param method: Метод API.
+		:param params: Параметры запроса.
 		"""
-		Выполняет POST-запрос к API ВКонтакте.
+
+		return self._parse_response(await self._request_("GET", method, params), method)
+
+	async def _post_raw_(self, method: str, params: dict[str, str | int | bool | float | None] | None = None, in_body: bool = False) -> dict:
+		"""
+		Выполняет POST-запрос к API ВКонтакте, возвращая ответ без его обработки через `_parse_response()`.
 
 		:param method: Метод API.
 		:param params: Параметры запроса.
+		:param in_body: Передавать ли параметры в теле запроса, а не в URL. Используется для запросов с большими параметрами, например, для `execute`.
 		"""
 
 		if params is None:
@@ -111,10 +194,158 @@ class VKAPI:
 
 		params["access_token"] = self.token.get_secret_value()
 		params["v"] = self.version
+		params = self._cleanup_none(params)
+
+		async with get_session().post(f"{self.api_url}/{method}", headers={"User-Agent": "VKAndroidApp/8.61-18574 (Android 13; SDK 33; arm64-v8a; Google Pixel 5; ru; 1920x1080)"}, data=params if in_body else None, params=None if in_body else params) as response:
+			return decode_json(await response.read())
+
+	async def _post_(self, method: str, params: dict[str, str | int | bool | float | None] | None = None) -> dict:
+		"""
+		Выполняет POST-запрос к API ВКонтакте.
+
+		:param method: Метод API.
+		:param params: Параметры запроса.
+		"""
+
+		return self._parse_response(await self._request_("POST", method, params), method)
+
+	async def _request_(self, http_method: Literal["GET", "POST"], method: str, params: dict[str, str | int | bool | float | None] | None = None, in_body: bool = False, priority: VKRequestPriority | None = None) -> dict:
+		"""
+		Выполняет запрос к API ВКонтакте через планировщик запросов этого токена, возвращая ответ без его обработки через `_parse_response()`.
+
+		При получении ошибки 6 (слишком много запросов) планировщик замедляется, а запрос повторяется (не более `VK_API_RATE_LIMIT_RETRIES` раз) с экспоненциально растущей случайной задержкой.
+
+		:param http_method: HTTP-метод запроса.
+		:param method: Метод API.
+		:param params: Параметры запроса.
+		:param in_body: Передавать ли параметры в теле запроса, а не в URL.
+		:param priority: Приоритет запроса. Если не указан, то берётся из `METHOD_PRIORITIES`.
+		"""
+
+		if priority is None:
+			priority = METHOD_PRIORITIES.get(method, VKRequestPriority.HIGH)
+
+		request = self._get_raw_ if http_method == "GET" else self._post_raw_
+
+		attempt = 0
+		while True:
+			await self.scheduler.acquire(priority)
+
+			response = await request(method, dict(params) if params else None, in_body=in_body)
 
-		async with aiohttp.ClientSession() as session:
-			async with session.post(f"https://api.vk.com/method/{method}", headers={"User-Agent": "VKAndroidApp/8.61-18574 (Android 13; SDK 33; arm64-v8a; Google Pixel 5; ru; 1920x1080)"}, params=self._cleanup_none(params)) as response:
-				return self._parse_response(await response.json(), method)
+			error = response.get("error")
+			if not (isinstance(error, dict) and error.get("error_code") == 6):
+				self.scheduler.on_success()
+
+				return response
+
+			self.scheduler.on_rate_limited()
+			if attempt >= VK_API_RATE_LIMIT_RETRIES:
+				return response
+
+			delay = min(VK_API_RATE_LIMIT_BACKOFF_MAX, VK_API_RATE_LIMIT_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.5)
+			attempt += 1
+
+			debug_lazy("[VK] Слишком много запросов при вызове {}, повторная попытка #{} через {:.2f} сек.", lambda: method, lambda: attempt, lambda: delay)
+
+			await asyncio.sleep(delay)
+
+	async def _batched_(self, method: str, params: dict[str, str | int | bool | float | None] | None = None) -> Any:
+		"""
+		Выполняет метод API ВКонтакте, объединяя его с другими вызовами в один запрос `execute`. Результат (либо ошибка) конкретного вызова возвращается вызвавшему его коду.
+
+		Если других запросов `execute` в данный момент не выполняется, то вызов отправляется сразу же, объединяясь лишь с вызовами, сделанными одновременно с ним. В ином случае вызовы накапливаются в течении `VK_API_BATCH_WINDOW` секунд.
+
+		:param method: Метод API.
+		:param params: Параметры запроса.
+		"""
+
+		loop = asyncio.get_running_loop()
+		future = loop.create_future()
+
+		self._batch.append((method, self._cleanup_none(params or {}), future))
+
+		if len(self._batch) >= VK_API_BATCH_MAX_CALLS:
+			self._start_batch()
+		elif self._batch_timer is None:
+			# Нулевая задержка всё равно даёт выполниться вызовам, уже ожидающим своей очереди в event loop'е.
+			self._batch_timer = loop.call_later(VK_API_BATCH_WINDOW if self._batch_tasks else 0, self._start_batch)
+
+		return await future
+
+	def _start_batch(self) -> None:
+		"""
+		Отправляет все накопленные через `_batched_()` вызовы в фоне.
+		"""
+
+		if self._batch_timer is not None:
+			self._batch_timer.cancel()
+			self._batch_timer = None
+
+		calls, self._batch = self._batch, []
+		if not calls:
+			return
+
+		task = asyncio.create_task(self._execute_batch(calls))
+		self._batch_tasks.add(task)
+		task.add_done_callback(self._batch_tasks.discard)
+
+	@staticmethod
+	def _get_batch_code(calls: list[tuple[str, dict, asyncio.Future]]) -> str:
+		"""
+		Возвращает VKScript-код для `execute`, который выполняет все вызовы из `calls` и возвращает массив их результатов.
+
+		:param calls: Список вызовов.
+		"""
+
+		return "return [" + ",".join(f"API.{method}({json.dumps(params, ensure_ascii=False)})" for method, params, _ in calls) + "];"
+
+	async def _execute_batch(self, calls: list[tuple[str, dict, asyncio.Future]]) -> None:
+		"""
+		Выполняет группу вызовов одним запросом `execute` и раздаёт результаты ожидающим их вызовам.
+
+		:param calls: Список вызовов.
+		"""
+
+		try:
+			if len(calls) == 1:
+				method, params, future = calls[0]
+
+				result = await self._post_(method, dict(params))
+				if not future.done():
+					future.set_result(result)
+
+				return
+
+			debug_lazy("[VK] Объединяю {} вызовов в execute: {}", lambda: len(calls), lambda: ", ".join(method for method, _, _ in calls))
+
+			raw_response = await self._request_("POST", "execute", {"code": self._get_batch_code(calls)}, in_body=True, priority=min(METHOD_PRIORITIES.get(method, VKRequestPriority.HIGH) for method, _, _ in calls))
+			results = self._parse_response(raw_response, "execute")
+		except Exception as error:
+			for _, _, future in calls:
+				if not future.done():
+					future.set_exception(error)
+
+			return
+
+		# Если какой-то из вызовов завершился с ошибкой, то вместо его результата возвращается false,
+		# а сама ошибка добавляется (в порядке вызовов) в поле execute_errors.
+		execute_errors = list(raw_response.get("execute_errors", []))
+
+		for index, (method, _, future) in enumerate(calls):
+			if future.done():
+				continue
+
+			result = results[index] if isinstance(results, list) and index < len(results) else False
+			if result is False and execute_errors:
+				try:
+					self._parse_response({"error": execute_errors.pop(0)}, method)
+				except Exception as error:
+					future.set_exception(error)
+
+					continue
+
+			future.set_result(result)
 
 	async def account_setOnline(self) -> dict:
 		"""
@@ -142,7 +373,7 @@ class VKAPI:
 		if user_ids:
 			data["user_ids"] = ",".join(map(str, user_ids))
 
-		return await self._post_("users.get", data)
+		return await self._batched_("users.get", data)
 
 	async def get_self_info(self, user_id: int | None = None) -> dict:
 		"""
@@ -212,12 +443,37 @@ class VKAPI:
 
 		return True
 
-	async def messages_getLongPollServer(self) -> dict:
+	async def messages_getLongPollServer(self, need_pts: bool = True, lp_version: int | None = None) -> dict:
 		"""
 		Выдаёт информацию о longpoll-сервере. API: `messages.getLongPollServer`.
+
+		:param need_pts: Возвращать ли поле `pts`, необходимое для `messages.getLongPollHistory`.
+		:param lp_version: Версия longpoll.
+		"""
+
+		return await self._post_("messages.getLongPollServer", {
+			"need_pts": 1 if need_pts else 0,
+			"lp_version": lp_version
+		})
+
+	async def messages_getLongPollHistory(self, ts: int, pts: int, lp_version: int | None = None, events_limit: int = 1000, msgs_limit: int = 200) -> dict:
 		"""
+		Возвращает события longpoll, произошедшие после указанных `ts` и `pts`. API: `messages.getLongPollHistory`.
 
-		return await self._post_("messages.getLongPollServer")
+		:param ts: Последнее значение `ts`, полученное от longpoll-сервера.
+		:param pts: Последнее значение `pts`, полученное от longpoll-сервера.
+		:param lp_version: Версия longpoll, в формате которой будут возвращены события.
+		:param events_limit: Максимальное количество возвращаемых событий.
+		:param msgs_limit: Максимальное количество возвращаемых сообщений.
+		"""
+
+		return await self._post_("messages.getLongPollHistory", {
+			"ts": ts,
+			"pts": pts,
+			"lp_version": lp_version,
+			"events_limit": events_limit,
+			"msgs_limit": msgs_limit
+		})
 
 	async def messages_getConversations(self, offset: int = 0, count: int = 200, extended: bool = True) -> dict:
 		"""
@@ -261,7 +517,7 @@ class VKAPI:
 		if isinstance(message_ids, int):
 			message_ids = [message_ids]
 
-		return await self._post_("messages.getById", {
+		return await self._batched_("messages.getById", {
 			"message_ids": ",".join(map(str, message_ids))
 		})
 
@@ -377,7 +633,7 @@ class VKAPI:
 		:param mark_conversation_as_read: Пометить ли беседу как прочитанную.
 		"""
 
-		return await self._post_("messages.markAsRead", {
+		return await self._batched_("messages.markAsRead", {
 			"peer_id": peer_id,
 			"start_message_id": start_message_id,
 			"mark_conversation_as_read": 1 if mark_conversation_as_read else 0
@@ -404,7 +660,7 @@ class VKAPI:
 		:param hash: Хэш.
 		"""
 
-		return await self._post_("photos.saveMessagesPhoto", {
+		return await self._batched_("photos.saveMessagesPhoto", {
 			"photo": photo,
 			"server": server,
 			"hash": hash
@@ -481,7 +737,7 @@ class VKAPI:
 		if user_ids:
 			data["group_ids"] = ",".join(map(str, user_ids))
 
-		return await self._post_("groups.getById", data)
+		return await self._batched_("groups.getById", data)
 
 	async def execute(self, code: str) -> dict:
 		"""
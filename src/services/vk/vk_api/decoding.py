@@ -0,0 +1,72 @@
+# coding: utf-8
+
+import json
+from typing import Any, Callable, TypedDict, cast
+
+try:
+	import msgspec
+except ImportError:
+	msgspec = None
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+
+class LongpollResponse(TypedDict, total=False):
+	"""
+	Ответ longpoll-сервера ВКонтакте на запрос `a_check`.
+	"""
+
+	ts: int
+	"""Номер последнего события, начиная с которого нужно получать данные."""
+	pts: int
+	"""Значение `pts`, используемое в `messages.getLongPollHistory`. Возвращается, если в `mode` longpoll'а есть флаг 32."""
+	updates: list[list[Any]]
+	"""Список событий."""
+	failed: int
+	"""Код ошибки longpoll-сервера."""
+
+def _get_json_decoder() -> tuple[str, Callable[[bytes | str], Any]]:
+	"""
+	Возвращает название и функцию самого быстрого из установленных JSON-декодеров: `msgspec`, `orjson`, либо стандартного `json`.
+	"""
+
+	if msgspec is not None:
+		return "msgspec", msgspec.json.Decoder().decode
+
+	if orjson is not None:
+		return "orjson", orjson.loads
+
+	return "json", json.loads
+
+JSON_DECODER_NAME, _decode = _get_json_decoder()
+"""Название используемого JSON-декодера."""
+
+_longpoll_decoder = msgspec.json.Decoder(LongpollResponse) if msgspec is not None else None
+
+def decode_json(data: bytes | str) -> Any:
+	"""
+	Декодирует JSON при помощи самого быстрого из установленных JSON-декодеров. Используется для ответов API ВКонтакте и longpoll-серверов.
+
+	:param data: JSON в виде байтов или строки.
+	"""
+
+	return _decode(data)
+
+def decode_longpoll_response(data: bytes | str) -> LongpollResponse:
+	"""
+	Декодирует ответ longpoll-сервера. Если установлен `msgspec`, то типы полей ответа проверяются прямо при декодировании.
+
+	:param data: JSON в виде байтов или строки.
+	"""
+
+	if _longpoll_decoder is not None:
+		try:
+			return _longpoll_decoder.decode(data)
+		except msgspec.ValidationError: # type: ignore
+			# Неожиданный формат ответа; дальнейшая обработка разберётся с ним сама.
+			pass
+
+	return cast(LongpollResponse, _decode(data))
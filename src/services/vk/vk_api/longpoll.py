@@ -1,15 +1,30 @@
 # coding: utf-8
 
 import asyncio
+import json
+import random
+import time
+import weakref
 from asyncio import TimeoutError
-from typing import AsyncGenerator, Optional
+from collections import deque
+from contextlib import nullcontext
+from typing import AsyncGenerator, Awaitable, Callable, Optional, cast
 
 import aiohttp
 from aiohttp import ClientConnectionError
 from loguru import logger
 
+from logger import debug_lazy
+from services.vk.consts import (VK_API_DNS_CACHE_TTL,
+                                VK_LONGPOLL_CONNECT_TIMEOUT,
+                                VK_LONGPOLL_MAX_PENDING_EVENTS,
+                                VK_LONGPOLL_MAX_WORKERS,
+                                VK_LONGPOLL_RETRY_DELAY_MAX,
+                                VK_LONGPOLL_SERVER_REFRESH_RETRIES,
+                                VK_LONGPOLL_TIMEOUT_SLACK)
 from services.vk.utils import VKLongpollMessageFlags
 from services.vk.vk_api.api import VKAPI
+from services.vk.vk_api.decoding import decode_longpoll_response
 
 
 class BaseVKLongpollEvent:
@@ -19,6 +34,11 @@ class BaseVKLongpollEvent:
 	Неофициальная документация Longpoll: https://danyadev.github.io/longpoll-doc/
 	"""
 
+	__slots__ = ("event_type", "event_data", "event_raw")
+
+	min_length: int = 0
+	"""Минимальная длина события, при которой оно будет распознано как событие этого класса."""
+
 	event_type: int
 	"""Тип события. Список событий: https://dev.vk.com/api/user-long-poll/getting-started#Структура событий"""
 	event_data: list
@@ -41,39 +61,213 @@ class BaseVKLongpollEvent:
 		:param raise_error: Выбрасывать ли ошибку, если тип события неизвестен. Если False, то возвращает None.
 		"""
 
-		event_type = event[0]
+		event_class = LONGPOLL_EVENT_CLASSES.get(event[0])
 
-		if event_type == 10004 and len(event) > 4:
-			# В редких случаях, ВКонтакте возвращает событие о новом сообщении (т.е., LongpollNewMessageEvent)
-			# с очень странным содержимым: в таком событии есть лишь 2 поля, предположительно:
-			# - ID сообщения.
-			# - Дата в UNIX.
-			#
-			# Всех остальных полей (по типу текста, ID отправителя и всего такого) нет.
-			# Что бы избежать странных ошибок, обработка такого типа событий здесь исключается.
-
-			return LongpollNewMessageEvent(event)
-		elif event_type == 63:
-			return LongpollTypingEventMultiple(event)
-		elif event_type == 64:
-			return LongpollVoiceMessageEvent(event)
-		elif event_type == 10005:
-			return LongpollMessageEditEvent(event)
-		elif event_type == 10002:
-			return LongpollMessageFlagsEdit(event)
+		if event_class and len(event) >= event_class.min_length:
+			return event_class(event)
 
 		if raise_error:
-			raise ValueError(f"Неизвестный тип события: {event_type}")
+			raise ValueError(f"Неизвестный тип события: {event[0]}")
 
 		return None
 
-class LongpollNewMessageEvent(BaseVKLongpollEvent):
+def _int_or_none(value: str | int | None) -> int | None:
+	"""
+	Преобразовывает значение из дополнительных полей сообщения в int, если оно есть.
+
+	:param value: Значение поля.
+	"""
+
+	return int(value) if value else None
+
+def _get_history_message_event(event: list, message: dict) -> list:
+	"""
+	Возвращает полное longpoll-событие нового сообщения, созданное из укороченного события `messages.getLongPollHistory` (вида `[10004, ID сообщения, флаги, ID чата]`) и самого сообщения из поля `messages` её ответа.
+
+	:param event: Укороченное событие нового сообщения.
+	:param message: Сообщение, полученное вместе с событием.
+	"""
+
+	additional: dict = {"from": str(message["from_id"])}
+
+	action = message.get("action")
+	if action:
+		additional["source_act"] = action["type"]
+
+		if action.get("member_id"):
+			additional["source_mid"] = str(action["member_id"])
+
+		if action.get("text"):
+			additional["source_text"] = action["text"]
+
+		if action.get("conversation_message_id"):
+			additional["source_chat_local_id"] = str(action["conversation_message_id"])
+
+	for field in ("payload", "keyboard"):
+		if field in message:
+			additional[field] = message[field]
+
+	attachments: dict = {}
+	for index, attachment in enumerate(message.get("attachments", []), start=1):
+		attachments[f"attach{index}_type"] = attachment["type"]
+
+		if attachment["type"] == "video_message":
+			attachments[f"attach{index}_type"] = "video"
+			attachments[f"attach{index}_kind"] = "video_message"
+
+	if message.get("reply_message"):
+		attachments["reply"] = json.dumps({"conversation_message_id": message["reply_message"].get("conversation_message_id")})
+
+	return [
+		10004, message["conversation_message_id"], event[2], 0, message["peer_id"], message["date"], message["text"],
+		additional, attachments, message.get("random_id", 0), message["id"], message.get("update_time", 0)
+	]
+
+def _expand_history_updates(updates: list[list], messages: list[dict]) -> list[list]:
+	"""
+	Заменяет укороченные события новых сообщений из `messages.getLongPollHistory` на полные, используя сообщения из поля `messages` её ответа. События, сообщения которых не были получены (к примеру, удалённые), остаются без изменений.
+
+	:param updates: События из поля `history`.
+	:param messages: Сообщения из поля `messages.items`.
+	"""
+
+	messages_by_id = {message["id"]: message for message in messages}
+	messages_by_conversation_id = {(message["peer_id"], message.get("conversation_message_id")): message for message in messages}
+
+	expanded = []
+	for event in updates:
+		if event[0] == 10004 and len(event) < LongpollNewMessageEvent.min_length:
+			# В зависимости от версии longpoll'а, в событии передаётся либо ID сообщения, либо его ID в беседе.
+			message = messages_by_conversation_id.get((event[3], event[1])) if len(event) > 3 else None
+			message = message or messages_by_id.get(event[1])
+
+			if message:
+				event = _get_history_message_event(event, message)
+
+		expanded.append(event)
+
+	return expanded
+
+class _LongpollMessageAdditionalFields:
+	"""
+	Дополнительные поля сообщения (`_additional_`) для событий нового и отредактированного сообщения.
+
+	Редко используемые поля извлекаются из `_additional_` лишь при обращении к ним.
+	"""
+
+	__slots__ = ()
+
+	_additional_: dict
+	"""Дополнительные поля."""
+	title: str | None
+	"""Титульник сообщения."""
+	emoji: bool | None
+	"""Наличие эмодзи в сообщении."""
+	from_id: int | None
+	"""ID отправителя сообщения."""
+
+	def _parse_additional_(self, additional: dict) -> None:
+		"""
+		Извлекает часто используемые дополнительные поля сообщения.
+
+		:param additional: Объект с дополнительными полями.
+		"""
+
+		self._additional_ = additional
+		self.title = additional.get("title")
+		self.emoji = additional.get("emoji") == "1"
+		self.from_id = _int_or_none(additional.get("from"))
+
+	@property
+	def has_template(self) -> bool | None:
+		"""Наличие шаблона."""
+
+		return self._additional_.get("has_template") == "1"
+
+	@property
+	def marked_users(self) -> list | None:
+		"""Упомянутые пользователи в сообщении."""
+
+		return self._additional_.get("marked_users")
+
+	@property
+	def keyboard(self) -> object | None:
+		"""Объект клавиатуры от ботом."""
+
+		return self._additional_.get("keyboard")
+
+	@property
+	def expire_ttl(self) -> int | None:
+		"""Количество секунд до исчезновения сообщения."""
+
+		return _int_or_none(self._additional_.get("expire_ttl"))
+
+	@property
+	def ttl(self) -> int | None:
+		"""Количество секунд до исчезновения сообщения в фантомном чате."""
+
+		return self._additional_.get("ttl")
+
+	@property
+	def is_expired(self) -> bool | None:
+		"""Указывает, что сообщение исчезло."""
+
+		return self._additional_.get("is_expired") == "1"
+
+	@property
+	def payload(self) -> str | None:
+		"""Полезная нагрузка сообщения."""
+
+		return self._additional_.get("payload")
+
+	@property
+	def source_act(self) -> str | None:
+		"""Действие, которое было совершено с сообщением. Например, `chat_kick_user`."""
+
+		return self._additional_.get("source_act")
+
+	@property
+	def source_text(self) -> str | None:
+		"""Текст, который связан с `source_act`."""
+
+		return self._additional_.get("source_text")
+
+	@property
+	def source_old_text(self) -> str | None:
+		"""Старый текст, который связан с `source_act`."""
+
+		return self._additional_.get("source_old_text")
+
+	@property
+	def source_message_id(self) -> int | None:
+		"""ID пользователя, с которым связано `source_act`."""
+
+		return _int_or_none(self._additional_.get("source_mid"))
+
+	@property
+	def source_chat_local_id(self) -> int | None:
+		"""ID сообщения, с которым связано `source_act`."""
+
+		return _int_or_none(self._additional_.get("source_chat_local_id"))
+
+class LongpollNewMessageEvent(_LongpollMessageAdditionalFields, BaseVKLongpollEvent):
 	"""
 	Longpoll-событие, вызываемое при получении нового сообщения ВКонтакте.
 
 	ID события: `10004`.
 	"""
 
+	__slots__ = ("conversation_message_id", "flags", "minor_id", "peer_id", "timestamp", "text", "_additional_", "title", "emoji", "from_id", "attachments", "random_id", "message_id", "update_timestamp")
+
+	# В редких случаях, ВКонтакте возвращает событие о новом сообщении (т.е., LongpollNewMessageEvent)
+	# с очень странным содержимым: в таком событии есть лишь 2 поля, предположительно:
+	# - ID сообщения.
+	# - Дата в UNIX.
+	#
+	# Всех остальных полей (по типу текста, ID отправителя и всего такого) нет.
+	# Что бы избежать странных ошибок, обработка такого типа событий исключается.
+	min_length = 5
+
 	conversation_message_id: int
 	"""ID сообщения относительно текущей беседы."""
 	flags: VKLongpollMessageFlags
@@ -87,40 +281,6 @@ class LongpollNewMessageEvent(BaseVKLongpollEvent):
 	text: str
 	"""Текст сообщения."""
 
-	# Объект с дополнительными данными.
-	_additional_: dict
-	"""Дополнительные поля."""
-	title: str | None
-	"""Титульник сообщения."""
-	emoji: bool | None
-	"""Наличие эмодзи в сообщении."""
-	from_id: int | None
-	"""ID отправителя сообщения."""
-	has_template: bool | None
-	"""Наличие шаблона."""
-	marked_users: list | None
-	"""Упомянутые пользователи в сообщении."""
-	keyboard: object | None
-	"""Объект клавиатуры от ботом."""
-	expire_ttl: int | None
-	"""Количество секунд до исчезновения сообщения."""
-	ttl: int | None
-	"""Количество секунд до исчезновения сообщения в фантомном чате."""
-	is_expired: bool | None
-	"""Указывает, что сообщение исчезло."""
-	payload: str | None
-	"""Полезная нагрузка сообщения."""
-	source_act: str | None
-	"""Действие, которое было совершено с сообщением. Например, `chat_kick_user`."""
-	source_text: str | None
-	"""Текст, который связан с `source_act`."""
-	source_old_text: str | None
-	"""Старый текст, который связан с `source_act`."""
-	source_message_id: int | None
-	"""ID пользователя, с которым связано `source_act`."""
-	source_chat_local_id: int | None
-	"""ID сообщения, с которым связано `source_act`."""
-
 	attachments: dict
 	"""Вложения сообщения."""
 
@@ -134,43 +294,14 @@ class LongpollNewMessageEvent(BaseVKLongpollEvent):
 	def __init__(self, event: list) -> None:
 		super().__init__(event)
 
-		self.conversation_message_id = self.event_data[0]
-		self.flags = VKLongpollMessageFlags(self.event_data[1])
-		self.minor_id = self.event_data[2]
-		self.peer_id = self.event_data[3]
-		self.timestamp = self.event_data[4]
-		self.text =  self.event_data[5]
-
-		self._additional_ = self.event_data[6]
-		self.title = self._additional_.get("title", None)
-		self.emoji = self._additional_.get("emoji", None) == "1"
-		self.from_id = self._additional_.get("from", None)
-		if self.from_id:
-			self.from_id = int(self.from_id)
-		self.has_template = self._additional_.get("has_template", None) == "1"
-		self.marked_users = self._additional_.get("marked_users", None)
-		self.keyboard = self._additional_.get("keyboard", None)
-		self.expire_ttl = self._additional_.get("expire_ttl", None)
-		if self.expire_ttl:
-			self.expire_ttl = int(self.expire_ttl)
-		self.ttl = self._additional_.get("ttl", None)
-		self.is_expired = self._additional_.get("is_expired", None) == "1"
-		self.payload = self._additional_.get("payload", None)
-		self.source_act = self._additional_.get("source_act")
-		self.source_message_id = self._additional_.get("source_mid")
-		if self.source_message_id:
-			self.source_message_id = int(self.source_message_id)
-		self.source_chat_local_id = self._additional_.get("source_chat_local_id")
-		if self.source_chat_local_id:
-			self.source_chat_local_id = int(self.source_chat_local_id)
-		self.source_text = self._additional_.get("source_text")
-		self.source_old_text = self._additional_.get("source_old_text")
-
-		self.attachments = self.event_data[7]
-
-		self.random_id = self.event_data[8]
-		self.message_id = self.event_data[9]
-		self.update_timestamp = self.event_data[10] or None
+		(
+			self.conversation_message_id, flags, self.minor_id, self.peer_id, self.timestamp, self.text,
+			additional, self.attachments, self.random_id, self.message_id, update_timestamp
+		) = self.event_data[:11]
+
+		self.flags = VKLongpollMessageFlags(flags)
+		self._parse_additional_(additional)
+		self.update_timestamp = update_timestamp or None
 
 class LongpollTypingEventMultiple(BaseVKLongpollEvent):
 	"""
@@ -179,6 +310,8 @@ class LongpollTypingEventMultiple(BaseVKLongpollEvent):
 	ID события: `63`.
 	"""
 
+	__slots__ = ("peer_id", "user_ids", "total_count", "timestamp")
+
 	peer_id: int
 	"""Чат, в котором начали печатать сообщение."""
 	user_ids: list[int]
@@ -203,6 +336,8 @@ class LongpollVoiceMessageEvent(BaseVKLongpollEvent):
 	ID события: `64`.
 	"""
 
+	__slots__ = ("user_ids", "peer_id")
+
 	user_ids: int
 	"""ID пользователей, которые записывают голосовое сообщение. Может быть несколько, если данное событие произошло в беседе, где записывают голосовые сообщения сразу несколько людей."""
 	peer_id: int
@@ -214,13 +349,15 @@ class LongpollVoiceMessageEvent(BaseVKLongpollEvent):
 		self.peer_id = self.event_data[0]
 		self.user_ids = self.event_data[1]
 
-class LongpollMessageEditEvent(BaseVKLongpollEvent):
+class LongpollMessageEditEvent(_LongpollMessageAdditionalFields, BaseVKLongpollEvent):
 	"""
 	Longpoll-событие, вызываемое при редактировании сообщения.
 
 	ID события: `10005`.
 	"""
 
+	__slots__ = ("flags", "minor_id", "peer_id", "timestamp", "text", "_additional_", "title", "emoji", "from_id", "attachments", "random_id", "message_id", "update_timestamp")
+
 	flags: VKLongpollMessageFlags
 	"""Флаги сообщения."""
 	minor_id: int | None
@@ -232,40 +369,6 @@ class LongpollMessageEditEvent(BaseVKLongpollEvent):
 	text: str
 	"""Текст сообщения."""
 
-	# Объект с дополнительными данными.
-	_additional_: dict
-	"""Дополнительные поля."""
-	title: str | None
-	"""Титульник сообщения."""
-	emoji: bool | None
-	"""Наличие эмодзи в сообщении."""
-	from_id: int | None
-	"""ID отправителя сообщения."""
-	has_template: bool | None
-	"""Наличие шаблона."""
-	marked_users: list | None
-	"""Упомянутые пользователи в сообщении."""
-	keyboard: object | None
-	"""Объект клавиатуры от ботом."""
-	expire_ttl: int | None
-	"""Количество секунд до исчезновения сообщения."""
-	ttl: int | None
-	"""Количество секунд до исчезновения сообщения в фантомном чате."""
-	is_expired: bool | None
-	"""Указывает, что сообщение исчезло."""
-	payload: str | None
-	"""Полезная нагрузка сообщения."""
-	source_act: str | None
-	"""Действие, которое было совершено с сообщением. Например, `chat_kick_user`."""
-	source_text: str | None
-	"""Текст, который связан с `source_act`."""
-	source_old_text: str | None
-	"""Старый текст, который связан с `source_act`."""
-	source_message_id: int | None
-	"""ID пользователя, с которым связано `source_act`."""
-	source_chat_local_id: int | None
-	"""ID сообщения, с которым связано `source_act`."""
-
 	attachments: dict
 	"""Вложения сообщения."""
 
@@ -279,42 +382,14 @@ class LongpollMessageEditEvent(BaseVKLongpollEvent):
 	def __init__(self, event: list) -> None:
 		super().__init__(event)
 
-		self.flags = VKLongpollMessageFlags(self.event_data[0])
-		self.minor_id = self.event_data[1]
-		self.peer_id = self.event_data[2]
-		self.timestamp = self.event_data[3]
-		self.text =  self.event_data[4]
-
-		self._additional_ = self.event_data[5]
-		self.title = self._additional_.get("title", None)
-		self.emoji = self._additional_.get("emoji", None) == "1"
-		self.from_id = self._additional_.get("from", None)
-		if self.from_id:
-			self.from_id = int(self.from_id)
-		self.has_template = self._additional_.get("has_template", None) == "1"
-		self.marked_users = self._additional_.get("marked_users", None)
-		self.keyboard = self._additional_.get("keyboard", None)
-		self.expire_ttl = self._additional_.get("expire_ttl", None)
-		if self.expire_ttl:
-			self.expire_ttl = int(self.expire_ttl)
-		self.ttl = self._additional_.get("ttl", None)
-		self.is_expired = self._additional_.get("is_expired", None) == "1"
-		self.payload = self._additional_.get("payload", None)
-		self.source_act = self._additional_.get("source_act")
-		self.source_message_id = self._additional_.get("source_mid")
-		if self.source_message_id:
-			self.source_message_id = int(self.source_message_id)
-		self.source_chat_local_id = self._additional_.get("source_chat_local_id")
-		if self.source_chat_local_id:
-			self.source_chat_local_id = int(self.source_chat_local_id)
-		self.source_text = self._additional_.get("source_text")
-		self.source_old_text = self._additional_.get("source_old_text")
-
-		self.attachments = self.event_data[6]
-
-		self.random_id = self.event_data[7]
-		self.message_id = self.event_data[8]
-		self.update_timestamp = self.event_data[9] or None
+		(
+			flags, self.minor_id, self.peer_id, self.timestamp, self.text,
+			additional, self.attachments, self.random_id, self.message_id, update_timestamp
+		) = self.event_data[:10]
+
+		self.flags = VKLongpollMessageFlags(flags)
+		self._parse_additional_(additional)
+		self.update_timestamp = update_timestamp or None
 
 class LongpollMessageFlagsEdit(BaseVKLongpollEvent):
 	"""
@@ -323,6 +398,8 @@ class LongpollMessageFlagsEdit(BaseVKLongpollEvent):
 	ID события: `10002`.
 	"""
 
+	__slots__ = ("conversation_message_id", "new_flags", "peer_id")
+
 	conversation_message_id: int
 	"""ID сообщения в беседе."""
 	new_flags: VKLongpollMessageFlags
@@ -337,6 +414,15 @@ class LongpollMessageFlagsEdit(BaseVKLongpollEvent):
 		self.new_flags = VKLongpollMessageFlags(self.event_data[1])
 		self.peer_id = self.event_data[2]
 
+LONGPOLL_EVENT_CLASSES: dict[int, type[BaseVKLongpollEvent]] = {
+	10004: LongpollNewMessageEvent,
+	63: LongpollTypingEventMultiple,
+	64: LongpollVoiceMessageEvent,
+	10005: LongpollMessageEditEvent,
+	10002: LongpollMessageFlagsEdit
+}
+"""Классы longpoll-событий по их ID. Используется в `BaseVKLongpollEvent.get_event_type()`."""
+
 class VKAPILongpoll:
 	"""
 	Longpoll для ВКонтакте.
@@ -353,12 +439,30 @@ class VKAPILongpoll:
 	version: int
 	"""Версия Longpoll."""
 
-	def __init__(self, api: VKAPI, wait: int = 50, mode: int = 1706, version: int = 19):
+	checkpoint: tuple[int, int | None] | None
+	"""Сохранённая позиция (`ts` и `pts`), с которой longpoll продолжит работу. Используется лишь при первом подключении к longpoll-серверу."""
+	on_position: Callable[[int, int | None], None] | None
+	"""Функция, вызываемая с `ts` и `pts` после того, как все события очередного ответа longpoll-сервера были выданы."""
+
+	_session: aiohttp.ClientSession | None
+	"""aiohttp-сессия для запросов к longpoll-серверу. См. `_get_session()`."""
+	_shared_session: aiohttp.ClientSession | None
+	"""Общая aiohttp-сессия, переданная извне. Если указана, то используется вместо собственной и не закрывается этим longpoll'ом."""
+	_connect_semaphore: asyncio.Semaphore | None
+	"""Семафор, ограничивающий количество одновременных запросов `messages.getLongPollServer` среди нескольких longpoll'ов."""
+
+	def __init__(self, api: VKAPI, wait: int = 50, mode: int = 1706, version: int = 19, checkpoint: tuple[int, int | None] | None = None, on_position: Callable[[int, int | None], None] | None = None, session: aiohttp.ClientSession | None = None, connect_semaphore: asyncio.Semaphore | None = None):
 		self.api = api
 
 		self.wait = wait
 		self.mode = mode
 		self.version = version
+		self.checkpoint = checkpoint
+		self.on_position = on_position
+
+		self._session = None
+		self._shared_session = session
+		self._connect_semaphore = connect_semaphore
 
 	def stop(self) -> None:
 		"""
@@ -368,6 +472,41 @@ class VKAPILongpoll:
 		if not self.is_stopped:
 			self.is_stopped = True
 
+	def _get_session(self) -> aiohttp.ClientSession:
+		"""
+		Возвращает aiohttp-сессию этого longpoll'а. Сессия держит одно keep-alive соединение к longpoll-серверу, которое переиспользуется между запросами, вместо создания нового TCP/TLS-соединения каждый цикл.
+
+		Если longpoll'у была передана общая сессия, то возвращается она.
+		"""
+
+		if self._shared_session is not None:
+			return self._shared_session
+
+		if self._session is None or self._session.closed:
+			self._session = aiohttp.ClientSession(
+				connector=aiohttp.TCPConnector(
+					limit=1,
+					ttl_dns_cache=VK_API_DNS_CACHE_TTL,
+					keepalive_timeout=self.wait + VK_LONGPOLL_TIMEOUT_SLACK
+				),
+				timeout=aiohttp.ClientTimeout(
+					total=self.wait + VK_LONGPOLL_TIMEOUT_SLACK,
+					sock_connect=VK_LONGPOLL_CONNECT_TIMEOUT
+				)
+			)
+
+		return self._session
+
+	async def close(self) -> None:
+		"""
+		Закрывает aiohttp-сессию этого longpoll'а. Общая сессия, переданная извне, не закрывается.
+		"""
+
+		if self._session is not None and not self._session.closed:
+			await self._session.close()
+
+		self._session = None
+
 	async def get_longpoll_event(self, server: dict) -> dict:
 		"""
 		Получает событие с longpoll-сервера.
@@ -375,9 +514,13 @@ class VKAPILongpoll:
 		Предупреждение: Ввиду того, как работает longpoll, данный метод выполяется очень долго, если нету никаких событий со стороны ВКонтакте.
 		"""
 
-		async with aiohttp.ClientSession() as session:
-			async with session.post(f"https://{server['server']}?act=a_check&key={server['key']}&ts={server['ts']}&wait={self.wait}&mode={self.mode}&version={self.version}") as response:
-				return await response.json()
+		timeout = aiohttp.ClientTimeout(
+			total=self.wait + VK_LONGPOLL_TIMEOUT_SLACK,
+			sock_connect=VK_LONGPOLL_CONNECT_TIMEOUT
+		)
+
+		async with self._get_session().post(f"https://{server['server']}?act=a_check&key={server['key']}&ts={server['ts']}&wait={self.wait}&mode={self.mode}&version={self.version}", timeout=timeout) as response:
+			return cast(dict, decode_longpoll_response(await response.read()))
 
 	async def get_longpoll_server(self) -> dict:
 		"""
@@ -386,6 +529,38 @@ class VKAPILongpoll:
 
 		return await self.api.messages_getLongPollServer()
 
+	async def _connect(self) -> dict:
+		"""
+		Получает информацию о longpoll-сервере через `get_longpoll_server()`, учитывая ограничение на количество одновременных запросов среди нескольких longpoll'ов.
+		"""
+
+		async with self._connect_semaphore or nullcontext():
+			return await self.get_longpoll_server()
+
+	async def get_longpoll_history(self, ts: int, pts: int) -> AsyncGenerator[dict, None]:
+		"""
+		Генератор, выдающий события, произошедшие после указанных `ts` и `pts`, в формате ответа longpoll-сервера. API: `messages.getLongPollHistory`. Поле `more` указывает, остались ли ещё не полученные события.
+
+		События запрашиваются пачками, поэтому даже после долгого перерыва количество запросов к API остаётся небольшим.
+
+		:param ts: Значение `ts`, с которого нужно получить события.
+		:param pts: Значение `pts`, с которого нужно получить события.
+		"""
+
+		while True:
+			history = await self.api.messages_getLongPollHistory(ts, pts, lp_version=self.version)
+
+			pts = history.get("new_pts", pts)
+			more = bool(history.get("more"))
+
+			# События новых сообщений передаются в укороченном виде, а сами сообщения — в отдельном поле.
+			updates = _expand_history_updates(history.get("history", []), history.get("messages", {}).get("items", []))
+
+			yield {"ts": ts, "pts": pts, "updates": updates, "more": more}
+
+			if not more:
+				break
+
 	async def listen_for_raw_updates(self) -> AsyncGenerator[dict, None]:
 		"""
 		Генератор для прослушки raw-событий с longpoll-сервера.
@@ -400,28 +575,88 @@ class VKAPILongpoll:
 
 		retries = 0
 		server: dict | None = None
+		checkpoint = self.checkpoint
+
+		try:
+			while not self.is_stopped:
+				try:
+					if not server:
+						server = await self._connect()
+
+						# Продолжаем с сохранённой позиции, что бы не потерять события, произошедшие во время перезапуска бота.
+						if checkpoint:
+							server["ts"] = checkpoint[0]
+
+					longpoll_event = await self.get_longpoll_event(server)
+					retries = 0
+
+					failed = longpoll_event.get("failed")
+					if failed in (1, 3) and checkpoint and checkpoint[1] is not None:
+						# Сохранённая позиция устарела: longpoll-сервер больше не хранит события с этого ts.
+						# Получаем пропущенные события через messages.getLongPollHistory.
+						debug_lazy("[VK] Longpoll вернул failed {} для сохранённой позиции {}, получаю пропущенные события через getLongPollHistory", lambda: failed, lambda: checkpoint)
+
+						ts, pts = checkpoint
+						checkpoint = None
+
+						if failed == 1:
+							server["ts"] = longpoll_event["ts"]
+						else:
+							server = await self._connect()
+
+						async for history_event in self.get_longpoll_history(ts, cast(int, pts)):
+							# Новая позиция подтверждается лишь после получения последней пачки событий, поэтому
+							# до этого момента передаём старую позицию: если бот упадёт, то история будет получена заново.
+							if history_event["more"]:
+								yield {"ts": ts, "pts": pts, "updates": history_event["updates"]}
+							else:
+								yield {"ts": server["ts"], "pts": history_event["pts"], "updates": history_event["updates"]}
 
-		while not self.is_stopped:
-			try:
-				if not server:
-					server = await self.get_longpoll_server()
+						continue
 
-				longpoll_event = await self.get_longpoll_event(server)
+					if failed in (1, 3) and checkpoint:
+						logger.warning(f"[VK] Сохранённая позиция longpoll'а {checkpoint} устарела, а pts для получения пропущенных событий неизвестен. События, произошедшие во время перезапуска бота, будут пропущены")
 
-				if "ts" not in longpoll_event:
-					server = None
+					checkpoint = None
 
-					continue
+					if failed == 1:
+						# История событий устарела либо была частично утеряна, ВКонтакте вернул новый ts.
+						debug_lazy("[VK] Longpoll вернул failed 1, продолжаю с ts {}", lambda: longpoll_event.get('ts'))
 
-				server["ts"] = longpoll_event["ts"]
-				retries = 0
+						server["ts"] = longpoll_event["ts"]
 
-				yield longpoll_event
-			except (TimeoutError, ClientConnectionError):
-				retries += 1
-				server = None
+						continue
+					elif failed == 2:
+						# Истёк срок действия ключа: получаем новый ключ, продолжая с того же ts.
+						logger.debug("[VK] Longpoll вернул failed 2, обновляю key")
+
+						server["key"] = (await self._connect())["key"]
+
+						continue
+					elif failed or "ts" not in longpoll_event:
+						# failed 3: информация о пользователе утрачена, нужно получить новые key и ts.
+						debug_lazy("[VK] Longpoll вернул failed {}, переподключаюсь к longpoll-серверу", lambda: failed)
 
-				await asyncio.sleep(0.25 * retries)
+						server = None
+
+						continue
+
+					server["ts"] = longpoll_event["ts"]
+
+					yield longpoll_event
+				except (TimeoutError, ClientConnectionError):
+					retries += 1
+
+					# Ключ и ts всё ещё актуальны, поэтому при единичных ошибках соединения
+					# переподключаемся к тому же серверу, а не запрашиваем новый.
+					if retries >= VK_LONGPOLL_SERVER_REFRESH_RETRIES:
+						server = None
+
+					# Задержка немного случайна, что бы после сетевого сбоя longpoll'ы разных пользователей
+					# не переподключались одновременно.
+					await asyncio.sleep(min(0.25 * retries, VK_LONGPOLL_RETRY_DELAY_MAX) * random.uniform(0.5, 1))
+		finally:
+			await self.close()
 
 	async def listen_for_updates(self) -> AsyncGenerator[BaseVKLongpollEvent, None]:
 		"""
@@ -441,11 +676,247 @@ class VKAPILongpoll:
 					continue
 
 				for update in event["updates"]:
-					event = BaseVKLongpollEvent.get_event_type(update, raise_error=False)
+					update_event = BaseVKLongpollEvent.get_event_type(update, raise_error=False)
 
-					if not event:
-						logger.debug(f"[VK] Неизвестный тип события: {update[0]}: {update[1:]}")
+					if not update_event:
+						debug_lazy("[VK] Неизвестный тип события: {}: {}", lambda: update[0], lambda: update[1:])
 
 						continue
 
-					yield event
+					yield update_event
+
+				# Все события этого ответа были выданы, сообщаем о новой позиции.
+				if self.on_position:
+					self.on_position(event["ts"], event.get("pts"))
+
+_dispatchers: "weakref.WeakSet[LongpollEventDispatcher]" = weakref.WeakSet()
+
+class LongpollEventDispatcher:
+	"""
+	Распределяет longpoll-события по очередям, отдельным для каждого `peer_id`. События из разных чатов обрабатываются параллельно (не более `max_workers` одновременно), а события внутри одного чата — строго по порядку.
+
+	Если в очередях накопилось `max_pending` событий, то `dispatch()` ожидает освобождения места, тем самым замедляя получение новых событий с longpoll-сервера.
+	"""
+
+	max_workers: int
+	"""Максимальное количество одновременно обрабатываемых событий."""
+	max_pending: int
+	"""Максимальное количество событий в очередях, после которого `dispatch()` начинает ожидать освобождения места."""
+	pending: int
+	"""Количество событий в очередях (включая обрабатываемые)."""
+	processed: int
+	"""Количество обработанных событий."""
+	total_lag: float
+	"""Суммарное время (в секундах), которое события провели в очереди до начала их обработки."""
+	max_lag: float
+	"""Максимальное время (в секундах), которое событие провело в очереди до начала его обработки."""
+	acknowledged_position: tuple[int, int | None] | None
+	"""Последняя позиция longpoll'а (`ts` и `pts`), все события до которой были обработаны. См. `mark()`."""
+	on_acknowledge: Callable[[int, int | None], None] | None
+	"""Функция, вызываемая с `ts` и `pts` при обновлении `acknowledged_position`."""
+
+	_handler: Callable[[BaseVKLongpollEvent], Awaitable[None]]
+	_queues: dict[int, deque[tuple[BaseVKLongpollEvent, float, int]]]
+	_workers: dict[int, asyncio.Task]
+	_processing: dict[int, int]
+	_marks: deque[tuple[int, tuple[int, int | None]]]
+	_next_seq: int
+	_semaphore: asyncio.Semaphore
+	_has_space: asyncio.Event
+	_error: BaseException | None
+
+	def __init__(self, handler: Callable[[BaseVKLongpollEvent], Awaitable[None]], max_workers: int = VK_LONGPOLL_MAX_WORKERS, max_pending: int = VK_LONGPOLL_MAX_PENDING_EVENTS) -> None:
+		"""
+		Инициализирует dispatcher.
+
+		:param handler: Функция, обрабатывающая одно событие.
+		:param max_workers: Максимальное количество одновременно обрабатываемых событий.
+		:param max_pending: Максимальное количество событий в очередях.
+		"""
+
+		self.max_workers = max_workers
+		self.max_pending = max_pending
+		self.pending = 0
+		self.processed = 0
+		self.total_lag = 0.0
+		self.max_lag = 0.0
+
+		self._handler = handler
+		self._queues = {}
+		self._workers = {}
+		self._semaphore = asyncio.Semaphore(max_workers)
+		self._has_space = asyncio.Event()
+		self._has_space.set()
+		self._error = None
+		self._processing = {}
+		self._marks = deque()
+		self._next_seq = 0
+		self.acknowledged_position = None
+		self.on_acknowledge = None
+
+		_dispatchers.add(self)
+
+	@property
+	def average_lag(self) -> float:
+		"""
+		Среднее время (в секундах), которое события проводят в очереди до начала их обработки.
+		"""
+
+		return self.total_lag / self.processed if self.processed else 0.0
+
+	@property
+	def current_lag(self) -> float:
+		"""
+		Время (в секундах), которое самое старое необработанное событие провело в очереди.
+		"""
+
+		now = time.monotonic()
+
+		return max((now - queue[0][1] for queue in self._queues.values() if queue), default=0.0)
+
+	def _raise_error(self) -> None:
+		"""
+		Выбрасывает ошибку, произошедшую при обработке события, если она была.
+		"""
+
+		if self._error is not None:
+			error, self._error = self._error, None
+
+			raise error
+
+	async def dispatch(self, event: BaseVKLongpollEvent) -> None:
+		"""
+		Добавляет событие в очередь его чата.
+
+		Если при обработке одного из предыдущих событий произошла ошибка, то она будет выброшена здесь.
+
+		:param event: Событие, полученное с longpoll-сервера.
+		"""
+
+		self._raise_error()
+
+		while self.pending >= self.max_pending:
+			self._has_space.clear()
+			await self._has_space.wait()
+
+			self._raise_error()
+
+		peer_id = getattr(event, "peer_id", 0)
+
+		self._queues.setdefault(peer_id, deque()).append((event, time.monotonic(), self._next_seq))
+		self._next_seq += 1
+		self.pending += 1
+
+		worker = self._workers.get(peer_id)
+		if worker is None or worker.done():
+			self._workers[peer_id] = asyncio.create_task(self._process_peer(peer_id))
+
+	async def _process_peer(self, peer_id: int) -> None:
+		"""
+		По порядку обрабатывает события из очереди одного чата.
+
+		:param peer_id: ID чата.
+		"""
+
+		queue = self._queues[peer_id]
+
+		try:
+			while queue:
+				async with self._semaphore:
+					event, enqueued_at, seq = queue.popleft()
+					self._processing[peer_id] = seq
+
+					lag = time.monotonic() - enqueued_at
+					self.total_lag += lag
+					self.max_lag = max(self.max_lag, lag)
+
+					try:
+						await self._handler(event)
+					except Exception as error:
+						if self._error is None:
+							self._error = error
+					finally:
+						del self._processing[peer_id]
+
+						self.processed += 1
+						self.pending -= 1
+						self._has_space.set()
+
+						self._acknowledge()
+		finally:
+			if self._workers.get(peer_id) is asyncio.current_task():
+				del self._workers[peer_id]
+
+			if not queue and self._queues.get(peer_id) is queue:
+				del self._queues[peer_id]
+
+	def mark(self, ts: int, pts: int | None) -> None:
+		"""
+		Отмечает позицию longpoll'а, до которой были переданы все события. Позиция станет `acknowledged_position` после того, как все переданные до неё события будут обработаны.
+
+		:param ts: Значение `ts` longpoll'а.
+		:param pts: Значение `pts` longpoll'а.
+		"""
+
+		self._marks.append((self._next_seq, (ts, pts)))
+
+		self._acknowledge()
+
+	def _acknowledge(self) -> None:
+		"""
+		Обновляет `acknowledged_position`, если все события до одной из отмеченных позиций были обработаны.
+		"""
+
+		# Номер самого раннего необработанного события. Внутри очереди одного чата события упорядочены,
+		# поэтому достаточно проверить лишь первые события очередей и обрабатываемые события.
+		oldest = min(
+			[queue[0][2] for queue in self._queues.values() if queue] + list(self._processing.values()),
+			default=self._next_seq
+		)
+
+		position = None
+		while self._marks and self._marks[0][0] <= oldest:
+			position = self._marks.popleft()[1]
+
+		if position is None or position == self.acknowledged_position:
+			return
+
+		self.acknowledged_position = position
+
+		if self.on_acknowledge:
+			self.on_acknowledge(*position)
+
+	async def join(self) -> None:
+		"""
+		Ожидает обработки всех событий в очередях. Если при обработке произошла ошибка, то она будет выброшена.
+		"""
+
+		while self._workers:
+			await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+		self._raise_error()
+
+	def cancel(self) -> None:
+		"""
+		Отменяет обработку всех событий в очередях.
+		"""
+
+		# Счётчик событий, которые обрабатываются в данный момент, уменьшится при отмене их задач.
+		for queue in self._queues.values():
+			self.pending -= len(queue)
+			queue.clear()
+
+		for task in self._workers.values():
+			task.cancel()
+
+		# Отменённые задачи могут завершиться не сразу; новые события должны обрабатываться новыми задачами.
+		self._workers.clear()
+		self._queues.clear()
+		self._has_space.set()
+
+def get_dispatchers() -> list[LongpollEventDispatcher]:
+	"""
+	Возвращает список всех существующих dispatcher'ов longpoll-событий.
+	"""
+
+	return list(_dispatchers)
@@ -0,0 +1,228 @@
+# coding: utf-8
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import time
+from enum import IntEnum
+
+from pydantic import SecretStr
+
+from services.vk.consts import (VK_API_RATE_LIMIT, VK_API_RATE_LIMIT_DECREASE,
+                                VK_API_RATE_LIMIT_INCREASE,
+                                VK_API_RATE_LIMIT_MIN)
+
+
+class VKRequestPriority(IntEnum):
+	"""
+	Приоритет запроса к API ВКонтакте. Чем меньше значение, тем раньше запрос будет выполнен при заполненной очереди.
+	"""
+
+	HIGH = 0
+	"""Запросы, вызванные действиями пользователя: отправка, редактирование, удаление сообщений, загрузка вложений и прочее."""
+	NORMAL = 1
+	"""Прочтение сообщений."""
+	LOW = 2
+	"""Фоновые запросы: статус печати и онлайн."""
+
+METHOD_PRIORITIES: dict[str, VKRequestPriority] = {
+	"messages.markAsRead": VKRequestPriority.NORMAL,
+	"messages.setActivity": VKRequestPriority.LOW,
+	"account.setOnline": VKRequestPriority.LOW
+}
+"""Приоритеты методов API ВКонтакте. Методы, которых здесь нет, имеют приоритет `VKRequestPriority.HIGH`."""
+
+class VKRequestScheduler:
+	"""
+	Планировщик запросов к API ВКонтакте для одного токена, работающий по принципу token bucket.
+
+	Запросы, которым не хватило места, ожидают в очереди с приоритетами. Скорость выдачи мест подстраивается под ответы ВКонтакте: она уменьшается в `VK_API_RATE_LIMIT_DECREASE` раз при получении ошибки 6 (слишком много запросов) и постепенно увеличивается обратно после успешных запросов.
+	"""
+
+	rate: float
+	"""Текущая скорость (запросов в секунду)."""
+	min_rate: float
+	"""Минимальная скорость (запросов в секунду)."""
+	max_rate: float
+	"""Максимальная скорость (запросов в секунду), а так же размер bucket'а."""
+	tokens: float
+	"""Количество свободных мест в bucket'е."""
+	requests: int
+	"""Количество запросов, получивших место."""
+	rate_limited: int
+	"""Количество полученных ошибок 6 (слишком много запросов)."""
+	total_wait: float
+	"""Суммарное время ожидания места в очереди всеми запросами, в секундах."""
+	max_wait: float
+	"""Максимальное время ожидания места в очереди, в секундах."""
+
+	_waiters: list[tuple[int, int, asyncio.Future]]
+	_counter: itertools.count
+	_dispatcher: asyncio.Task | None
+	_last_refill: float
+
+	def __init__(self, rate: float = VK_API_RATE_LIMIT, min_rate: float = VK_API_RATE_LIMIT_MIN) -> None:
+		"""
+		Инициализирует планировщик.
+
+		:param rate: Максимальная (и начальная) скорость, запросов в секунду.
+		:param min_rate: Минимальная скорость, до которой может опуститься планировщик при получении ошибок 6.
+		"""
+
+		self.rate = self.max_rate = rate
+		self.min_rate = min_rate
+		self.tokens = rate
+		self.requests = 0
+		self.rate_limited = 0
+		self.total_wait = 0.0
+		self.max_wait = 0.0
+
+		self._waiters = []
+		self._counter = itertools.count()
+		self._dispatcher = None
+		self._last_refill = time.monotonic()
+
+	@property
+	def queue_depth(self) -> int:
+		"""
+		Количество запросов, ожидающих места в очереди.
+		"""
+
+		return sum(1 for _, _, future in self._waiters if not future.done())
+
+	@property
+	def average_wait(self) -> float:
+		"""
+		Среднее время ожидания места в очереди, в секундах.
+		"""
+
+		return self.total_wait / self.requests if self.requests else 0.0
+
+	def _refill(self) -> None:
+		"""
+		Пополняет bucket в соответствии с прошедшим временем.
+		"""
+
+		now = time.monotonic()
+
+		self.tokens = min(self.max_rate, self.tokens + (now - self._last_refill) * self.rate)
+		self._last_refill = now
+
+	def _record_wait(self, wait_time: float) -> None:
+		"""
+		Сохраняет статистику времени ожидания.
+
+		:param wait_time: Время ожидания в секундах.
+		"""
+
+		self.requests += 1
+		self.total_wait += wait_time
+		self.max_wait = max(self.max_wait, wait_time)
+
+	async def _dispatch(self) -> None:
+		"""
+		Выдаёт места ожидающим запросам по мере пополнения bucket'а, в порядке приоритета.
+		"""
+
+		while self._waiters:
+			self._refill()
+
+			if self.tokens < 1:
+				await asyncio.sleep((1 - self.tokens) / self.rate)
+
+				continue
+
+			_, _, future = heapq.heappop(self._waiters)
+			if future.done():
+				continue
+
+			self.tokens -= 1
+			future.set_result(None)
+
+	async def acquire(self, priority: VKRequestPriority = VKRequestPriority.HIGH) -> float:
+		"""
+		Ожидает места для выполнения запроса. Возвращает время ожидания в секундах.
+
+		:param priority: Приоритет запроса.
+		"""
+
+		start = time.monotonic()
+
+		self._refill()
+		if not self._waiters and self.tokens >= 1:
+			self.tokens -= 1
+			self._record_wait(0.0)
+
+			return 0.0
+
+		future = asyncio.get_running_loop().create_future()
+		heapq.heappush(self._waiters, (priority, next(self._counter), future))
+
+		if self._dispatcher is None or self._dispatcher.done():
+			self._dispatcher = asyncio.create_task(self._dispatch())
+
+		await future
+
+		wait_time = time.monotonic() - start
+		self._record_wait(wait_time)
+
+		return wait_time
+
+	def on_success(self) -> None:
+		"""
+		Вызывается после успешного запроса. Постепенно увеличивает скорость до максимальной.
+		"""
+
+		self.rate = min(self.max_rate, self.rate + VK_API_RATE_LIMIT_INCREASE)
+
+	def on_rate_limited(self) -> None:
+		"""
+		Вызывается при получении ошибки 6 (слишком много запросов). Уменьшает скорость и опустошает bucket.
+		"""
+
+		self.rate_limited += 1
+		self.rate = max(self.min_rate, self.rate * VK_API_RATE_LIMIT_DECREASE)
+		self.tokens = min(self.tokens, 0.0)
+
+_schedulers: dict[str, VKRequestScheduler] = {}
+
+def _get_scheduler_key(token: SecretStr) -> str:
+	"""
+	Возвращает ключ планировщика для токена. В качестве ключа используется хэш токена, чтобы сам токен не хранился в памяти дольше, чем объект `VKAPI`.
+
+	:param token: Токен ВКонтакте.
+	"""
+
+	return hashlib.sha256(token.get_secret_value().encode()).hexdigest()
+
+def get_scheduler(token: SecretStr) -> VKRequestScheduler:
+	"""
+	Возвращает планировщик запросов для токена. Все объекты `VKAPI` с одним и тем же токеном используют общий планировщик.
+
+	:param token: Токен ВКонтакте.
+	"""
+
+	key = _get_scheduler_key(token)
+
+	scheduler = _schedulers.get(key)
+	if scheduler is None:
+		scheduler = _schedulers[key] = VKRequestScheduler()
+
+	return scheduler
+
+def remove_scheduler(token: SecretStr) -> None:
+	"""
+	Удаляет планировщик запросов для токена. Вызывается при отключении сервиса, после чего токен больше не используется.
+
+	:param token: Токен ВКонтакте.
+	"""
+
+	_schedulers.pop(_get_scheduler_key(token), None)
+
+def get_schedulers() -> list[VKRequestScheduler]:
+	"""
+	Возвращает список всех созданных планировщиков запросов.
+	"""
+
+	return list(_schedulers.values())
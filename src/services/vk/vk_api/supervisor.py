@@ -0,0 +1,260 @@
+# coding: utf-8
+
+import asyncio
+import random
+import time
+from enum import Enum
+from typing import Awaitable, Callable
+
+import aiohttp
+
+from logger import debug_lazy
+from services.vk.consts import (VK_API_DNS_CACHE_TTL,
+                                VK_LONGPOLL_CONNECTIONS_LIMIT,
+                                VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT,
+                                VK_LONGPOLL_MAX_CONNECTING,
+                                VK_LONGPOLL_RESTART_BACKOFF,
+                                VK_LONGPOLL_RESTART_BACKOFF_MAX,
+                                VK_LONGPOLL_START_INTERVAL,
+                                VK_LONGPOLL_TIMEOUT_SLACK)
+from services.vk.vk_api.api import VKAPI
+from services.vk.vk_api.longpoll import VKAPILongpoll
+
+
+class LongpollState(Enum):
+	"""
+	Состояние longpoll'а, которым управляет `LongpollSupervisor`.
+	"""
+
+	STARTING = "starting"
+	"""Longpoll ожидает своей очереди на запуск либо подключается к longpoll-серверу."""
+	RUNNING = "running"
+	"""Longpoll получает события с longpoll-сервера."""
+	BACKING_OFF = "backing_off"
+	"""Longpoll упал с ошибкой и ожидает перезапуска."""
+	FAILED = "failed"
+	"""Longpoll превысил порог глобальных ошибок и больше не будет перезапущен."""
+
+class SupervisedLongpoll:
+	"""
+	Информация о longpoll'е одного пользователя ВКонтакте, которым управляет `LongpollSupervisor`.
+	"""
+
+	owner_id: int
+	"""ID пользователя ВКонтакте, которому принадлежит longpoll."""
+	state: LongpollState
+	"""Текущее состояние longpoll'а."""
+	errors: int
+	"""Количество глобальных ошибок. При достижении `max_errors` у `LongpollSupervisor` longpoll больше не перезапускается."""
+	restarts: int
+	"""Количество перезапусков longpoll'а после ошибок."""
+	task: asyncio.Task | None
+	"""Задача, выполняющая longpoll."""
+
+	def __init__(self, owner_id: int) -> None:
+		self.owner_id = owner_id
+		self.state = LongpollState.STARTING
+		self.errors = 0
+		self.restarts = 0
+		self.task = None
+
+class LongpollSupervisor:
+	"""
+	Управляет longpoll'ами всех пользователей ВКонтакте.
+
+	Все longpoll'ы используют общую aiohttp-сессию, запускаются не чаще, чем раз в `start_interval` секунд, и одновременно запрашивают longpoll-сервер не более чем `max_connecting` штук. После глобальной ошибки longpoll перезапускается со случайной экспоненциально растущей задержкой, что бы после сетевого сбоя longpoll'ы всех пользователей не переподключались к ВКонтакте одновременно.
+	"""
+
+	start_interval: float
+	"""Минимальный интервал (в секундах) между запусками longpoll'ов."""
+	max_errors: int
+	"""Количество глобальных ошибок, после которого longpoll больше не перезапускается."""
+	backoff: float
+	"""Начальная задержка (в секундах) перед перезапуском longpoll'а после ошибки."""
+	backoff_max: float
+	"""Максимальная задержка (в секундах) перед перезапуском longpoll'а после ошибки."""
+
+	_longpolls: dict[int, SupervisedLongpoll]
+	_connect_semaphore: asyncio.Semaphore
+	_next_start_at: float
+	_session: aiohttp.ClientSession | None
+	_session_loop: asyncio.AbstractEventLoop | None
+
+	def __init__(self, start_interval: float = VK_LONGPOLL_START_INTERVAL, max_connecting: int = VK_LONGPOLL_MAX_CONNECTING, max_errors: int = VK_LONGPOLL_GLOBAL_ERRORS_AMOUNT, backoff: float = VK_LONGPOLL_RESTART_BACKOFF, backoff_max: float = VK_LONGPOLL_RESTART_BACKOFF_MAX) -> None:
+		"""
+		Инициализирует supervisor.
+
+		:param start_interval: Минимальный интервал (в секундах) между запусками longpoll'ов.
+		:param max_connecting: Максимальное количество longpoll'ов, одновременно запрашивающих longpoll-сервер.
+		:param max_errors: Количество глобальных ошибок, после которого longpoll больше не перезапускается.
+		:param backoff: Начальная задержка (в секундах) перед перезапуском longpoll'а после ошибки.
+		:param backoff_max: Максимальная задержка (в секундах) перед перезапуском longpoll'а после ошибки.
+		"""
+
+		self.start_interval = start_interval
+		self.max_errors = max_errors
+		self.backoff = backoff
+		self.backoff_max = backoff_max
+
+		self._longpolls = {}
+		self._connect_semaphore = asyncio.Semaphore(max_connecting)
+		self._next_start_at = 0.0
+		self._session = None
+		self._session_loop = None
+
+	def get_session(self) -> aiohttp.ClientSession:
+		"""
+		Возвращает общую для всех longpoll'ов aiohttp-сессию. Сессия пересоздаётся, если она была закрыта или если она была создана в другом event loop'е.
+		"""
+
+		loop = asyncio.get_running_loop()
+		if self._session is None or self._session.closed or self._session_loop is not loop:
+			self._session = aiohttp.ClientSession(
+				connector=aiohttp.TCPConnector(
+					limit=VK_LONGPOLL_CONNECTIONS_LIMIT,
+					limit_per_host=0,
+					ttl_dns_cache=VK_API_DNS_CACHE_TTL,
+					keepalive_timeout=VK_LONGPOLL_TIMEOUT_SLACK
+				)
+			)
+			self._session_loop = loop
+
+		return self._session
+
+	async def close(self) -> None:
+		"""
+		Закрывает общую aiohttp-сессию. Вызывается при остановке бота.
+		"""
+
+		if self._session is not None and not self._session.closed:
+			await self._session.close()
+
+		self._session = None
+		self._session_loop = None
+
+	def create_longpoll(self, api: VKAPI, longpoll: SupervisedLongpoll, checkpoint: tuple[int, int | None] | None = None, on_position: Callable[[int, int | None], None] | None = None) -> VKAPILongpoll:
+		"""
+		Создаёт `VKAPILongpoll`, использующий общую сессию и общее ограничение на одновременные подключения к longpoll-серверам.
+
+		:param api: Объект API ВКонтакте пользователя.
+		:param longpoll: Информация о longpoll'е, полученная в `run` из `start()`.
+		:param checkpoint: Сохранённая позиция longpoll'а.
+		:param on_position: Функция, вызываемая с `ts` и `pts` после выдачи всех событий очередного ответа longpoll-сервера.
+		"""
+
+		def _on_position(ts: int, pts: int | None) -> None:
+			longpoll.state = LongpollState.RUNNING
+
+			if on_position:
+				on_position(ts, pts)
+
+		return VKAPILongpoll(
+			api,
+			checkpoint=checkpoint,
+			on_position=_on_position,
+			session=self.get_session(),
+			connect_semaphore=self._connect_semaphore
+		)
+
+	def start(self, owner_id: int, run: Callable[[SupervisedLongpoll], Awaitable[None]], on_error: Callable[[Exception, SupervisedLongpoll], Awaitable[bool]]) -> asyncio.Task:
+		"""
+		Запускает longpoll пользователя, возвращая задачу, которая его выполняет.
+
+		:param owner_id: ID пользователя ВКонтакте.
+		:param run: Функция, выполняющая longpoll до его остановки. Вызывается повторно при перезапуске после ошибки.
+		:param on_error: Функция, вызываемая после глобальной ошибки в `run`. К моменту её вызова счётчик ошибок уже увеличен, а состояние longpoll'а выставлено в `FAILED`, если порог ошибок был превышен. Если функция возвращает `False`, то longpoll не будет перезапущен.
+		"""
+
+		longpoll = SupervisedLongpoll(owner_id)
+
+		previous = self._longpolls.get(owner_id)
+		if previous and previous.task and not previous.task.done():
+			previous.task.cancel()
+
+		self._longpolls[owner_id] = longpoll
+		longpoll.task = asyncio.create_task(self._supervise(longpoll, run, on_error))
+
+		return longpoll.task
+
+	async def _wait_for_start_slot(self) -> None:
+		"""
+		Ожидает своей очереди на запуск, что бы longpoll'ы запускались не чаще, чем раз в `start_interval` секунд.
+		"""
+
+		now = time.monotonic()
+		start_at = max(now, self._next_start_at)
+		self._next_start_at = start_at + self.start_interval
+
+		await asyncio.sleep(start_at - now)
+
+	def get_restart_delay(self, errors: int) -> float:
+		"""
+		Возвращает случайную задержку (в секундах) перед перезапуском longpoll'а после `errors` ошибок.
+
+		:param errors: Количество глобальных ошибок longpoll'а.
+		"""
+
+		return random.uniform(0, min(self.backoff * 2 ** (errors - 1), self.backoff_max))
+
+	async def _supervise(self, longpoll: SupervisedLongpoll, run: Callable[[SupervisedLongpoll], Awaitable[None]], on_error: Callable[[Exception, SupervisedLongpoll], Awaitable[bool]]) -> None:
+		"""
+		Выполняет longpoll, перезапуская его после ошибок.
+		"""
+
+		try:
+			while True:
+				longpoll.state = LongpollState.STARTING
+				await self._wait_for_start_slot()
+
+				try:
+					await run(longpoll)
+
+					break
+				except Exception as error:
+					longpoll.errors += 1
+					longpoll.state = LongpollState.FAILED if longpoll.errors >= self.max_errors else LongpollState.BACKING_OFF
+
+					if not await on_error(error, longpoll) or longpoll.state is LongpollState.FAILED:
+						break
+
+				delay = self.get_restart_delay(longpoll.errors)
+				debug_lazy("[VK] Перезапускаю longpoll пользователя {} через {:.1f}с после ошибки #{}", lambda: longpoll.owner_id, lambda: delay, lambda: longpoll.errors)
+
+				await asyncio.sleep(delay)
+				longpoll.restarts += 1
+		finally:
+			# Упавшие longpoll'ы остаются в списке, что бы они отображались в `/status`.
+			if longpoll.state is not LongpollState.FAILED and self._longpolls.get(longpoll.owner_id) is longpoll:
+				del self._longpolls[longpoll.owner_id]
+
+	def get_longpolls(self) -> list[SupervisedLongpoll]:
+		"""
+		Возвращает список всех longpoll'ов, которыми управляет supervisor.
+		"""
+
+		return list(self._longpolls.values())
+
+	def get_state_counts(self) -> dict[LongpollState, int]:
+		"""
+		Возвращает количество longpoll'ов в каждом из состояний.
+		"""
+
+		counts = {state: 0 for state in LongpollState}
+		for longpoll in self._longpolls.values():
+			counts[longpoll.state] += 1
+
+		return counts
+
+_supervisor: LongpollSupervisor | None = None
+
+def get_supervisor() -> LongpollSupervisor:
+	"""
+	Возвращает общий для всех пользователей `LongpollSupervisor`.
+	"""
+
+	global _supervisor
+
+	if _supervisor is None:
+		_supervisor = LongpollSupervisor()
+
+	return _supervisor
@@ -42,7 +42,8 @@ SETTINGS_TREE = {
                 "Определяет, может ли Telehooper хранить ID отправленных и/ли полученных медиа с типами, описанными ниже, с целью кэширования, уменьшения нагрузки и ускорения работы бота.\n"
 				"Кэшируемые типы медиа:\n"
 				" • Стикеры,\n"
-				" • GIF-изображения.\n"
+				" • GIF-изображения,\n"
+				" • Фотографии, видео, документы и аудио из ВКонтакте (хранятся лишь в памяти бота, не дольше суток).\n"
                 "\n"
 				"О безопасности: Даже при взломе базы данных бота получить доступ к медиа невозможно. При получении нового медиа, например, стикера, бот отправляет медиа как сообщение в Telegram, после чего у бота появляется несколько технических полей: <code>FileID</code> (Telegram) и <code>attachment</code> (ВКонтакте). Бот сохраняет в БД SHA-256 хэш FileID как ключ, и использует зашифрованный attachment, используя FileID как ключ шифрования."
 			),
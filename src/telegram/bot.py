@@ -5,6 +5,7 @@ import importlib
 import os
 import pkgutil
 import re
+import time
 from types import ModuleType
 
 from aiocouch import Document
@@ -22,7 +23,8 @@ import utils
 from api import TelehooperAPI, TelehooperSubGroup, TelehooperUser
 from config import config
 from consts import COMMANDS, COMMANDS_USERS_GROUPS
-from DB import get_attachment_cache, get_db
+from DB import create_message_mapping_view, get_db
+from DB import get_user as db_get_user
 from services.vk.service import VKServiceAPI
 
 
@@ -41,6 +43,7 @@ dispatcher = Dispatcher()
 username: str | None
 
 minibots: dict[str, Bot] = {}
+_message_mapping_init_task: asyncio.Task | None = None
 
 def get_bot() -> Bot:
 	"""
@@ -158,6 +161,8 @@ async def reconnect_services() -> None:
 
 			return
 
+		# Передаём уже загруженный документ пользователя в кэш документов, что бы все дальнейшие изменения документа проходили через кэш.
+		user = await db_get_user(telegram_user, document=user)
 		telehooper_user = TelehooperUser(user, telegram_user)
 		service_apis = {}
 
@@ -254,12 +259,56 @@ async def connect_minibots(session: BaseSession) -> dict[str, Bot]:
 async def load_cached_attachments() -> None:
 	"""
 	Загружает кэшированные вложения из БД.
+
+	Старые записи кэша вложений (`global_attchcache_*`, где все вложения сервиса хранились в одном документе) переносятся в отдельные документы для каждого вложения, после чего удаляются.
 	"""
 
 	db = await get_db()
+	start_time = time.perf_counter()
+	attachments: dict[str, dict[str, str]] = {}
+
+	async for doc in db.docs(prefix="attch_"):
+		attachments.setdefault(doc["Service"], {})[doc["Key"]] = doc["Value"]
+
+	for service_name, service_attachments in attachments.items():
+		logger.debug(f"Кэшированных вложений для сервиса {service_name}: {len(service_attachments)}")
+
+		TelehooperAPI.load_attachments(service_name, service_attachments)
+
+	total = sum(len(i) for i in attachments.values())
+	logger.info(f"Загружено {total} кэшированных вложений за {time.perf_counter() - start_time:.3f} сек.")
 
+	# Переносим старые записи кэша вложений.
 	async for doc in db.docs(prefix="global_attchcache_"):
-		logger.debug(f"Кэшированных вложений для сервиса {doc['Service']}: {len(doc['Attachments'])}")
+		logger.info(f"Переношу {len(doc['Attachments'])} кэшированных вложений сервиса {doc['Service']} из старой записи кэша вложений...")
 
 		for key, value in doc["Attachments"].items():
-			await TelehooperAPI.save_attachment(doc["Service"], key, value, encrypt=False, save_in_db=False)
+			await TelehooperAPI.save_attachment(doc["Service"], key, value, encrypt=False, save_in_db=True)
+
+		if not await TelehooperAPI.flush_attachments():
+			logger.warning(f"Не удалось перенести кэш вложений сервиса {doc['Service']}, старая запись не будет удалена.")
+
+			continue
+
+		await doc.delete()
+
+async def init_saved_messages(use_async: bool = True) -> None:
+	"""
+	Подготавливает БД для работы с сохранёнными связями ID сообщений. Сами связи не загружаются при запуске: они подгружаются из БД в кэш по мере обращения к ним.
+
+	:param use_async: Асинхронная подготовка, не блокирующая запуск бота.
+	"""
+
+	async def _init() -> None:
+		try:
+			await create_message_mapping_view()
+		except Exception as error:
+			logger.warning(f"Не удалось создать view для связей ID сообщений в БД: {error}")
+
+	global _message_mapping_init_task
+
+	if use_async:
+		# Храним ссылку на задачу, чтобы она не была удалена сборщиком мусора до завершения.
+		_message_mapping_init_task = asyncio.create_task(_init())
+	else:
+		await _init()
@@ -15,7 +15,8 @@ from loguru import logger
 
 import utils
 from api import TelehooperAPI
-from DB import get_db, get_default_group, get_group
+from DB import (CachedDocument, get_db, get_default_group, get_document,
+                get_group, invalidate_document)
 from telegram.bot import get_minibots
 from telegram.handlers.this import group_convert_message
 
@@ -129,13 +130,15 @@ async def on_telehooper_added_in_chat_handler(event: ChatMemberUpdated, bot: Bot
 		admin_rights=False # TODO: Проверка на наличие прав администратора?
 	)
 
-	# Небольшой костыль на случай, если группа уже сохранена в БД бота.
-	group_db = await db.create(
-		f"group_{event.chat.id}",
-		exists_ok=True,
-		data=data
-	)
-	group_db.update(data=data)
+	# Группа может быть уже сохранена в БД бота. Копия группы в кэше документов могла устареть
+	# (например, после удаления данных группы), поэтому документ загружается из БД заново,
+	# а создаётся и обновляется через кэш документов.
+	invalidate_document(f"group_{event.chat.id}")
+	group_db = await get_document(f"group_{event.chat.id}")
+	if group_db is None:
+		group_db = CachedDocument(db, f"group_{event.chat.id}", data=data)
+	else:
+		group_db.update(data)
 
 	await group_db.save()
 
@@ -433,10 +436,7 @@ async def group_to_supergroup_convert_handler(message: Message, bot: Bot):
 
 		# Сохраняем изменения у владельца группы.
 		await group_owner.save()
+		invalidate_document(group_owner.id)
 
 	# Фиксим все subgroup'ы, что бы в них был новый ID.
-	for subgroup in TelehooperAPI.get_all_subgroups():
-		if subgroup.parent.chat.id != old_chat_id:
-			continue
-
-		subgroup.parent.chat = new_chat
+	TelehooperAPI.change_subgroups_chat(old_chat_id, new_chat)
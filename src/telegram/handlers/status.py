@@ -6,7 +6,14 @@ from aiogram.types import Message
 
 import api
 import utils
-from consts import GITHUB_SOURCES_URL
+from consts import GITHUB_SOURCES_URL, QUEUE_WAIT_HISTOGRAM_BUCKETS
+from services.vk.media import (get_attachments_prepare_stats,
+                               get_file_cache, get_media_spool)
+from services.vk.vk_api.longpoll import get_dispatchers as get_vk_dispatchers
+from services.vk.vk_api.scheduler import get_schedulers as get_vk_schedulers
+from services.vk.vk_api.supervisor import LongpollState
+from services.vk.vk_api.supervisor import \
+    get_supervisor as get_vk_longpoll_supervisor
 from telegram.bot import get_minibots
 
 
@@ -19,9 +26,24 @@ async def get_bot_status_fields() -> str:
 	if commit_hash_url:
 		commit_hash_url = f"<a href=\"{GITHUB_SOURCES_URL}/commit/{commit_hash_url}\">{commit_hash_url}</a>"
 
-	mids_sum = 0
-	for mid_objects in api._cached_message_ids.values():
-		mids_sum += len(mid_objects)
+	wait_histogram = api.TelehooperAPI.get_queue_wait_histogram()
+	wait_histogram_str = ", ".join(
+		[f"≤{bucket}с: {count}" for bucket, count in zip(QUEUE_WAIT_HISTOGRAM_BUCKETS, wait_histogram)] + [f">{QUEUE_WAIT_HISTOGRAM_BUCKETS[-1]}с: {wait_histogram[-1]}"]
+	)
+
+	vk_schedulers = get_vk_schedulers()
+	vk_requests = sum(scheduler.requests for scheduler in vk_schedulers)
+	vk_average_wait = sum(scheduler.total_wait for scheduler in vk_schedulers) / vk_requests if vk_requests else 0.0
+
+	vk_dispatchers = get_vk_dispatchers()
+	vk_processed_events = sum(dispatcher.processed for dispatcher in vk_dispatchers)
+	vk_average_lag = sum(dispatcher.total_lag for dispatcher in vk_dispatchers) / vk_processed_events if vk_processed_events else 0.0
+
+	vk_longpoll_states = get_vk_longpoll_supervisor().get_state_counts()
+
+	vk_prepare_stats = get_attachments_prepare_stats()
+	vk_file_cache = get_file_cache()
+	vk_media_spool = get_media_spool()
 
 	return (
 		f" • <b>Uptime</b>: {utils.seconds_to_userfriendly_string(utils.time_since(api._start_timestamp))}.\n"
@@ -31,8 +53,16 @@ async def get_bot_status_fields() -> str:
 		f" • <b>Миниботов подключено</b>: {len(get_minibots())} шт.\n"
 		f" • <b>Объектов ServiceAPI</b>: {len(api._saved_connections)} шт.\n"
 		f" • <b>Объектов TelehooperSubGroup</b>: {len(api._service_dialogues)} шт.\n"
-		f" • <b>Кэшированные MIDs</b>: {mids_sum} шт., (при {len(api._cached_message_ids)} объектах)\n"
-		f" • <b>Кэшированные вложения</b>: {len(api._cached_attachments)} шт."
+		f" • <b>Кэшированные MIDs</b>: {len(api._cached_message_ids)} шт., (при {api._cached_message_ids.owners_count()} объектах, ~{round(api._cached_message_ids.size_bytes / 1_000_000, 1)} МБ)\n"
+		f" • <b>Вытеснено MIDs из кэша</b>: {api._cached_message_ids.evicted} шт.\n"
+		f" • <b>Кэшированные вложения</b>: {len(api._cached_attachments)} шт.\n"
+		f" • <b>Ожидание очереди отправки в Telegram</b>: {wait_histogram_str}.\n"
+		f" • <b>Очередь запросов к API ВК</b>: {sum(scheduler.queue_depth for scheduler in vk_schedulers)} в очереди, {vk_requests} всего, среднее ожидание {vk_average_wait:.2f}с, максимальное {max((scheduler.max_wait for scheduler in vk_schedulers), default=0.0):.2f}с, ошибок 6: {sum(scheduler.rate_limited for scheduler in vk_schedulers)}.\n"
+		f" • <b>Очередь событий VK longpoll</b>: {sum(dispatcher.pending for dispatcher in vk_dispatchers)} в очереди, задержка сейчас {max((dispatcher.current_lag for dispatcher in vk_dispatchers), default=0.0):.2f}с, средняя {vk_average_lag:.2f}с, максимальная {max((dispatcher.max_lag for dispatcher in vk_dispatchers), default=0.0):.2f}с.\n"
+		f" • <b>VK longpoll'ы</b>: {vk_longpoll_states[LongpollState.RUNNING]} работают, {vk_longpoll_states[LongpollState.STARTING]} запускаются, {vk_longpoll_states[LongpollState.BACKING_OFF]} ожидают перезапуска, {vk_longpoll_states[LongpollState.FAILED]} упали.\n"
+		f" • <b>Подготовка вложений ВК</b>: {vk_prepare_stats.count} сообщений, среднее время {vk_prepare_stats.average:.2f}с, максимальное {vk_prepare_stats.max:.2f}с.\n"
+		f" • <b>Кэш file_id вложений ВК</b>: {len(vk_file_cache)} шт., попаданий {vk_file_cache.hits} из {vk_file_cache.hits + vk_file_cache.misses} ({round(vk_file_cache.hit_rate * 100)}%).\n"
+		f" • <b>Спул вложений ВК</b>: {len(vk_media_spool)} файлов, {round(vk_media_spool.size / 1_000_000, 1)} из {round(vk_media_spool.max_size / 1_000_000)} МБ, вытеснено {vk_media_spool.evicted} шт."
 	)
 
 router = Router()
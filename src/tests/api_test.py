@@ -0,0 +1,291 @@
+# coding: utf-8
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from aiocouch import Document
+
+from api import (TelehooperAPI, TelehooperMessage, TelehooperMessageStorage,
+                 TelehooperSubGroupRegistry)
+from DB import cache_document, find_message_mapping, invalidate_document
+
+
+def test_messageStorageIndexes():
+	"""
+	`TelehooperMessageStorage` находит сообщения по ID в Telegram, ID в сервисе и ID беседы.
+	"""
+
+	storage = TelehooperMessageStorage()
+	msg = TelehooperMessage("VK", [10, 11], [100, 101], [5, 6])
+	storage.add(1, msg)
+
+	assert storage.get_by_telegram_id("VK", 1, 11) is msg
+	assert storage.get_by_service_id("VK", 1, 100) is msg
+	assert storage.get_by_service_conversation_id("VK", 1, 6) is msg
+	assert storage.get_by_telegram_id("VK", 2, 11) is None
+	assert storage.get_by_telegram_id("Discord", 1, 11) is None
+	assert len(storage) == 1
+	assert storage.owners_count() == 1
+
+def test_messageStorageRemove():
+	"""
+	`TelehooperMessageStorage.remove()` удаляет сообщение из всех индексов.
+	"""
+
+	storage = TelehooperMessageStorage()
+	old = TelehooperMessage("VK", 10, 100)
+	new = TelehooperMessage("VK", 10, 200)
+	storage.add(1, old)
+	storage.add(1, new)
+
+	# Более старое сообщение не должно удалить индекс более нового сообщения.
+	storage.remove(1, old)
+	assert storage.get_by_telegram_id("VK", 1, 10) is new
+	assert storage.get_by_service_id("VK", 1, 100) is None
+
+	storage.remove(1, new)
+	assert storage.get_by_telegram_id("VK", 1, 10) is None
+	assert len(storage) == 0
+	assert storage.owners_count() == 0
+
+	# Повторное удаление ничего не делает.
+	storage.remove(1, new)
+
+def test_messageStorageEviction():
+	"""
+	`TelehooperMessageStorage` удаляет давно не использованные сообщения при превышении лимитов.
+	"""
+
+	storage = TelehooperMessageStorage(max_per_owner=2, max_total=3)
+	first = TelehooperMessage("VK", 1, 1)
+	second = TelehooperMessage("VK", 2, 2)
+	storage.add(1, first)
+	storage.add(1, second)
+
+	# Обращение к сообщению помечает его как недавно использованное.
+	assert storage.get_by_telegram_id("VK", 1, 1) is first
+	storage.add(1, TelehooperMessage("VK", 3, 3))
+	assert storage.get_by_telegram_id("VK", 1, 2) is None
+	assert storage.get_by_telegram_id("VK", 1, 1) is first
+	assert storage.evicted == 1
+
+	# Глобальный лимит.
+	storage.add(2, TelehooperMessage("VK", 4, 4))
+	storage.add(2, TelehooperMessage("VK", 5, 5))
+	assert len(storage) == 3
+	assert storage.evicted == 2
+	assert storage.get_by_telegram_id("VK", 1, 3) is None
+	assert storage.size_bytes > 0
+
+	for owner_id, mid in [(1, 1), (1, 3), (2, 4), (2, 5)]:
+		msg = storage.get_by_telegram_id("VK", owner_id, mid)
+		if msg:
+			storage.remove(owner_id, msg)
+
+	assert len(storage) == 0
+	assert storage.size_bytes == 0
+
+def test_attachmentCache():
+	"""
+	`TelehooperAPI` сохраняет, возвращает и удаляет вложения из кэша.
+	"""
+
+	async def _test():
+		await TelehooperAPI.save_attachment("Test", "sticker123", "file_id", save_in_db=False)
+
+		assert await TelehooperAPI.get_attachment("Test", "sticker123") == "file_id"
+		assert await TelehooperAPI.get_attachment("Test", "sticker456") is None
+		assert await TelehooperAPI.get_attachment("Other", "sticker123") is None
+
+		# Повторное сохранение не перезаписывает значение.
+		await TelehooperAPI.save_attachment("Test", "sticker123", "other_file_id", save_in_db=False)
+		assert await TelehooperAPI.get_attachment("Test", "sticker123") == "file_id"
+
+		await TelehooperAPI.delete_attachment("Test", "sticker123")
+		assert await TelehooperAPI.get_attachment("Test", "sticker123") is None
+
+	asyncio.run(_test())
+
+def test_subgroupRegistry():
+	"""
+	`TelehooperSubGroupRegistry` находит сервис-диалоги по диалогу сервиса и по группе Telegram.
+	"""
+
+	def _subgroup(chat_id: int, topic_id: int, service_chat_id: int):
+		return SimpleNamespace(
+			id=topic_id,
+			service_chat_id=service_chat_id,
+			service=SimpleNamespace(service_name="VK"),
+			parent=SimpleNamespace(creatorID=1, chat=SimpleNamespace(id=chat_id))
+		)
+
+	registry = TelehooperSubGroupRegistry()
+	first = _subgroup(-100, 0, 2000000001)
+	second = _subgroup(-200, 5, 123)
+	registry.add(first) # type: ignore
+	registry.add(second) # type: ignore
+
+	assert registry.get_by_service_dialogue(1, "VK", 123) is second
+	assert registry.get_by_service_dialogue(2, "VK", 123) is None
+	assert registry.get_by_chat(-100) is first
+	assert registry.get_by_chat(-200, 5) is second
+	assert registry.get_by_chat(-200) is None
+	assert len(registry) == 2
+
+	# Конвертация группы в supergroup меняет ID группы.
+	registry.change_chat(-100, SimpleNamespace(id=-1000)) # type: ignore
+	assert registry.get_by_chat(-100) is None
+	assert registry.get_by_chat(-1000) is first
+	assert registry.get_by_service_dialogue(1, "VK", 2000000001) is first
+
+	registry.remove(first) # type: ignore
+	assert registry.get_by_chat(-1000) is None
+	assert registry.get_by_service_dialogue(1, "VK", 2000000001) is None
+	assert list(registry) == [second]
+
+	with pytest.raises(ValueError):
+		registry.remove(first) # type: ignore
+
+def test_subgroupRegistrySharedParent():
+	"""
+	`change_chat()` переносит все сервис-диалоги группы, даже если у них общий `parent`, как у топиков одной группы.
+	"""
+
+	parent = SimpleNamespace(creatorID=1, chat=SimpleNamespace(id=-100))
+	first = SimpleNamespace(id=1, service_chat_id=123, service=SimpleNamespace(service_name="VK"), parent=parent)
+	second = SimpleNamespace(id=2, service_chat_id=456, service=SimpleNamespace(service_name="VK"), parent=parent)
+
+	registry = TelehooperSubGroupRegistry()
+	registry.add(first) # type: ignore
+	registry.add(second) # type: ignore
+
+	registry.change_chat(-100, SimpleNamespace(id=-1000)) # type: ignore
+	assert parent.chat.id == -1000
+	assert registry.get_by_chat_id(-100) == []
+	assert registry.get_by_chat(-1000, 1) is first
+	assert registry.get_by_chat(-1000, 2) is second
+	assert len(registry) == 2
+	assert sorted(subgroup.id for subgroup in registry) == [1, 2]
+
+	registry.remove(second) # type: ignore
+	assert registry.get_by_chat_id(-1000) == [first]
+
+def test_removeGroupLimiters():
+	"""
+	`remove_group_limiters()` удаляет лимитеры лишь указанной группы (и, если указано, лишь указанного бота).
+	"""
+
+	from api import _group_limiters
+
+	for key in [(-100, 1), (-100, 2), (-200, 1)]:
+		_group_limiters[key] = object() # type: ignore
+
+	TelehooperAPI.remove_group_limiters(-100, 2)
+	assert (-100, 2) not in _group_limiters and (-100, 1) in _group_limiters
+
+	TelehooperAPI.remove_group_limiters(-100)
+	assert (-100, 1) not in _group_limiters
+	assert (-200, 1) in _group_limiters
+
+	TelehooperAPI.remove_group_limiters(-200)
+
+def test_queueWaitHistogram():
+	"""
+	`TelehooperAPI.record_queue_wait()` сохраняет время ожидания очереди в гистограмму.
+	"""
+
+	TelehooperAPI.record_queue_wait(-1, 0)
+	TelehooperAPI.record_queue_wait(-1, 0.7)
+	TelehooperAPI.record_queue_wait(-1, 1000)
+
+	histogram = TelehooperAPI.get_queue_wait_histogram(-1)
+	assert histogram[0] == 1
+	assert histogram[2] == 1
+	assert histogram[-1] == 1
+	assert sum(TelehooperAPI.get_queue_wait_histogram()) >= 3
+	assert sum(TelehooperAPI.get_queue_wait_histogram(-2)) == 0
+
+def test_cacheDocument():
+	"""
+	`cache_document()` добавляет в кэш документов документ, загруженный в обход кэша, не заменяя уже закэшированную копию.
+	"""
+
+	database = SimpleNamespace()
+	doc = Document(database, "user_test_cache", data={"ID": 1, "_rev": "1-a"}) # type: ignore
+
+	cached = cache_document(doc)
+	assert cached["ID"] == 1
+	assert cached.rev == "1-a"
+
+	# Повторное добавление возвращает ту же копию из кэша.
+	assert cache_document(Document(database, "user_test_cache", data={"ID": 2})) is cached # type: ignore
+
+	invalidate_document("user_test_cache")
+
+def test_flushQueue(monkeypatch):
+	"""
+	`_flush_queue()` не создаёт пустых документов при удалении несуществующих записей и возвращает в очередь записи, которые БД не приняла.
+	"""
+
+	class FakeDatabase:
+		def __init__(self) -> None:
+			self.written: list[dict] = []
+
+		async def docs(self, ids: list[str], create: bool = False):
+			for doc_id in ids:
+				yield Document(self, doc_id, data={"_rev": "1-a"} if doc_id.startswith("existing") else None) # type: ignore
+
+		async def _bulk_docs(self, docs: list[dict]) -> list[dict]:
+			self.written.extend(docs)
+
+			return [{"id": doc["_id"], "error": "conflict"} if doc["_id"] == "new_conflict" else {"id": doc["_id"], "ok": True, "rev": "2-b"} for doc in docs]
+
+	database = FakeDatabase()
+
+	async def get_db():
+		return database
+
+	monkeypatch.setattr("api.get_db", get_db)
+
+	pending = {
+		"existing_deleted": None,
+		"missing_deleted": None,
+		"new_saved": 1,
+		"new_conflict": 2
+	}
+
+	assert not asyncio.run(TelehooperAPI._flush_queue(pending, lambda value: {"Value": value}, "тестовых записей"))
+
+	assert sorted(doc["_id"] for doc in database.written) == ["existing_deleted", "new_conflict", "new_saved"]
+	assert next(doc for doc in database.written if doc["_id"] == "existing_deleted")["_deleted"]
+	assert pending == {"new_conflict": 2}
+
+def test_findMessageMappingByViewKey(monkeypatch):
+	"""
+	`find_message_mapping()` ищет связь ID сообщений по ключу view, не перебирая все связи пользователя.
+	"""
+
+	requests = []
+
+	class FakeRemote:
+		async def _get(self, path: str, params: dict | None = None):
+			requests.append((path, params))
+
+			return None, {"offset": 0, "total_rows": 1, "rows": [{"id": "msgmap_VK_1_10", "key": json.loads(params["key"]), "value": None, "doc": {"_id": "msgmap_VK_1_10", "_rev": "1-a", "ServiceIDs": [10]}}]} # type: ignore
+
+	database = SimpleNamespace(endpoint="/telehooper", _remote=FakeRemote())
+
+	async def get_db():
+		return database
+
+	monkeypatch.setattr("DB.get_db", get_db)
+
+	doc = asyncio.run(find_message_mapping("VK", 1, "ServiceIDs", 10))
+
+	assert doc is not None and doc.id == "msgmap_VK_1_10"
+	assert requests[0][0] == "/telehooper/_design/msgmap-ids/_view/by-id"
+	assert json.loads(requests[0][1]["key"]) == ["VK", 1, "ServiceIDs", 10]
+	assert requests[0][1]["include_docs"] and requests[0][1]["limit"] == 1
@@ -0,0 +1,63 @@
+# coding: utf-8
+
+import sys
+import timeit
+
+from loguru import logger
+
+import logger as telehooper_logger
+from logger import debug_lazy, truncate
+
+
+RESPONSE = {
+	"response": {
+		"count": 200,
+		"items": [{"conversation": {"peer": {"id": 2000000000 + index, "type": "chat"}, "chat_settings": {"title": f"Беседа #{index}", "members_count": 50}}, "last_message": {"id": index, "text": "Привет! " * 20}} for index in range(200)],
+		"profiles": [{"id": index, "first_name": "Имя", "last_name": "Фамилия", "photo_100": "https://sun1-1.userapi.com/photo.jpg"} for index in range(200)]
+	}
+}
+"""Ответ, по размеру похожий на ответ `messages.getConversations` с 200 диалогами."""
+
+def test_truncate():
+	"""
+	`truncate()` обрезает длинные значения, указывая количество обрезанных символов.
+	"""
+
+	assert truncate("short", 10) == "short"
+	assert truncate("a" * 15, 10) == "aaaaaaaaaa... (+5 символов)"
+
+def test_debugLazyBenchmark():
+	"""
+	Сравнивает время вызова `logger.debug(f"...")` и `debug_lazy()` с большим ответом API на уровне логирования INFO. Результаты видны при запуске `pytest -s`.
+	"""
+
+	evaluated = []
+
+	def _response() -> dict:
+		evaluated.append(True)
+
+		return RESPONSE
+
+	def _fstring():
+		logger.debug(f"[VK] messages.getConversations response: {RESPONSE}")
+
+	def _lazy():
+		debug_lazy("[VK] {} response: {}", lambda: "messages.getConversations", _response)
+
+	logger.remove()
+	handler_id = logger.add(lambda _: None, level="INFO")
+	telehooper_logger.set_debug_enabled(False)
+
+	try:
+		runs = 200
+
+		fstring_time = min(timeit.repeat(_fstring, number=runs, repeat=3)) / runs
+		lazy_time = min(timeit.repeat(_lazy, number=runs, repeat=3)) / runs
+
+		assert not evaluated
+	finally:
+		logger.remove(handler_id)
+		logger.add(sys.stderr)
+		telehooper_logger.set_debug_enabled(True)
+
+	print(f"\nDebug-логирование на уровне INFO: {fstring_time * 1_000_000:.1f} мкс с f-строкой, {lazy_time * 1_000_000:.2f} мкс с debug_lazy().")
@@ -0,0 +1,40 @@
+# coding: utf-8
+
+import timeit
+
+import utils
+
+
+def test_fernetKeyCacheBenchmark():
+	"""
+	Замеряет время расшифровки одной строки с кэшированием объекта Fernet и без него. Результаты видны при запуске `pytest -s`.
+	"""
+
+	key = "sticker_AgADBAADr7cxG"
+	encrypted = utils.encrypt_with_key("CAACAgIAAxkBAAEBmZ5lY", key)
+	runs = 2000
+
+	def _uncached():
+		return utils.get_fernet.__wrapped__(key).decrypt(encrypted.encode()).decode()
+
+	def _cached():
+		return utils.decrypt_with_key(encrypted, key)
+
+	assert _uncached() == _cached()
+
+	uncached_time = min(timeit.repeat(_uncached, number=runs, repeat=3)) / runs
+	cached_time = min(timeit.repeat(_cached, number=runs, repeat=3)) / runs
+
+	print(f"\nFernet decrypt: {uncached_time * 1_000_000:.1f} мкс без кэша, {cached_time * 1_000_000:.1f} мкс с кэшем.")
+
+def test_decryptManyWithCachedFernet():
+	"""
+	Один закэшированный объект Fernet расшифровывает список строк, зашифрованных `encrypt_with_key()`.
+	"""
+
+	key = "mypassword"
+	inputs = ["Hello", "World", ""]
+
+	fernet = utils.get_fernet(key)
+	assert fernet is utils.get_fernet(key)
+	assert [fernet.decrypt(utils.encrypt_with_key(i, key).encode()).decode() for i in inputs] == inputs
@@ -0,0 +1,94 @@
+# coding: utf-8
+
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+from pydantic import SecretStr
+
+from services.vk.vk_api import api as vk_api
+from services.vk.vk_api.api import VKAPI
+from services.vk.vk_api.scheduler import VKRequestScheduler
+
+
+async def _start_stub_server() -> tuple[web.AppRunner, str]:
+	"""
+	Запускает локальный HTTP-сервер, который отвечает на любой метод API так же, как и ВКонтакте.
+	"""
+
+	async def _handler(request: web.Request) -> web.Response:
+		return web.json_response({"response": {"method": request.match_info["method"]}})
+
+	app = web.Application()
+	app.router.add_route("*", "/method/{method}", _handler)
+
+	runner = web.AppRunner(app)
+	await runner.setup()
+
+	site = web.TCPSite(runner, "127.0.0.1", 0)
+	await site.start()
+
+	port = site._server.sockets[0].getsockname()[1] # type: ignore
+
+	return runner, f"http://127.0.0.1:{port}/method"
+
+def test_sharedSessionReused():
+	"""
+	Все объекты `VKAPI` используют одну и ту же сессию, а `close_session()` её закрывает.
+	"""
+
+	async def _test():
+		runner, url = await _start_stub_server()
+
+		try:
+			first = VKAPI(SecretStr("token1"))
+			second = VKAPI(SecretStr("token2"))
+			first.api_url = second.api_url = url
+
+			assert (await first._post_("users.get"))["method"] == "users.get"
+			session = vk_api.get_session()
+			assert (await second._get_("messages.getById"))["method"] == "messages.getById"
+			assert vk_api.get_session() is session
+
+			await vk_api.close_session()
+			assert session.closed
+		finally:
+			await runner.cleanup()
+
+	asyncio.run(_test())
+
+def test_sharedSessionBenchmark():
+	"""
+	Сравнивает количество запросов в секунду к локальному серверу при создании сессии на каждый запрос и при использовании общей сессии. Результаты видны при запуске `pytest -s`.
+	"""
+
+	runs = 300
+
+	async def _test():
+		runner, url = await _start_stub_server()
+
+		try:
+			vkAPI = VKAPI(SecretStr("token"))
+			vkAPI.api_url = url
+			vkAPI.scheduler = VKRequestScheduler(rate=1_000_000)
+
+			start = time.perf_counter()
+			for _ in range(runs):
+				async with aiohttp.ClientSession() as session:
+					async with session.post(f"{url}/users.get", params={"access_token": "token", "v": vkAPI.version}) as response:
+						vkAPI._parse_response(await response.json(), "users.get")
+			per_call_time = time.perf_counter() - start
+
+			start = time.perf_counter()
+			for _ in range(runs):
+				await vkAPI._post_("users.get")
+			shared_time = time.perf_counter() - start
+
+			await vk_api.close_session()
+		finally:
+			await runner.cleanup()
+
+		print(f"\nVKAPI: {runs / per_call_time:.0f} запросов/с с сессией на каждый запрос, {runs / shared_time:.0f} запросов/с с общей сессией.")
+
+	asyncio.run(_test())
@@ -0,0 +1,197 @@
+# coding: utf-8
+
+import asyncio
+
+import pytest
+from pydantic import SecretStr
+
+from services.vk.exceptions import AccessDeniedException
+from services.vk.vk_api import api as vk_api
+from services.vk.vk_api import scheduler as scheduler_module
+from services.vk.vk_api.api import VKAPI
+from services.vk.vk_api.scheduler import (VKRequestPriority, VKRequestScheduler,
+                                          get_scheduler, get_schedulers,
+                                          remove_scheduler)
+
+
+def test_batchedCallsMergedIntoExecute():
+	"""
+	Вызовы, сделанные одновременно, объединяются в один `execute`, а результаты и ошибки раздаются вызвавшему их коду.
+	"""
+
+	requests = []
+
+	async def _post_raw_(method: str, params: dict | None = None, in_body: bool = False) -> dict:
+		requests.append((method, params))
+
+		return {
+			"response": [[{"id": 1}], False, 1],
+			"execute_errors": [{"method": "messages.getById", "error_code": 15, "error_msg": "Access denied"}]
+		}
+
+	async def _test():
+		vkAPI = VKAPI(SecretStr("token"))
+		vkAPI._post_raw_ = _post_raw_ # type: ignore
+
+		return await asyncio.gather(
+			vkAPI.users_get([1]),
+			vkAPI.messages_getById(123),
+			vkAPI.messages_markAsRead(1),
+			return_exceptions=True
+		)
+
+	users, message, read = asyncio.run(_test())
+
+	assert len(requests) == 1
+	assert requests[0][0] == "execute"
+	assert requests[0][1]["code"].startswith("return [API.users.get(")
+	assert users == [{"id": 1}]
+	assert isinstance(message, AccessDeniedException)
+	assert read == 1
+
+def test_batchedSingleCallNotWrapped():
+	"""
+	Одиночный вызов отправляется как есть, без `execute`.
+	"""
+
+	requests = []
+
+	async def _post_raw_(method: str, params: dict | None = None, in_body: bool = False) -> dict:
+		requests.append(method)
+
+		return {"response": 1}
+
+	async def _test():
+		vkAPI = VKAPI(SecretStr("token"))
+		vkAPI._post_raw_ = _post_raw_ # type: ignore
+
+		return await vkAPI.messages_markAsRead(1)
+
+	assert asyncio.run(_test()) == 1
+	assert requests == ["messages.markAsRead"]
+
+def test_batchedCallWithoutWindow(monkeypatch):
+	"""
+	Если других запросов не выполняется, то вызов отправляется сразу же, не дожидаясь `VK_API_BATCH_WINDOW`.
+	"""
+
+	monkeypatch.setattr(vk_api, "VK_API_BATCH_WINDOW", 10)
+
+	async def _post_raw_(method: str, params: dict | None = None, in_body: bool = False) -> dict:
+		return {"response": 1}
+
+	async def _test():
+		vkAPI = VKAPI(SecretStr("token"))
+		vkAPI._post_raw_ = _post_raw_ # type: ignore
+
+		return await asyncio.wait_for(vkAPI.messages_markAsRead(1), timeout=1)
+
+	assert asyncio.run(_test()) == 1
+
+def test_batchedRequestErrorPropagated():
+	"""
+	Ошибка всего запроса `execute` передаётся всем вызовам из группы.
+	"""
+
+	async def _post_raw_(method: str, params: dict | None = None, in_body: bool = False) -> dict:
+		raise ConnectionError
+
+	async def _test():
+		vkAPI = VKAPI(SecretStr("token"))
+		vkAPI._post_raw_ = _post_raw_ # type: ignore
+
+		await asyncio.gather(vkAPI.users_get([1]), vkAPI.users_get([2]))
+
+	with pytest.raises(ConnectionError):
+		asyncio.run(_test())
+
+def test_schedulerPriorityOrder():
+	"""
+	При заполненном bucket'е запросы с более высоким приоритетом получают место раньше.
+	"""
+
+	order = []
+
+	async def _test():
+		scheduler = VKRequestScheduler(rate=50)
+		scheduler.tokens = 0
+
+		async def _acquire(name: str, priority: VKRequestPriority):
+			await scheduler.acquire(priority)
+			order.append(name)
+
+		await asyncio.gather(
+			_acquire("typing", VKRequestPriority.LOW),
+			_acquire("read", VKRequestPriority.NORMAL),
+			_acquire("send", VKRequestPriority.HIGH)
+		)
+
+		assert scheduler.requests == 3
+		assert scheduler.queue_depth == 0
+		assert scheduler.max_wait > 0
+
+	asyncio.run(_test())
+
+	assert order == ["send", "read", "typing"]
+
+def test_schedulerAdaptsToRateLimit():
+	"""
+	Ошибка 6 замедляет планировщик, а успешные запросы постепенно его ускоряют.
+	"""
+
+	scheduler = VKRequestScheduler(rate=4, min_rate=1)
+
+	scheduler.on_rate_limited()
+	assert scheduler.rate == 2
+	assert scheduler.rate_limited == 1
+
+	scheduler.on_rate_limited()
+	scheduler.on_rate_limited()
+	assert scheduler.rate == 1
+
+	for _ in range(1000):
+		scheduler.on_success()
+	assert scheduler.rate == 4
+
+def test_tooManyRequestsRetried(monkeypatch):
+	"""
+	Запрос, получивший ошибку 6, повторяется.
+	"""
+
+	monkeypatch.setattr(vk_api, "VK_API_RATE_LIMIT_BACKOFF", 0.01)
+
+	responses = [
+		{"error": {"error_code": 6, "error_msg": "Too many requests per second"}},
+		{"response": 1}
+	]
+
+	async def _post_raw_(method: str, params: dict | None = None, in_body: bool = False) -> dict:
+		return responses.pop(0)
+
+	async def _test():
+		vkAPI = VKAPI(SecretStr("retry_token"))
+		vkAPI._post_raw_ = _post_raw_ # type: ignore
+
+		assert await vkAPI.messages_send(1, "Hello") == 1
+		assert vkAPI.scheduler.rate_limited == 1
+
+	asyncio.run(_test())
+	assert not responses
+
+def test_schedulerRegistry():
+	"""
+	Объекты `VKAPI` с одним токеном используют общий планировщик, который удаляется при отключении сервиса и не хранит сам токен.
+	"""
+
+	token = SecretStr("scheduler_registry_token")
+
+	scheduler = get_scheduler(token)
+	assert get_scheduler(SecretStr("scheduler_registry_token")) is scheduler
+	assert scheduler in get_schedulers()
+	assert token.get_secret_value() not in scheduler_module._schedulers
+
+	remove_scheduler(token)
+	assert scheduler not in get_schedulers()
+	assert get_scheduler(token) is not scheduler
+
+	remove_scheduler(token)
@@ -0,0 +1,70 @@
+# coding: utf-8
+
+import json
+import timeit
+
+import pytest
+
+from services.vk.vk_api import decoding
+from services.vk.vk_api.decoding import (JSON_DECODER_NAME, decode_json,
+                                         decode_longpoll_response)
+
+
+CONVERSATIONS_RESPONSE = json.dumps({
+	"response": {
+		"count": 200,
+		"items": [{"conversation": {"peer": {"id": 2000000000 + index, "type": "chat", "local_id": index}, "in_read": 100, "out_read": 100, "chat_settings": {"title": f"Беседа #{index}", "members_count": 50, "photo": {"photo_50": "https://sun1-1.userapi.com/photo.jpg"}}}, "last_message": {"id": index, "date": 1700000000, "from_id": 123456789, "text": "Привет! " * 20, "attachments": []}} for index in range(200)],
+		"profiles": [{"id": index, "first_name": "Имя", "last_name": "Фамилия", "sex": 2, "photo_100": "https://sun1-1.userapi.com/photo.jpg", "online": 1} for index in range(200)]
+	}
+}, ensure_ascii=False).encode()
+"""Ответ, по размеру и структуре похожий на ответ `messages.getConversations` с 200 диалогами."""
+
+LONGPOLL_RESPONSE = json.dumps({
+	"ts": 1871234567,
+	"pts": 10012345,
+	"updates": [[10004, 4821 + index, 532497, 0, 2000000042, 1700000000, "Привет! Как дела?", {"title": " ... ", "from": "123456789"}, {}, 0, 991234 + index, 0] for index in range(50)]
+}, ensure_ascii=False).encode()
+"""Ответ longpoll-сервера с 50 событиями новых сообщений."""
+
+def test_decodeLongpollResponse():
+	"""
+	`decode_longpoll_response()` декодирует ответ longpoll-сервера, в том числе ответы с ошибками.
+	"""
+
+	response = decode_longpoll_response(LONGPOLL_RESPONSE)
+	assert response["ts"] == 1871234567
+	assert response["pts"] == 10012345
+	assert len(response["updates"]) == 50
+
+	assert decode_longpoll_response(b'{"failed": 2}') == {"failed": 2}
+	assert decode_longpoll_response(b'{"failed": 4, "min_version": 0, "max_version": 19}')["failed"] == 4
+	assert decode_json(CONVERSATIONS_RESPONSE) == json.loads(CONVERSATIONS_RESPONSE)
+
+def test_decodeLongpollResponseMsgspec():
+	"""
+	Если установлен `msgspec`, то ответ с неожиданными типами полей (например, `ts` в виде строки) не проходит проверку типов, и декодируется без неё.
+	"""
+
+	msgspec = pytest.importorskip("msgspec")
+
+	assert decoding._longpoll_decoder is not None
+	assert decoding._longpoll_decoder.decode(LONGPOLL_RESPONSE)["ts"] == 1871234567
+
+	response = b'{"ts": "1871234567", "updates": []}'
+	with pytest.raises(msgspec.ValidationError):
+		decoding._longpoll_decoder.decode(response)
+
+	assert decode_longpoll_response(response) == {"ts": "1871234567", "updates": []}
+
+def test_decodingBenchmark():
+	"""
+	Сравнивает время декодирования ответов ВКонтакте стандартным `json` и `decode_json()`. Результаты видны при запуске `pytest -s`.
+	"""
+
+	runs = 200
+
+	for name, payload in [("getConversations", CONVERSATIONS_RESPONSE), ("longpoll", LONGPOLL_RESPONSE)]:
+		stdlib_time = min(timeit.repeat(lambda: json.loads(payload), number=runs, repeat=3)) / runs
+		decoder_time = min(timeit.repeat(lambda: decode_json(payload), number=runs, repeat=3)) / runs
+
+		print(f"\n{name} ({len(payload) // 1024} КБ): {stdlib_time * 1_000_000:.0f} мкс с json, {decoder_time * 1_000_000:.0f} мкс с {JSON_DECODER_NAME}.")
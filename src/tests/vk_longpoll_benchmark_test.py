@@ -0,0 +1,67 @@
+# coding: utf-8
+
+import asyncio
+import time
+
+from pydantic import SecretStr
+
+from services.vk.vk_api.api import VKAPI
+from services.vk.vk_api.longpoll import LongpollNewMessageEvent, VKAPILongpoll
+
+
+RECORDED_UPDATES = [
+	[10004, 4821, 532497, 0, 2000000042, 1700000000, "Привет! Как дела?", {"title": " ... ", "from": "123456789", "emoji": "1"}, {}, 0, 991234, 0],
+	[10004, 4822, 3, 0, 123456789, 1700000001, "", {"title": " ... "}, {"attach1_type": "photo", "attach1": "123456789_457239017"}, 0, 991235, 0],
+	[10004, 4823, 532481, 0, 2000000042, 1700000002, "", {"from": "987654321", "source_act": "chat_invite_user", "source_mid": "111111111"}, {}, 0, 991236, 0],
+	[10005, 532481, 0, 2000000042, 1700000003, "Привет! Как дела? (ред.)", {"from": "123456789", "keyboard": {"buttons": []}}, {}, 0, 991234, 1700000010],
+	[10002, 4821, 1, 2000000042],
+	[63, 2000000042, [123456789, 987654321], 2, 1700000004],
+	[64, 123456789, [123456789], 1, 1700000005],
+	[10004, 4824, 2],
+	[80, 15, 0]
+]
+"""Пачка longpoll-событий разных типов в том виде, в котором их отдаёт longpoll-сервер ВКонтакте."""
+
+def test_longpollDecodingBenchmark():
+	"""
+	Прогоняет записанную пачку longpoll-событий через `listen_for_updates()`, замеряя количество обрабатываемых событий в секунду. Результаты видны при запуске `pytest -s`.
+	"""
+
+	batches = 2000
+
+	longpoll = VKAPILongpoll(VKAPI(SecretStr("token")))
+	remaining = batches
+
+	async def get_longpoll_server() -> dict:
+		return {"server": "im.vk.com/nim1", "key": "key", "ts": 1}
+
+	async def get_longpoll_event(server: dict) -> dict:
+		nonlocal remaining
+
+		remaining -= 1
+		if remaining <= 0:
+			longpoll.stop()
+
+		return {"ts": server["ts"] + 1, "updates": RECORDED_UPDATES}
+
+	longpoll.get_longpoll_server = get_longpoll_server # type: ignore
+	longpoll.get_longpoll_event = get_longpoll_event # type: ignore
+
+	async def _test() -> tuple[int, float]:
+		events = 0
+
+		start = time.perf_counter()
+		async for event in longpoll.listen_for_updates():
+			if type(event) is LongpollNewMessageEvent:
+				assert event.flags.outbox is not None
+
+			events += 1
+
+		return events, time.perf_counter() - start
+
+	events, elapsed = asyncio.run(_test())
+
+	# Неизвестное событие (80) и неполное событие нового сообщения пропускаются.
+	assert events == batches * (len(RECORDED_UPDATES) - 2)
+
+	print(f"\nLongpoll: {events / elapsed:.0f} событий/с.")
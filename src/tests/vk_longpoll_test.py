@@ -0,0 +1,309 @@
+# coding: utf-8
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pydantic import SecretStr
+
+from services.vk.vk_api.api import VKAPI
+from services.vk.vk_api.longpoll import (BaseVKLongpollEvent,
+                                         LongpollEventDispatcher,
+                                         LongpollNewMessageEvent, VKAPILongpoll)
+
+
+def test_eventDecoding():
+	"""
+	`get_event_type()` выдаёт нужный класс события, а редко используемые поля извлекаются при обращении к ним.
+	"""
+
+	event = BaseVKLongpollEvent.get_event_type([10004, 10, 3, 0, 2000000001, 1700000000, "text", {"from": "5", "source_act": "chat_kick_user", "source_mid": "7"}, {}, 0, 99, 0])
+
+	assert type(event) is LongpollNewMessageEvent
+	assert event.from_id == 5
+	assert event.flags.unread and event.flags.outbox
+	assert event.source_act == "chat_kick_user"
+	assert event.source_message_id == 7
+	assert event.source_chat_local_id is None
+	assert event.update_timestamp is None
+	assert not hasattr(event, "__dict__")
+
+	assert BaseVKLongpollEvent.get_event_type([10004, 10, 1700000000], raise_error=False) is None
+	with pytest.raises(ValueError):
+		BaseVKLongpollEvent.get_event_type([80, 15, 0])
+
+def _create_longpoll(responses: list[dict], requests: list[dict], servers: list[dict]) -> VKAPILongpoll:
+	"""
+	Создаёт longpoll, который вместо запросов к ВКонтакте возвращает ответы из `responses`, сохраняя переданные ему `server` в `requests`.
+	"""
+
+	longpoll = VKAPILongpoll(VKAPI(SecretStr("token")))
+
+	async def get_longpoll_server() -> dict:
+		server = {"server": "im.vk.com/nim1", "key": f"key{len(servers)}", "ts": 100 + len(servers)}
+		servers.append(server)
+
+		return dict(server)
+
+	async def get_longpoll_event(server: dict) -> dict:
+		requests.append(dict(server))
+
+		if not responses:
+			longpoll.stop()
+
+			return {"ts": server["ts"], "updates": []}
+
+		return responses.pop(0)
+
+	longpoll.get_longpoll_server = get_longpoll_server # type: ignore
+	longpoll.get_longpoll_event = get_longpoll_event # type: ignore
+
+	return longpoll
+
+def test_longpollFailedCodes():
+	"""
+	Longpoll обновляет лишь нужные поля при получении `failed` 1, 2 и 3.
+	"""
+
+	requests = []
+	servers = []
+	longpoll = _create_longpoll([
+		{"failed": 1, "ts": 200},
+		{"failed": 2},
+		{"ts": 201, "updates": []},
+		{"failed": 3}
+	], requests, servers)
+
+	async def _test():
+		return [event async for event in longpoll.listen_for_raw_updates()]
+
+	events = asyncio.run(_test())
+
+	assert requests[0] == {"server": "im.vk.com/nim1", "key": "key0", "ts": 100}
+	# failed 1: новый ts, тот же key.
+	assert requests[1]["key"] == "key0" and requests[1]["ts"] == 200
+	# failed 2: новый key, тот же ts.
+	assert requests[2]["key"] == "key1" and requests[2]["ts"] == 200
+	assert requests[3]["ts"] == 201
+	# failed 3: новые key и ts.
+	assert requests[4]["key"] == "key2" and requests[4]["ts"] == 102
+	assert events[0] == {"ts": 201, "updates": []}
+
+def test_longpollConnectionErrorKeepsServer():
+	"""
+	При единичной ошибке соединения longpoll переподключается к тому же серверу.
+	"""
+
+	requests = []
+	servers = []
+	longpoll = _create_longpoll([], requests, servers)
+	get_longpoll_event = longpoll.get_longpoll_event
+
+	async def _failing_get_longpoll_event(server: dict) -> dict:
+		if not requests:
+			requests.append(dict(server))
+
+			raise asyncio.TimeoutError
+
+		return await get_longpoll_event(server)
+
+	longpoll.get_longpoll_event = _failing_get_longpoll_event # type: ignore
+
+	async def _test():
+		return [event async for event in longpoll.listen_for_raw_updates()]
+
+	asyncio.run(_test())
+
+	assert len(servers) == 1
+	assert requests[0] == requests[1]
+
+def test_longpollSessionReused():
+	"""
+	Longpoll использует одну и ту же сессию между запросами и закрывает её при остановке.
+	"""
+
+	async def _test():
+		longpoll = VKAPILongpoll(VKAPI(SecretStr("token")))
+
+		session = longpoll._get_session()
+		assert longpoll._get_session() is session
+
+		await longpoll.close()
+		assert session.closed
+
+	asyncio.run(_test())
+
+def test_longpollResumesFromCheckpoint():
+	"""
+	Longpoll продолжает работу с сохранённого `ts`, а если он устарел, то получает пропущенные события через `messages.getLongPollHistory`.
+	"""
+
+	requests = []
+	servers = []
+	longpoll = _create_longpoll([
+		{"failed": 1, "ts": 300}
+	], requests, servers)
+	longpoll.checkpoint = (50, 7)
+
+	history_requests = []
+
+	async def messages_getLongPollHistory(ts: int, pts: int, lp_version: int | None = None) -> dict:
+		history_requests.append((ts, pts))
+
+		return {"history": [[10002, 1, 0, 1]], "new_pts": pts + 1, "more": len(history_requests) < 2}
+
+	longpoll.api.messages_getLongPollHistory = messages_getLongPollHistory # type: ignore
+
+	async def _test():
+		return [event async for event in longpoll.listen_for_raw_updates()]
+
+	events = asyncio.run(_test())
+
+	assert requests[0]["ts"] == 50
+	assert history_requests == [(50, 7), (50, 8)]
+	# Новая позиция передаётся лишь с последней пачкой событий истории.
+	assert [(event["ts"], event["pts"]) for event in events[:2]] == [(50, 7), (300, 9)]
+	assert requests[1]["ts"] == 300
+
+def test_longpollHistoryMessages():
+	"""
+	Укороченные события новых сообщений из `messages.getLongPollHistory` дополняются сообщениями из поля `messages`, поэтому пропущенные во время перезапуска бота сообщения не теряются.
+	"""
+
+	longpoll = _create_longpoll([], [], [])
+
+	async def messages_getLongPollHistory(ts: int, pts: int, lp_version: int | None = None) -> dict:
+		return {
+			"history": [
+				[10004, 55, 3, 2000000001],
+				[10004, 56, 1, 123],
+				[10002, 40, 128, 123]
+			],
+			"messages": {
+				"count": 1,
+				"items": [{
+					"id": 991234,
+					"conversation_message_id": 55,
+					"peer_id": 2000000001,
+					"from_id": 5,
+					"date": 1700000000,
+					"text": "Привет!",
+					"random_id": 0,
+					"attachments": [{"type": "photo", "photo": {}}],
+					"reply_message": {"conversation_message_id": 50},
+					"action": {"type": "chat_kick_user", "member_id": 7}
+				}]
+			},
+			"new_pts": pts + 3
+		}
+
+	longpoll.api.messages_getLongPollHistory = messages_getLongPollHistory # type: ignore
+
+	async def _test():
+		return [page async for page in longpoll.get_longpoll_history(50, 7)]
+
+	pages = asyncio.run(_test())
+	assert len(pages) == 1 and pages[0]["pts"] == 10 and not pages[0]["more"]
+
+	event = BaseVKLongpollEvent.get_event_type(pages[0]["updates"][0])
+	assert type(event) is LongpollNewMessageEvent
+	assert event.message_id == 991234
+	assert event.conversation_message_id == 55
+	assert event.peer_id == 2000000001
+	assert event.from_id == 5
+	assert event.text == "Привет!"
+	assert event.flags.unread and event.flags.outbox
+	assert event.source_act == "chat_kick_user"
+	assert event.source_message_id == 7
+	assert event.attachments["attach1_type"] == "photo"
+	assert "reply" in event.attachments
+
+	# Сообщение, которое не было получено (к примеру, удалённое), остаётся укороченным событием.
+	assert pages[0]["updates"][1] == [10004, 56, 1, 123]
+	assert BaseVKLongpollEvent.get_event_type(pages[0]["updates"][1], raise_error=False) is None
+	assert pages[0]["updates"][2] == [10002, 40, 128, 123]
+
+def test_dispatcherAcknowledgesProcessedPositions():
+	"""
+	Позиция longpoll'а подтверждается лишь после обработки всех событий, переданных до неё.
+	"""
+
+	acknowledged = []
+
+	async def _handler(event: SimpleNamespace) -> None:
+		await asyncio.sleep(event.delay)
+
+	async def _test():
+		dispatcher = LongpollEventDispatcher(_handler) # type: ignore
+		dispatcher.on_acknowledge = lambda ts, pts: acknowledged.append((ts, pts))
+
+		await dispatcher.dispatch(SimpleNamespace(peer_id=1, delay=0.1)) # type: ignore
+		dispatcher.mark(1, 10)
+		await dispatcher.dispatch(SimpleNamespace(peer_id=2, delay=0)) # type: ignore
+		dispatcher.mark(2, 11)
+
+		await asyncio.sleep(0.05)
+		assert acknowledged == []
+
+		await dispatcher.join()
+
+		assert dispatcher.acknowledged_position == (2, 11)
+
+	asyncio.run(_test())
+
+	assert acknowledged == [(2, 11)]
+
+def test_dispatcherOrderPerPeer():
+	"""
+	События одного чата обрабатываются по порядку, а медленное событие не задерживает события других чатов.
+	"""
+
+	handled = []
+
+	async def _handler(event: SimpleNamespace) -> None:
+		if event.slow:
+			await asyncio.sleep(0.1)
+
+		handled.append((event.peer_id, event.index))
+
+	async def _test():
+		dispatcher = LongpollEventDispatcher(_handler) # type: ignore
+
+		await dispatcher.dispatch(SimpleNamespace(peer_id=1, index=0, slow=True)) # type: ignore
+		await dispatcher.dispatch(SimpleNamespace(peer_id=1, index=1, slow=False)) # type: ignore
+		await dispatcher.dispatch(SimpleNamespace(peer_id=2, index=0, slow=False)) # type: ignore
+
+		await dispatcher.join()
+
+		assert dispatcher.processed == 3
+		assert dispatcher.pending == 0
+		assert dispatcher.max_lag >= 0.1
+
+	asyncio.run(_test())
+
+	assert handled == [(2, 0), (1, 0), (1, 1)]
+
+def test_dispatcherBackpressure():
+	"""
+	`dispatch()` ожидает, если в очередях накопилось `max_pending` событий, а ошибка обработчика выбрасывается при следующем вызове.
+	"""
+
+	async def _handler(event: SimpleNamespace) -> None:
+		await asyncio.sleep(0.05)
+
+		if event.fail:
+			raise ValueError
+
+	async def _test():
+		dispatcher = LongpollEventDispatcher(_handler, max_workers=2, max_pending=2) # type: ignore
+
+		await dispatcher.dispatch(SimpleNamespace(peer_id=1, fail=True)) # type: ignore
+		await dispatcher.dispatch(SimpleNamespace(peer_id=2, fail=False)) # type: ignore
+		assert dispatcher.pending == 2
+
+		with pytest.raises(ValueError):
+			await dispatcher.dispatch(SimpleNamespace(peer_id=3, fail=False)) # type: ignore
+
+		await dispatcher.join()
+
+	asyncio.run(_test())
@@ -0,0 +1,374 @@
+# coding: utf-8
+
+import asyncio
+import os
+import time
+import tracemalloc
+
+from aiohttp import web
+
+from services.vk.consts import VK_MEDIA_CONNECTIONS_LIMIT
+from services.vk.media import (AttachmentsPrepareStats, MediaSpool,
+                               StreamingInputFile, TelegramFileCache,
+                               close_media_session,
+                               get_attachments_prepare_stats,
+                               get_media_session, probe_video_sizes,
+                               record_attachments_prepare_time,
+                               select_video_quality)
+from services.vk.vk_api import api as vk_api
+
+
+CHUNK = os.urandom(64 * 1024)
+"""Часть файла, которую отдаёт локальный сервер."""
+FILE_CHUNKS = 256
+"""Количество частей в файле. Размер файла: 16 МБ."""
+
+async def _start_file_server(hits: list[str]) -> tuple[web.AppRunner, str]:
+	"""
+	Запускает локальный HTTP-сервер, который по частям отдаёт файл размером `FILE_CHUNKS` * `len(CHUNK)` байт.
+	"""
+
+	async def _handler(request: web.Request) -> web.StreamResponse:
+		hits.append(request.method)
+
+		response = web.StreamResponse(headers={"Content-Length": str(FILE_CHUNKS * len(CHUNK))})
+		await response.prepare(request)
+
+		for _ in range(FILE_CHUNKS):
+			await response.write(CHUNK)
+
+		return response
+
+	app = web.Application()
+	app.router.add_get("/video.mp4", _handler)
+
+	runner = web.AppRunner(app)
+	await runner.setup()
+
+	site = web.TCPSite(runner, "127.0.0.1", 0)
+	await site.start()
+
+	port = site._server.sockets[0].getsockname()[1] # type: ignore
+
+	return runner, f"http://127.0.0.1:{port}/video.mp4"
+
+def test_streamingFileMemoryBound(tmp_path):
+	"""
+	`StreamingInputFile` передаёт файл частями не больше `chunk_size`, не держа его целиком в памяти, а при повторной передаче читает его из спула.
+	"""
+
+	chunk_size = 64 * 1024
+	hits = []
+
+	async def _test():
+		runner, url = await _start_file_server(hits)
+		spool = MediaSpool(directory=str(tmp_path))
+
+		try:
+			file = StreamingInputFile(url, filename="video.mp4", chunk_size=chunk_size, spool=spool)
+			assert await file.open() == FILE_CHUNKS * len(CHUNK)
+
+			tracemalloc.start()
+			try:
+				total = 0
+				max_chunk = 0
+				async for chunk in file.read(None): # type: ignore
+					total += len(chunk)
+					max_chunk = max(max_chunk, len(chunk))
+
+				_, peak = tracemalloc.get_traced_memory()
+			finally:
+				tracemalloc.stop()
+
+			assert total == FILE_CHUNKS * len(CHUNK)
+			assert max_chunk <= chunk_size
+			# Файл весит 16 МБ, однако потребление памяти не зависит от размера файла: в памяти находятся лишь буферы соединения и несколько частей.
+			assert peak < 32 * chunk_size, f"Пиковое потребление памяти: {peak} байт"
+
+			# Повторная передача читает копию файла из спула.
+			spool_path = file.spool_path
+			assert spool_path and os.path.getsize(spool_path) == total
+
+			replayed = b"".join([chunk async for chunk in file.read(None)]) # type: ignore
+			assert replayed == CHUNK * FILE_CHUNKS
+			assert hits == ["GET"]
+
+			await file.close()
+			assert file.spool_path is None
+
+			# Копия остаётся в спуле, и другой файл с тем же URL не загружается заново.
+			other_file = StreamingInputFile(url, filename="video.mp4", spool=spool)
+			assert await other_file.open() == total
+			assert b"".join([chunk async for chunk in other_file.read(None)]) == replayed # type: ignore
+			assert hits == ["GET"]
+
+			await other_file.close()
+
+			spool.clear()
+			assert not os.path.exists(spool_path)
+		finally:
+			await close_media_session()
+			await runner.cleanup()
+
+	asyncio.run(_test())
+
+def test_streamingFileInterrupted(tmp_path):
+	"""
+	Если передача файла была прервана (например, из-за таймаута Telegram), то файл догружается в спул, и повторная передача не загружает его с серверов ВКонтакте заново.
+	"""
+
+	hits = []
+
+	async def _test():
+		runner, url = await _start_file_server(hits)
+		spool = MediaSpool(directory=str(tmp_path))
+
+		try:
+			file = StreamingInputFile(url, filename="video.mp4", spool=spool)
+
+			# Генератор прерванной передачи не закрывается явно, как и при таймауте во время отправки.
+			reader = file.read(None) # type: ignore
+			await reader.__anext__()
+
+			assert b"".join([chunk async for chunk in file.read(None)]) == CHUNK * FILE_CHUNKS # type: ignore
+			assert hits == ["GET"]
+
+			await file.close()
+			assert len(spool) == 1
+		finally:
+			await close_media_session()
+			await runner.cleanup()
+
+	asyncio.run(_test())
+
+def test_attachmentsPrepareStats():
+	"""
+	Время подготовки вложений учитывается в статистике, отображаемой в `/status`.
+	"""
+
+	stats = get_attachments_prepare_stats()
+	count, total, maximum = stats.count, stats.total, stats.max
+
+	record_attachments_prepare_time(0.5)
+	record_attachments_prepare_time(1.5)
+
+	assert stats.count == count + 2
+	assert stats.total == total + 2.0
+	assert stats.max == max(maximum, 1.5)
+
+	assert AttachmentsPrepareStats().average == 0.0
+
+def test_telegramFileCache():
+	"""
+	`TelegramFileCache` хранит `file_id` вложений отдельно для каждого бота, учитывая попадания и промахи.
+	"""
+
+	cache = TelegramFileCache(max_size=2, ttl=60)
+
+	assert cache.get(1, "photo1_1") is None
+
+	cache.save(1, "photo1_1", "file_id")
+	assert cache.get(1, "photo1_1") == "file_id"
+
+	# file_id действителен лишь для загрузившего файл бота.
+	assert cache.get(2, "photo1_1") is None
+
+	assert cache.hits == 1
+	assert cache.misses == 2
+	assert cache.hit_rate == 1 / 3
+
+	# Размер кэша ограничен.
+	cache.save(1, "photo1_2", "file_id_2")
+	cache.save(1, "photo1_3", "file_id_3")
+	assert len(cache) == 2
+
+	cache.delete(1, "photo1_3")
+	assert cache.get(1, "photo1_3") is None
+
+def test_telegramFileCacheTTL():
+	"""
+	`TelegramFileCache` забывает `file_id` по истечении времени хранения.
+	"""
+
+	cache = TelegramFileCache(max_size=10, ttl=0.05)
+	cache.save(1, "doc1_1", "file_id")
+
+	time.sleep(0.1)
+
+	assert cache.get(1, "doc1_1") is None
+
+def test_probeVideoSizes():
+	"""
+	`probe_video_sizes()` узнаёт размеры файлов через HEAD либо `Range: bytes=0-0`, не загружая файлы целиком, и кэширует результат для каждого видео.
+	"""
+
+	hits = []
+
+	async def _with_length(request: web.Request) -> web.Response:
+		hits.append(f"{request.method} with_length")
+
+		return web.Response(body=b"0" * 100)
+
+	async def _with_range(request: web.Request) -> web.Response:
+		hits.append(f"{request.method} with_range")
+
+		# HEAD-ответ без Content-Length, однако поддерживается Range.
+		if request.method == "HEAD":
+			return web.Response(status=405)
+
+		assert request.headers["Range"] == "bytes=0-0"
+
+		return web.Response(status=206, body=b"0", headers={"Content-Range": "bytes 0-0/200"})
+
+	async def _without_length(request: web.Request) -> web.Response:
+		hits.append(f"{request.method} without_length")
+
+		return web.Response(status=405)
+
+	async def _test():
+		app = web.Application()
+		app.router.add_get("/with_length", _with_length)
+		app.router.add_route("*", "/with_range", _with_range)
+		app.router.add_route("*", "/without_length", _without_length)
+
+		runner = web.AppRunner(app)
+		await runner.setup()
+
+		site = web.TCPSite(runner, "127.0.0.1", 0)
+		await site.start()
+
+		port = site._server.sockets[0].getsockname()[1] # type: ignore
+		urls = {name: f"http://127.0.0.1:{port}/{name}" for name in ["with_length", "with_range", "without_length"]}
+
+		try:
+			sizes = await probe_video_sizes("video1_probe", urls)
+			assert sizes == {"with_length": 100, "with_range": 200, "without_length": None}
+			assert "GET with_length" not in hits
+
+			# Повторная проверка того же видео берётся из кэша, кроме неудачных проверок.
+			hits.clear()
+			assert await probe_video_sizes("video1_probe", urls) == sizes
+			assert hits == ["HEAD without_length", "GET without_length"]
+		finally:
+			await close_media_session()
+			await runner.cleanup()
+
+	asyncio.run(_test())
+
+def test_selectVideoQuality():
+	"""
+	`select_video_quality()` выбирает лучшее качество, не превышающее лимит, а если размеры неизвестны — худшее из качеств с неизвестным размером.
+	"""
+
+	qualities = ["mp4_1080", "mp4_720", "mp4_480"]
+
+	assert select_video_quality(qualities, {"mp4_1080": 300, "mp4_720": 200, "mp4_480": 100}, 250) == "mp4_720"
+	assert select_video_quality(qualities, {"mp4_1080": 300, "mp4_720": 200, "mp4_480": 100}, 50) is None
+	assert select_video_quality(qualities, {"mp4_1080": None, "mp4_720": 200, "mp4_480": 100}, 250) == "mp4_720"
+	assert select_video_quality(qualities, {"mp4_1080": None, "mp4_720": None, "mp4_480": 300}, 250) == "mp4_720"
+
+def test_mediaSpoolEviction(tmp_path):
+	"""
+	`MediaSpool` удаляет давно не использованные файлы при превышении лимита, не трогая используемые.
+	"""
+
+	async def _write(spool: MediaSpool, key: str, size: int) -> str:
+		with open(spool.reserve(key), "wb") as file:
+			file.write(b"0" * size)
+
+		return spool.commit(key)
+
+	async def _test():
+		spool = MediaSpool(directory=str(tmp_path), max_size=250)
+
+		first = await _write(spool, "first", 100)
+		second = await _write(spool, "second", 100)
+		spool.release("first")
+		spool.release("second")
+
+		# Обращение к файлу помечает его как недавно использованный.
+		assert spool.acquire("first") == first
+		spool.release("first")
+
+		# Используемый файл не удаляется, даже если лимит превышен.
+		third = await _write(spool, "third", 100)
+		assert not os.path.exists(second)
+		assert os.path.exists(first) and os.path.exists(third)
+		assert spool.size == 200
+		assert spool.evicted == 1
+
+		fourth = await _write(spool, "fourth", 100)
+		assert not os.path.exists(first)
+		assert spool.size == 200
+
+		# Неудачная загрузка удаляется из спула.
+		spool.reserve("failed")
+		assert spool.acquire("failed") is None
+		spool.discard("failed")
+		assert not spool.is_reserved("failed")
+
+		spool.clear()
+		assert not os.path.exists(third) and not os.path.exists(fourth)
+		assert len(spool) == 0 and spool.size == 0
+
+	asyncio.run(_test())
+
+def test_mediaSpoolPrepareDirectory(tmp_path):
+	"""
+	`MediaSpool` удаляет из своей папки лишь оставшиеся после прошлого запуска файлы спула, не трогая чужие файлы.
+	"""
+
+	stale = tmp_path / ("a" * 64)
+	stale_part = tmp_path / ("b" * 64 + ".part")
+	foreign = tmp_path / "notes.txt"
+	for path in (stale, stale_part, foreign):
+		path.write_bytes(b"0")
+
+	spool = MediaSpool(directory=str(tmp_path))
+	spool.reserve("first")
+
+	assert not stale.exists() and not stale_part.exists()
+	assert foreign.exists()
+
+	spool.clear()
+
+def test_mediaSpoolMmap(tmp_path):
+	"""
+	`MediaSpool` читает файлы по частям как обычным чтением, так и через memory-mapping.
+	"""
+
+	async def _test():
+		for use_mmap in (False, True):
+			spool = MediaSpool(directory=str(tmp_path / str(use_mmap)), use_mmap=use_mmap)
+
+			with open(spool.reserve("file"), "wb") as file:
+				file.write(CHUNK)
+
+			path = spool.commit("file")
+
+			chunks = [chunk async for chunk in spool.read(path, 1000)]
+			assert b"".join(chunks) == CHUNK
+			assert max(len(chunk) for chunk in chunks) == 1000
+
+			spool.clear()
+
+	asyncio.run(_test())
+
+def test_mediaSession():
+	"""
+	Вложения загружаются через отдельную сессию со своим лимитом соединений, а не через общую сессию API ВКонтакте.
+	"""
+
+	async def _test():
+		try:
+			session = get_media_session()
+			assert get_media_session() is session
+			assert session is not vk_api.get_session()
+			assert session.connector.limit == VK_MEDIA_CONNECTIONS_LIMIT # type: ignore
+
+			await close_media_session()
+			assert session.closed
+		finally:
+			await vk_api.close_session()
+
+	asyncio.run(_test())
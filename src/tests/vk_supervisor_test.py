@@ -0,0 +1,90 @@
+# coding: utf-8
+
+import asyncio
+import time
+
+from pydantic import SecretStr
+
+from services.vk.vk_api.api import VKAPI
+from services.vk.vk_api.supervisor import (LongpollState, LongpollSupervisor,
+                                           SupervisedLongpoll)
+
+
+def test_supervisorStaggersStarts():
+	"""
+	Longpoll'ы запускаются не чаще, чем раз в `start_interval` секунд.
+	"""
+
+	started = []
+
+	async def _run(longpoll: SupervisedLongpoll) -> None:
+		started.append(time.monotonic())
+
+	async def _on_error(error: Exception, longpoll: SupervisedLongpoll) -> bool:
+		return True
+
+	async def _test():
+		supervisor = LongpollSupervisor(start_interval=0.05)
+
+		await asyncio.gather(*[supervisor.start(owner_id, _run, _on_error) for owner_id in range(3)])
+
+		assert supervisor.get_longpolls() == []
+
+	asyncio.run(_test())
+
+	assert started[2] - started[0] >= 0.09
+
+def test_supervisorRestartsAndFails():
+	"""
+	После ошибки longpoll перезапускается, а после `max_errors` ошибок остаётся в состоянии `FAILED`.
+	"""
+
+	errors = []
+
+	async def _run(longpoll: SupervisedLongpoll) -> None:
+		raise ValueError
+
+	async def _on_error(error: Exception, longpoll: SupervisedLongpoll) -> bool:
+		errors.append((longpoll.errors, longpoll.state))
+
+		return True
+
+	async def _test():
+		supervisor = LongpollSupervisor(start_interval=0, max_errors=3, backoff=0.01, backoff_max=0.01)
+
+		await supervisor.start(1, _run, _on_error)
+
+		counts = supervisor.get_state_counts()
+		assert counts[LongpollState.FAILED] == 1
+		assert counts[LongpollState.RUNNING] == 0
+		assert supervisor.get_longpolls()[0].restarts == 2
+
+	asyncio.run(_test())
+
+	assert errors == [(1, LongpollState.BACKING_OFF), (2, LongpollState.BACKING_OFF), (3, LongpollState.FAILED)]
+
+def test_supervisorSharedSession():
+	"""
+	Все longpoll'ы используют общую сессию supervisor'а, которую они не закрывают.
+	"""
+
+	async def _test():
+		supervisor = LongpollSupervisor()
+		longpoll = SupervisedLongpoll(1)
+
+		first = supervisor.create_longpoll(VKAPI(SecretStr("token1")), longpoll)
+		second = supervisor.create_longpoll(VKAPI(SecretStr("token2")), longpoll)
+
+		assert first._get_session() is second._get_session() is supervisor.get_session()
+
+		await first.close()
+		assert not supervisor.get_session().closed
+
+		# Longpoll считается работающим после получения первого ответа от longpoll-сервера.
+		assert first.on_position
+		first.on_position(1, None)
+		assert longpoll.state is LongpollState.RUNNING
+
+		await supervisor.close()
+
+	asyncio.run(_test())
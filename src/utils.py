@@ -2,6 +2,7 @@
 
 import asyncio
 import base64
+import functools
 import gzip
 import hashlib
 import io
@@ -111,18 +112,28 @@ def decrypt_with_env_key(input: str) -> str:
 	# Ключ шифрования есть, тогда расшифровываем:
 	return decrypt_with_key(input, config.token_encryption_key.get_secret_value() + os.environ.get("token_encryption_key2", ""))
 
-def encrypt_with_key(input: str, key: str) -> str:
+@functools.lru_cache(maxsize=1024)
+def get_fernet(key: str) -> Fernet:
 	"""
-	Шифрует строку `input` с ключём `key`.
+	Возвращает объект Fernet для ключа шифрования `key`. Объекты кэшируются, поэтому ключ не вычисляется заново при каждом шифровании/расшифровке.
 
-	:param input: Входная строка.
 	:param key: Ключ шифрования.
 	"""
 
 	hlib = hashlib.md5()
 	hlib.update(key.encode())
 
-	return Fernet(base64.urlsafe_b64encode(hlib.hexdigest().encode())).encrypt(input.encode()).decode()
+	return Fernet(base64.urlsafe_b64encode(hlib.hexdigest().encode()))
+
+def encrypt_with_key(input: str, key: str) -> str:
+	"""
+	Шифрует строку `input` с ключём `key`.
+
+	:param input: Входная строка.
+	:param key: Ключ шифрования.
+	"""
+
+	return get_fernet(key).encrypt(input.encode()).decode()
 
 def decrypt_with_key(input: str, key: str) -> str:
 	"""
@@ -132,10 +143,7 @@ def decrypt_with_key(input: str, key: str) -> str:
 	:param key: Ключ шифрования.
 	"""
 
-	hlib = hashlib.md5()
-	hlib.update(key.encode())
-
-	return Fernet(base64.urlsafe_b64encode(hlib.hexdigest().encode())).decrypt(input.encode()).decode()
+	return get_fernet(key).decrypt(input.encode()).decode()
 
 def md5_hash(input: str) -> str:
 	"""